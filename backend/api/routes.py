@@ -1,70 +1,388 @@
+import asyncio
 import logging
+import time
 from api.schemas import PaginatedURLInfo
+from api.schemas import URLBatchSubmit
 from api.schemas import URLInfo
 from api.schemas import URLSubmit
 from database import crud
+from database.enums import URLStatus
+from database.session import AsyncSessionLocal
+from database.session import get_session
 from fastapi import APIRouter
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi import Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from settings import HISTORY_MAX_PAGE_SIZE
+from settings import HOT_REFRESH_ENABLED
+from settings import IMAGE_PROXY_CACHE_MAX_AGE_SECONDS
 from settings import REDIS_CLIENT
+from settings import SCRAPE_STATUS_MAX_WAIT_SECONDS
+from settings import SCRAPE_STATUS_POLL_INTERVAL_SECONDS
+from settings import SUBMIT_BATCH_CONCURRENCY
+from settings import SUBMIT_SINGLE_FLIGHT_LOCK_TTL_SECONDS
+from settings import SUBMIT_SINGLE_FLIGHT_REDIS_ENABLED
+from settings import URL_CANONICAL_ALIASES_ENABLED
+from services.host_scheduler import interleave_by_host
+from services.host_scheduler import url_host
+from services.hot_urls import access_tracker
+from services.image_proxy import ImageProxyError
+from services.image_proxy import get_thumbnail
+from services.local_cache import local_cache
+from services.metrics import SUBMIT_BY_PATH
+from services.metrics import SUBMIT_CACHE_HIT
+from services.metrics import SUBMIT_DEFERRED
+from services.og_scraper import alias_get
+from services.og_scraper import alias_save
+from services.og_scraper import cache_get
+from services.og_scraper import cache_get_many
 from services.og_scraper import cache_save
+from services.og_scraper import fresh_seconds_left
+from services.og_scraper import is_retry_deferred
+from services.og_scraper import is_stale_servable
 from services.og_scraper import process_og_url_by_entry_id
+from services.og_scraper import process_og_url_entry
+from services.og_scraper import revalidate_in_background
+from services.scrape_queue import ScrapeQueueFull
+from services.scrape_queue import get_scrape_queue
+from services.single_flight import RedisSingleFlight
+from services.single_flight import SingleFlight
+from services.url_normalizer import normalize_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator
+from typing import List
 from typing import Optional
 
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+
+class SubmitOutcome(BaseModel):
+    """
+    Result of a coalesced submit, shared by every request waiting for it.
+    path is the SUBMIT_BY_PATH key each request observes its own latency under.
+    """
+    path: str
+    info: URLInfo
+
+
+# Coalesce concurrent submits of the same url, so a viral link is scraped once
+submit_flight = SingleFlight()
+submit_redis_flight = RedisSingleFlight(
+    REDIS_CLIENT,
+    prefix="submit",
+    lock_ttl=SUBMIT_SINGLE_FLIGHT_LOCK_TTL_SECONDS,
+    dumps=lambda outcome: outcome.model_dump_json(),
+    loads=SubmitOutcome.model_validate_json,
+)
+
 @router.post("/submit", response_model=URLInfo)
-async def submit_url(payload: URLSubmit):
+async def submit_url(payload: URLSubmit, response: Response, background: bool = False):
     """
     Response image_url for given url by scraping the og tag image attribute.
     Args:
-        input: URLSubmit
+        input:
+            URLSubmit
+            background: if True, queue the scrape and response the pending record with 202 right away,
+                poll GET /status/{id} for the result
+        output: URLInfo
+    """
+    start = time.perf_counter()
+    url = normalize_url(payload.url)
+    cached_info = await cache_get(url)
+    if not cached_info and URL_CANONICAL_ALIASES_ENABLED:
+        # An alias is served the record of its canonical url
+        canonical_url = await alias_get(url)
+        if canonical_url:
+            url = canonical_url
+            cached_info = await cache_get(url)
+    if HOT_REFRESH_ENABLED:
+        # Counted for the hot url refresher only, nothing drains the counts without it
+        access_tracker.record(url)
+
+    # CASE 1: Cache hit, the cached value is the URLInfo json, response it as is without any DB query.
+    # A failed record is cached too, so urls without og image are not scraped again yet
+    if cached_info:
+        logging.info(f"API - Submit - cache hit - url: {url}")
+        SUBMIT_CACHE_HIT.observe(time.perf_counter() - start)
+        return Response(content=cached_info, media_type="application/json")
+
+    # The coalesced flows open their own session: they outlive the request that started them
+    # when that client disconnects, while other requests still wait for the result.
+    if background:
+        info = await submit_flight.do(("background", url), lambda: enqueue_submit(url))
+        if info.status == URLStatus.PENDING.value:
+            response.status_code = 202
+        SUBMIT_DEFERRED.observe(time.perf_counter() - start)
+        return info
+
+    outcome = await submit_flight.do(url, lambda: coalesced_submit(url))
+    # Observed per request, so the requests that waited on a coalesced flow are measured too
+    SUBMIT_BY_PATH[outcome.path].observe(time.perf_counter() - start)
+    return outcome.info
+
+
+async def enqueue_submit(url: str) -> URLInfo:
+    """
+    Background submit flow on a cache miss: upsert the DB entry, then queue the scrape
+    Args:
+        input: url
         output: URLInfo
     """
-    url = payload.url
-    cached_image_url = await REDIS_CLIENT.get(url)
-
-    # CASE 1: Cache hit
-    if cached_image_url:
-        logging.info(f"API - Submit - cache hit - url: {url}, image_url: {cached_image_url}")
-        return await crud.get_url_entry_by_url(url)
-
-    # CASE 2: No cache — check if DB already has it
-    db_entry = await crud.get_url_entry_by_url(url)
-    if db_entry:
-        if db_entry.image_url:
-            logging.info(f"API - Submit - existing entry - no image_url - url: {url}, image_url: {db_entry.image_url}")
-            await cache_save(url, db_entry.image_url)
-            return db_entry
+    async with AsyncSessionLocal() as session:
+        return await enqueue_submit_in_session(session, url)
+
+
+async def upsert_following_alias(session: AsyncSession, url: str):
+    """
+    Get the DB entry of the url, creating it if new, or the entry of its canonical url if it is an alias.
+    The alias is saved to the cache again, its key may have expired.
+    """
+    db_entry = await crud.upsert_url_entry(session, url)
+    if db_entry.canonical_url:
+        await alias_save(url, db_entry.canonical_url)
+        db_entry = await crud.upsert_url_entry(session, db_entry.canonical_url)
+    return db_entry
+
+
+async def enqueue_submit_in_session(session: AsyncSession, url: str) -> URLInfo:
+    db_entry = await upsert_following_alias(session, url)
+    if db_entry.image_url and fresh_seconds_left(db_entry) > 0:
+        await cache_save(db_entry)
+        return URLInfo.model_validate(db_entry)
+    if is_retry_deferred(db_entry):
+        logging.info(f"API - Submit - retry deferred - url: {url}, next retry at: {db_entry.next_retry_at}")
+        return URLInfo.model_validate(db_entry)
+
+    # New, failed or stale, a stale entry is still returned while its revalidation is queued
+    try:
+        queued = await get_scrape_queue().put(db_entry.id)
+    except ScrapeQueueFull as e:
+        logging.warning(f"API - Submit - queue full - url: {url}")
+        raise HTTPException(status_code=503, detail=str(e))
+    logging.info(f"API - Submit - queued - url: {url}, id: {db_entry.id}, already queued: {not queued}")
+    return URLInfo.model_validate(db_entry)
+
+
+@router.post("/submit/batch")
+async def submit_batch(payload: URLBatchSubmit, session: AsyncSession = Depends(get_session)):
+    """
+    Submit many urls at once.
+    Cache lookups take one Redis MGET, DB lookups one SELECT and new urls one multi-row insert,
+    then the misses are scraped concurrently (up to SUBMIT_BATCH_CONCURRENCY at a time).
+    Args:
+        input: URLBatchSubmit
+        output: NDJSON stream, one URLInfo per line in completion order, so slow urls do not hold back fast ones
+    """
+    urls = list(dict.fromkeys(normalize_url(url) for url in payload.urls))
+    if HOT_REFRESH_ENABLED:
+        for url in urls:
+            access_tracker.record(url)
+    cached = await cache_get_many(urls)
+    ready = [value for value in cached.values() if value]
+    misses = [url for url, value in cached.items() if not value]
+
+    to_scrape = []
+    to_cache = []
+    entries = await crud.upsert_url_entries(session, misses)
+    canonical_urls = list(dict.fromkeys(entry.canonical_url for entry in entries if entry.canonical_url))
+    if canonical_urls:
+        # Aliases are served the record of their canonical url, with one more upsert
+        entries = [entry for entry in entries if not entry.canonical_url]
+        seen = {entry.id for entry in entries}
+        entries += [entry for entry in await crud.upsert_url_entries(session, canonical_urls) if entry.id not in seen]
+    for entry in entries:
+        if entry.image_url and fresh_seconds_left(entry) > 0:
+            ready.append(URLInfo.model_validate(entry).model_dump_json())
+            to_cache.append(entry)
+        elif entry.image_url and is_stale_servable(entry):
+            ready.append(URLInfo.model_validate(entry).model_dump_json())
+            revalidate_in_background(entry.url)
+        elif is_retry_deferred(entry):
+            ready.append(URLInfo.model_validate(entry).model_dump_json())
         else:
-            # retry processing and cache the value
-            logging.info(f"API - Submit - existing entry - has image_url - url: {url}, image_url: {db_entry.image_url}")
-            await process_og_url_by_entry_id(db_entry.id)
-            return await crud.get_url_entry_by_id(db_entry.id)
+            # New, failed or stale beyond the stale-while-revalidate window
+            to_scrape.append(entry)
+    await asyncio.gather(*(cache_save(entry) for entry in to_cache))
+
+    logging.info(f"API - Submit batch - urls: {len(urls)}, ready: {len(ready)}, to scrape: {len(to_scrape)}")
+    return StreamingResponse(stream_batch_results(ready, to_scrape), media_type="application/x-ndjson")
+
+
+async def stream_batch_results(ready: List[str], to_scrape: list) -> AsyncIterator[str]:
+    """
+    Yield the ready URLInfo json lines first, then each scraped entry as soon as it is done
+    """
+    for value in ready:
+        yield value + "\n"
+
+    semaphore = asyncio.Semaphore(SUBMIT_BATCH_CONCURRENCY)
+
+    # Each scrape has its own session, a session can not be shared by concurrent tasks
+    async def scrape(entry) -> str:
+        async with semaphore:
+            try:
+                entry = await process_og_url_by_entry_id(entry.id) or entry
+            except Exception as e:
+                logging.exception(f"API - Submit batch - url: {entry.url} error: {e}")
+        return URLInfo.model_validate(entry).model_dump_json()
+
+    # Started round-robin across hosts, so the batch slots are not all waiting on the biggest host
+    ordered = interleave_by_host(to_scrape, lambda entry: url_host(entry.url))
+    tasks = [asyncio.ensure_future(scrape(entry)) for entry in ordered]
+    for next_done in asyncio.as_completed(tasks):
+        yield await next_done + "\n"
 
-    # CASE 3: New URL — processing the url
-    db_entry = await crud.create_url_entry(url)
 
-    await process_og_url_by_entry_id(db_entry.id)
-    entry = await crud.get_url_entry_by_id(db_entry.id)
-    logging.info(f"API - Submit - create new entry - url: {url}, image_url: {entry.image_url}")
+@router.get("/status/{id}", response_model=URLInfo)
+async def get_status(id: int, wait: float = 0, session: AsyncSession = Depends(get_session)):
+    """
+    Get the processing status of a submitted url
+    Args:
+        Input:
+            id: URLRecord id
+            wait: long poll, seconds to wait for a pending record to finish (capped by settings)
+        Output:
+            URLInfo
+    """
+    entry = await crud.get_url_entry_by_id(session, id)
+    if entry is None:
+        raise HTTPException(status_code=404, detail=f"URL record {id} not found")
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + min(max(wait, 0), SCRAPE_STATUS_MAX_WAIT_SECONDS)
+    while entry.status == URLStatus.PENDING.value and loop.time() < deadline:
+        # Release the connection while waiting, and expire the entry so it is read again
+        await session.rollback()
+        await asyncio.sleep(SCRAPE_STATUS_POLL_INTERVAL_SECONDS)
+        entry = await crud.get_url_entry_by_id(session, id)
     return entry
 
 
+async def coalesced_submit(url: str) -> SubmitOutcome:
+    """
+    Run the uncached submit once per url across workers when the Redis lock is enabled,
+    otherwise once per url in this process.
+    """
+    if SUBMIT_SINGLE_FLIGHT_REDIS_ENABLED:
+        return await submit_redis_flight.do(url, lambda: process_submit(url))
+    return await process_submit(url)
+
+
+async def process_submit(url: str) -> SubmitOutcome:
+    """
+    Submit flow on a cache miss: upsert the DB entry, then scrape.
+    One DB session is shared by the whole flow, the row is never read again after the scrape.
+    Args:
+        input: url
+        output: SubmitOutcome, the URLInfo and the path taken
+    """
+    async with AsyncSessionLocal() as session:
+        return await process_submit_in_session(session, url)
+
+
+async def process_submit_in_session(session: AsyncSession, url: str) -> SubmitOutcome:
+    # CASE 2: No cache — get the DB entry, creating it if new, in one statement (two for an alias)
+    db_entry = await upsert_following_alias(session, url)
+    url = db_entry.url
+    if db_entry.image_url and fresh_seconds_left(db_entry) > 0:
+        logging.info(f"API - Submit - existing entry - has image_url - url: {url}, image_url: {db_entry.image_url}")
+        await cache_save(db_entry)
+        return SubmitOutcome(path="db_hit", info=URLInfo.model_validate(db_entry))
+    if db_entry.image_url and is_stale_servable(db_entry):
+        logging.info(f"API - Submit - existing entry - stale, revalidating in background - url: {url}")
+        revalidate_in_background(url)
+        return SubmitOutcome(path="stale", info=URLInfo.model_validate(db_entry))
+    if is_retry_deferred(db_entry):
+        logging.info(f"API - Submit - retry deferred - url: {url}, next retry at: {db_entry.next_retry_at}")
+        return SubmitOutcome(path="deferred", info=URLInfo.model_validate(db_entry))
+
+    # CASE 3: New URL, retry or revalidation of a stale entry — processing the url
+    entry = await process_og_url_entry(session, db_entry)
+    logging.info(f"API - Submit - processed entry - url: {url}, image_url: {entry.image_url}")
+    return SubmitOutcome(path="scrape", info=URLInfo.model_validate(entry))
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag: "*" or one of its comma separated tags,
+    compared weakly (a W/ prefix is ignored), as If-None-Match is
+    """
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    if "*" in tags:
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    return any((tag[2:] if tag.startswith("W/") else tag) == opaque for tag in tags)
+
+
+@router.get("/image/{id}")
+async def get_image(id: int, request: Request, session: AsyncSession = Depends(get_session)):
+    """
+    Thumbnail of the og image of a record, so clients do not hotlink full size images from the origins
+    Args:
+        Input:
+            id: URLRecord id
+        Output:
+            WebP thumbnail with a strong ETag, 304 if it matches If-None-Match,
+            404 if the record has no image, 502 if the image can not be fetched or resized
+    """
+    entry = await crud.get_url_entry_by_id(session, id)
+    if entry is None or not entry.image_url:
+        raise HTTPException(status_code=404, detail=f"No image for URL record {id}")
+    image_url = entry.image_url
+    # End the read transaction, so no DB connection is held during the image fetch
+    await session.commit()
+
+    try:
+        digest, thumbnail = await get_thumbnail(image_url)
+    except ImageProxyError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    etag = f'"{digest}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={IMAGE_PROXY_CACHE_MAX_AGE_SECONDS}"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=thumbnail, media_type="image/webp", headers=headers)
+
+
+@router.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Counters of the in-process cache in front of Redis for this worker
+    """
+    return local_cache.stats()
+
+
 @router.get("/history", response_model=PaginatedURLInfo)
-async def get_history(limit: int = 10, cursor: Optional[str] = None):
+async def get_history(
+    limit: int = Query(10, ge=1, le=HISTORY_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    status: Optional[URLStatus] = None,
+    session: AsyncSession = Depends(get_session),
+):
     """
-    Get all history records of the user url og tag queries
+    Get all history records of the user url og tag queries, newest first
     Args:
         Input:
             limit: size per page
-            cursor: id of the record as the cursor
+            cursor: opaque next_cursor of the previous page
+            status: only list records with this status
         Output:
             PaginatedURLInfo
     """
-    cursor = int(cursor) if cursor else None
-    entries, next_cursor = await crud.get_all_entries(limit=limit, cursor=cursor, is_desc_order=True)
-    return PaginatedURLInfo(
-        results=[URLInfo.from_orm(entry) for entry in entries],
-        next_cursor=next_cursor
-    )
+    try:
+        entries, next_cursor = await crud.get_all_entries(
+            session, limit=limit, cursor=cursor, is_desc_order=True, status=status.value if status else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # Validated once here and returned as json, FastAPI would validate the page a second time
+    page = PaginatedURLInfo.model_validate({"results": entries, "next_cursor": next_cursor}, from_attributes=True)
+    return Response(content=page.model_dump_json(), media_type="application/json")
@@ -1,7 +1,10 @@
+from datetime import datetime
 from database.enums import URLStatus
 from pydantic import BaseModel
 from pydantic import ConfigDict
+from pydantic import Field
 from pydantic import HttpUrl
+from settings import SUBMIT_BATCH_MAX_SIZE
 from typing import List
 from typing import Optional
 
@@ -10,17 +13,30 @@ class URLSubmit(BaseModel):
     url: str
 
 
+class URLBatchSubmit(BaseModel):
+    urls: List[str] = Field(min_length=1, max_length=SUBMIT_BATCH_MAX_SIZE)
+
+
 class URLInfo(BaseModel):
     id: int
     url: HttpUrl
     image_url: Optional[str]
     status: URLStatus
+    next_retry_at: Optional[datetime] = None
+    title: Optional[str] = None
+    description: Optional[str] = None
+    site_name: Optional[str] = None
+    image_width: Optional[int] = None
+    image_height: Optional[int] = None
+    image_type: Optional[str] = None
+    twitter_card: Optional[str] = None
+    icon_url: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True, use_enum_values=True)
 
 
 class PaginatedURLInfo(BaseModel):
     results: List[URLInfo]
-    next_cursor: Optional[int]
+    next_cursor: Optional[str]
 
     model_config = ConfigDict(from_attributes=True, use_enum_values=True)
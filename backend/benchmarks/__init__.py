@@ -0,0 +1,4 @@
+import os
+
+# The benchmarks scrape local stand-ins on the loopback address, which the scraper refuses by default
+os.environ.setdefault("SCRAPER_BLOCK_PRIVATE_ADDRESSES", "false")
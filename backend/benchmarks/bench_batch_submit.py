@@ -0,0 +1,56 @@
+"""
+Throughput of one POST /api/submit per url (before) vs POST /api/submit/batch (after),
+against a local stub origin answering each page after 50 ms, with sqlite and fakeredis stand-ins.
+Run from backend/: python -m benchmarks.bench_batch_submit
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("SCRAPER_MAX_CONNECTIONS_PER_HOST", "100")
+os.environ.setdefault("SCRAPER_HOST_RATE_PER_SECOND", "0")
+
+import asyncio
+import httpx
+import logging
+import time
+from api.routes import router
+from benchmarks.stand_ins import use_local_stand_ins
+from benchmarks.stub_origin import StubPage
+from benchmarks.stub_origin import StubOrigin
+from fastapi import FastAPI
+from services.http_client import close_http_client
+
+
+URLS = 200
+PAGE_DELAY_SECONDS = 0.05
+
+
+async def main():
+    logging.disable(logging.INFO)
+    engine = await use_local_stand_ins()
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+
+    pages = {f"/page{i}": StubPage(delay=PAGE_DELAY_SECONDS) for i in range(URLS * 2)}
+    async with StubOrigin(pages) as origin, \
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test", timeout=60) as client:
+        singles = [f"{origin.base_url}/page{i}" for i in range(URLS)]
+        start = time.perf_counter()
+        for url in singles:
+            response = await client.post("/api/submit", json={"url": url})
+            assert response.json()["image_url"]
+        before = URLS / (time.perf_counter() - start)
+
+        batch = [f"{origin.base_url}/page{i}" for i in range(URLS, URLS * 2)]
+        start = time.perf_counter()
+        response = await client.post("/api/submit/batch", json={"urls": batch})
+        assert len(response.text.splitlines()) == URLS
+        after = URLS / (time.perf_counter() - start)
+
+    print(f"single submits: {before:8.1f} urls/s")
+    print(f"batch submit:   {after:8.1f} urls/s")
+    await close_http_client()
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,70 @@
+"""
+Cache hit latency and DB query count: Redis GET + DB lookup (before) vs the URLInfo json served from Redis (after).
+Redis is fakeredis and the DB is an in-process sqlite, so this measures the work per hit, not network round trips.
+Run from backend/: python -m benchmarks.bench_cache_hit
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import asyncio
+import logging
+import time
+from api.schemas import URLInfo
+from benchmarks.stand_ins import use_local_stand_ins
+from database import crud
+from database import session as db_session
+from services import og_scraper
+from services.local_cache import local_cache
+from sqlalchemy import event
+
+
+ROWS = 10_000
+HITS = 5_000
+
+
+async def hit_before(url: str) -> str:
+    # The previous hit path: the cache held only the image_url, the record came from the DB
+    await og_scraper.REDIS_CLIENT.get(url)
+    async with db_session.AsyncSessionLocal() as session:
+        entry = await crud.get_url_entry_by_url(session, url)
+    return URLInfo.model_validate(entry).model_dump_json()
+
+
+async def hit_after(url: str) -> str:
+    return await og_scraper.cache_get(url)
+
+
+async def measure(hit, urls, queries) -> tuple:
+    queries.clear()
+    start = time.perf_counter()
+    for url in urls:
+        assert await hit(url)
+    elapsed = time.perf_counter() - start
+    return elapsed / len(urls) * 1_000_000, len(queries)
+
+
+async def main():
+    logging.disable(logging.INFO)
+    engine = await use_local_stand_ins()
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+
+    urls = [f"https://site{i}.com/article" for i in range(ROWS)]
+    async with db_session.AsyncSessionLocal() as session:
+        for entry in await crud.upsert_url_entries(session, urls):
+            entry.image_url, entry.status = entry.url + ".jpg", "success"
+            await og_scraper.REDIS_CLIENT.set(entry.url, entry.image_url)  # the old cache layout
+            await og_scraper.cache_save(entry)
+    local_cache.clear()  # measure the Redis tier, not the in-process one
+
+    hits = urls[:HITS]
+    before_us, before_queries = await measure(hit_before, hits, queries)
+    after_us, after_queries = await measure(hit_after, hits, queries)
+    print(f"{'':8} {'us/hit':>8} {'SQL statements':>15}")
+    print(f"{'before':8} {before_us:>8.1f} {before_queries:>15}")
+    print(f"{'after':8} {after_us:>8.1f} {after_queries:>15}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,111 @@
+"""
+History page latency at growing cursor depths on a seeded 1M-row sqlite DB:
+full ORM rows and URLInfo.from_orm on an id cursor (before) vs projected rows on a (created_at, id) keyset (after).
+Run from backend/: python -m benchmarks.bench_history (HISTORY_BENCH_ROWS to change the table size)
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import asyncio
+import logging
+import time
+import warnings
+from api.schemas import PaginatedURLInfo
+from api.schemas import URLInfo
+from benchmarks.stand_ins import use_local_stand_ins
+from database import crud
+from database import session as db_session
+from database.models import URLRecord
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import text
+
+
+ROWS = int(os.getenv("HISTORY_BENCH_ROWS", "1000000"))
+PAGE_SIZE = 20
+PAGES = 200
+DEPTHS = (0.0, 0.1, 0.5, 0.99)
+STATUSES = ("success", "success", "success", "failed", "pending")
+
+
+async def seed(engine):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    chunk = 50_000
+    async with engine.begin() as conn:
+        for offset in range(0, ROWS, chunk):
+            await conn.execute(insert(URLRecord), [
+                {
+                    "url": f"https://site{i}.com/article",
+                    "image_url": f"https://site{i}.com/og.jpg",
+                    "status": STATUSES[i % len(STATUSES)],
+                    "created_at": start + timedelta(seconds=i),
+                }
+                for i in range(offset, min(offset + chunk, ROWS))
+            ])
+
+
+async def page_before(session, position):
+    # The previous listing: whole ORM objects from an id cursor, converted one by one
+    stmt = select(URLRecord).where(URLRecord.id <= position).order_by(URLRecord.id.desc()).limit(PAGE_SIZE + 1)
+    entries = (await session.execute(stmt)).scalars().all()
+    results = [URLInfo.from_orm(entry) for entry in entries[:PAGE_SIZE]]
+    return PaginatedURLInfo(results=results, next_cursor=None).model_dump_json()
+
+
+async def page_after(session, cursor, status=None):
+    entries, next_cursor = await crud.get_all_entries(session, limit=PAGE_SIZE, cursor=cursor, status=status)
+    page = PaginatedURLInfo.model_validate({"results": entries, "next_cursor": next_cursor}, from_attributes=True)
+    return page.model_dump_json()
+
+
+async def measure(page, *args) -> float:
+    async with db_session.AsyncSessionLocal() as session:
+        await page(session, *args)  # warm up
+        start = time.perf_counter()
+        for _ in range(PAGES):
+            await page(session, *args)
+            session.expunge_all()
+        return (time.perf_counter() - start) / PAGES * 1000
+
+
+async def cursor_at(depth: float, status=None):
+    # Cursor of the row `depth` of the way down the newest-first listing
+    async with db_session.AsyncSessionLocal() as session:
+        stmt = select(URLRecord.created_at, URLRecord.id).order_by(URLRecord.created_at.desc(), URLRecord.id.desc())
+        if status:
+            stmt = stmt.where(URLRecord.status == status)
+        row = (await session.execute(stmt.offset(int(ROWS * depth * (0.6 if status else 1))).limit(1))).one()
+        return crud.encode_cursor(row.created_at, row.id), row.id
+
+
+async def main():
+    logging.disable(logging.INFO)
+    warnings.simplefilter("ignore", DeprecationWarning)  # URLInfo.from_orm of the previous listing
+    engine = await use_local_stand_ins()
+    start = time.perf_counter()
+    await seed(engine)
+    print(f"seeded {ROWS} rows in {time.perf_counter() - start:.1f}s, {PAGE_SIZE} rows per page")
+
+    print(f"{'depth':>6} {'before ms':>10} {'after ms':>10} {'after, status=success ms':>26}")
+    for depth in DEPTHS:
+        cursor, id = await cursor_at(depth) if depth else (None, ROWS)
+        status_cursor, _ = await cursor_at(depth, "success") if depth else (None, None)
+        before = await measure(page_before, id)
+        after = await measure(page_after, cursor)
+        filtered = await measure(page_after, status_cursor, "success")
+        print(f"{depth:>6.0%} {before:>10.3f} {after:>10.3f} {filtered:>26.3f}")
+
+    async with engine.connect() as conn:
+        plan = await conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT id FROM url_records WHERE status = 'success' "
+            "AND (created_at, id) < ('2024-06-01 00:00:00.000000', 1) ORDER BY created_at DESC, id DESC LIMIT 21"
+        ))
+        print("status page plan:", " / ".join(row[-1] for row in plan))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
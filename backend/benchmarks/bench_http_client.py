@@ -0,0 +1,59 @@
+"""
+Scrapes per second with a new httpx.AsyncClient per url (before) vs the shared pooled client (after).
+Run from backend/: python -m benchmarks.bench_http_client
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+# Client throughput against one local host, politeness pacing off
+os.environ.setdefault("SCRAPER_HOST_RATE_PER_SECOND", "0")
+
+import asyncio
+import httpx
+import logging
+import time
+from benchmarks.stub_origin import StubOrigin
+from bs4 import BeautifulSoup
+from services.http_client import close_http_client
+from services.og_scraper import extract_og_image
+
+
+SCRAPES = 2000
+CONCURRENCY = 20
+
+
+async def extract_og_image_per_call_client(url: str):
+    # The pre-pooling implementation, kept here as the baseline
+    async with httpx.AsyncClient(timeout=10) as client:
+        response = await client.get(url)
+        tag = BeautifulSoup(response.text, "html.parser").find("meta", property="og:image")
+        return tag["content"] if tag else None
+
+
+async def run(scrape, url: str) -> float:
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def one():
+        async with semaphore:
+            assert await scrape(url)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(SCRAPES)))
+    return SCRAPES / (time.perf_counter() - start)
+
+
+async def main():
+    logging.disable(logging.INFO)
+    async with StubOrigin() as origin:
+        url = origin.base_url + "/"
+        before = await run(extract_og_image_per_call_client, url)
+        before_connections = origin.connections
+        after = await run(extract_og_image, url)
+        after_connections = origin.connections - before_connections
+        await close_http_client()
+
+    print(f"per-call client: {before:8.1f} scrapes/s, {before_connections} connections")
+    print(f"pooled client:   {after:8.1f} scrapes/s, {after_connections} connections")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,109 @@
+"""
+Parse cost per page on the fixture corpus: soup.find of og:image (the original extractor),
+the og:image-only streaming parser (before) and the single pass metadata parser (after).
+Pages are fed in chunks like the scraper does, stopping once the parser is done.
+Run from backend/: python -m benchmarks.bench_og_metadata
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import time
+from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from pathlib import Path
+from services.og_parser import OGHeadParser
+from settings import SCRAPER_CHUNK_SIZE_BYTES
+
+
+FIXTURES_DIR = Path(__file__).parent.parent / "tests" / "fixtures" / "pages"
+ROUNDS = 200
+
+
+class OGImageParser(HTMLParser):
+    # The og:image-only parser this pass replaced, kept here as the baseline
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.image_url = None
+        self.found = False
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "body":
+            self.done = True
+            return
+        if tag == "meta" and not self.found:
+            attrs = dict(attrs)
+            if attrs.get("property") == "og:image":
+                self.found = True
+                self.image_url = attrs.get("content")
+                self.done = True
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag == "head":
+            self.done = True
+
+
+def news_page() -> str:
+    # A typical article head: analytics scripts, preloads and a few dozen meta tags, the og tags last
+    script = "<script>window.dataLayer = window.dataLayer || [];" + "var x = {a: 1, b: [1, 2, 3]};" * 200 + "</script>\n"
+    links = "".join(f'<link rel="preload" href="/static/chunk{i}.js" as="script">\n' for i in range(30))
+    metas = "".join(f'<meta name="meta{i}" content="value {i}">\n' for i in range(30))
+    og = (
+        '<link rel="icon" href="/favicon.ico">'
+        '<meta property="og:title" content="News title"><meta property="og:description" content="Summary">'
+        '<meta property="og:site_name" content="News"><meta property="og:image" content="/img/hero.jpg">'
+        '<meta property="og:image:width" content="1200"><meta property="og:image:height" content="630">'
+        '<meta name="twitter:card" content="summary_large_image">'
+    )
+    body = "<p>" + "Lorem ipsum dolor sit amet. " * 40 + "</p>\n"
+    return f"<html><head><title>News</title>{script}{links}{metas}{og}</head><body>{body * 200}</body></html>"
+
+
+def parse_streaming(parser: HTMLParser, html: str):
+    for i in range(0, len(html), SCRAPER_CHUNK_SIZE_BYTES):
+        parser.feed(html[i:i + SCRAPER_CHUNK_SIZE_BYTES])
+        if parser.done:
+            break
+    return parser
+
+
+def soup_find(html: str):
+    tag = BeautifulSoup(html, "html.parser").find("meta", property="og:image")
+    return tag.get("content") if tag else None
+
+
+def image_only(html: str):
+    return parse_streaming(OGImageParser(), html).image_url
+
+
+def metadata(html: str):
+    parser = parse_streaming(OGHeadParser(base_url="https://example.com/article"), html)
+    return parser.image_url, parser.metadata()
+
+
+def measure(parse, pages) -> float:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        for html in pages:
+            parse(html)
+    return (time.perf_counter() - start) / ROUNDS / len(pages) * 1_000_000
+
+
+def main():
+    corpora = {
+        "fixtures": [path.read_text(encoding="utf-8") for path in sorted(FIXTURES_DIR.glob("*.html"))],
+        "news page": [news_page()],
+    }
+    print(f"{'corpus':>10} {'soup.find us':>13} {'og:image only us':>17} {'full metadata us':>17}")
+    for name, pages in corpora.items():
+        before_soup = measure(soup_find, pages)
+        before = measure(image_only, pages)
+        after = measure(metadata, pages)
+        print(f"{name:>10} {before_soup:>13.1f} {before:>17.1f} {after:>17.1f}")
+
+
+if __name__ == "__main__":
+    main()
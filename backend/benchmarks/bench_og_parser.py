@@ -0,0 +1,68 @@
+"""
+Latency and peak memory of full download + BeautifulSoup (before) vs the streaming head parser (after)
+on large article pages.
+Run from backend/: python -m benchmarks.bench_og_parser
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import asyncio
+import logging
+import time
+import tracemalloc
+from benchmarks.stub_origin import StubOrigin
+from benchmarks.stub_origin import StubPage
+from bs4 import BeautifulSoup
+from services.http_client import close_http_client
+from services.http_client import get_http_client
+from services.og_scraper import extract_og_image
+
+
+ROUNDS = 5
+PAGE_SIZES_MB = (1, 4, 8)
+
+
+def article_page(size_mb: int) -> bytes:
+    paragraph = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20 + "</p>\n"
+    body = paragraph * (size_mb * 1024 * 1024 // len(paragraph))
+    return (
+        '<html><head><title>Big article</title>'
+        '<meta property="og:image" content="https://stub.local/big.jpg">'
+        f'</head><body>{body}</body></html>'
+    ).encode()
+
+
+async def extract_og_image_full_parse(url: str):
+    # The pre-streaming implementation, kept here as the baseline
+    response = await get_http_client().get(url)
+    tag = BeautifulSoup(response.text, "html.parser").find("meta", property="og:image")
+    return tag["content"] if tag else None
+
+
+async def measure(scrape, url: str):
+    latencies = []
+    tracemalloc.start()
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        assert await scrape(url)
+        latencies.append(time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sum(latencies) / len(latencies) * 1000, peak / 1024 / 1024
+
+
+async def main():
+    logging.disable(logging.INFO)
+    pages = {f"/{size}mb": StubPage(body=article_page(size)) for size in PAGE_SIZES_MB}
+    async with StubOrigin(pages) as origin:
+        print(f"{'page':>6} {'full parse ms':>14} {'full parse MiB':>15} {'streaming ms':>13} {'streaming MiB':>14}")
+        for size in PAGE_SIZES_MB:
+            url = f"{origin.base_url}/{size}mb"
+            before_ms, before_mb = await measure(extract_og_image_full_parse, url)
+            after_ms, after_mb = await measure(extract_og_image, url)
+            print(f"{size:>4}MB {before_ms:>14.1f} {before_mb:>15.1f} {after_ms:>13.1f} {after_mb:>14.1f}")
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Event loop lag and scrape throughput of each HTML parser backend, parsing on the event loop ("inline")
+vs in the parse pool ("thread", "process"), under a mix of small heads and large heads (inline scripts and JSON).
+Lag is how late a 10 ms ticker on the same event loop wakes up while the pages are scraped,
+what every other request of the worker would wait.
+Run from backend/: python -m benchmarks.bench_parse_offload
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import asyncio
+import logging
+import time
+from benchmarks.stub_origin import StubOrigin
+from benchmarks.stub_origin import StubPage
+from services import og_scraper
+from services import parse_pool
+from services.http_client import close_http_client
+from services.og_parser import lxml_available
+from services.og_scraper import stream_og_page
+
+
+PAGES = 500
+CONCURRENCY = 4
+LARGE_EVERY = 5  # one page in 5 has a large head
+LARGE_HEAD_BYTES = 512 * 1024
+TICK_SECONDS = 0.01
+BACKENDS = ["html.parser", "regex"] + (["lxml"] if lxml_available() else [])
+POOLS = ("inline", "thread", "process")
+
+
+def page(head_bytes: int) -> bytes:
+    # Framework pages inline their state and hundreds of preloads in the head, before the og tags
+    state = '{"items": [' + ",".join('{"id": %d, "name": "<b>item</b>"}' % i for i in range(head_bytes // 64)) + "]}"
+    links = "".join(f'<link rel="preload" href="/static/chunk-{i}.js" as="script">' for i in range(head_bytes // 128))
+    return (
+        f'<html><head><title>Page</title><script>window.__STATE__ = {state[:head_bytes // 2]}</script>{links}'
+        '<meta property="og:image" content="/og.jpg"><meta property="og:title" content="Page">'
+        "</head><body>" + "<p>body</p>" * 1000 + "</body></html>"
+    ).encode()
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append(time.perf_counter() - start - TICK_SECONDS)
+
+
+async def run(base_url: str, backend: str, pool: str):
+    og_scraper.HTML_PARSER_BACKEND = backend
+    og_scraper.HTML_PARSE_POOL = parse_pool.HTML_PARSE_POOL = pool
+    parse_pool.close_parse_pool()
+    # Workers started (and spawned) before the clock starts
+    await stream_og_page(f"{base_url}/large")
+
+    urls = [f"{base_url}/large" if i % LARGE_EVERY == 0 else f"{base_url}/small" for i in range(PAGES)]
+    queue = asyncio.Queue()
+    for url in urls:
+        queue.put_nowait(url)
+
+    async def worker():
+        while not queue.empty():
+            page = await stream_og_page(queue.get_nowait())
+            assert page.image_url, page
+
+    lags = []
+    stop = asyncio.Event()
+    tick = asyncio.ensure_future(ticker(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    seconds = time.perf_counter() - start
+    stop.set()
+    await tick
+    return PAGES / seconds, percentile(lags, 0.99) * 1000, max(lags) * 1000
+
+
+async def main():
+    logging.disable(logging.INFO)
+    pages = {"/small": StubPage(body=page(4 * 1024)), "/large": StubPage(body=page(LARGE_HEAD_BYTES))}
+    print(f"{PAGES} pages, 1 in {LARGE_EVERY} with a {LARGE_HEAD_BYTES // 1024} KiB head, {CONCURRENCY} in flight, "
+          f"{parse_pool.HTML_PARSE_WORKERS} parse workers, {os.cpu_count()} cores")
+    async with StubOrigin(pages) as origin:
+        print(f"{'backend':>12} {'pool':>8} {'pages/s':>9} {'lag p99 ms':>11} {'lag max ms':>11}")
+        for backend in BACKENDS:
+            for pool in POOLS:
+                rate, lag_p99, lag_max = await run(origin.base_url, backend, pool)
+                print(f"{backend:>12} {pool:>8} {rate:>9.1f} {lag_p99:>11.1f} {lag_max:>11.1f}")
+    parse_pool.close_parse_pool()
+    await close_http_client()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
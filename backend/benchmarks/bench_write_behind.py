@@ -0,0 +1,92 @@
+"""
+Scrape result writes: one UPDATE transaction and one Redis SET per result (before) vs the write-behind buffer,
+one executemany UPDATE transaction and one Redis pipeline per flush (after).
+Scrapers finishing concurrently save their results, the origin fetch is left out.
+Reports results/s, DB transactions/s, and the commit latency: how long until a result is in the DB,
+which is also what the scraper waits before (per UPDATE) and the time in the buffer after.
+Run from backend/: python -m benchmarks.bench_write_behind [--database-url postgresql+asyncpg://...] [--redis-url ...]
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+import argparse
+import asyncio
+import logging
+import time
+from benchmarks.stand_ins import use_local_stand_ins
+from database import crud
+from database import session as db_session
+from database.enums import URLStatus
+from datetime import datetime
+from datetime import timezone
+from services import og_scraper
+from services.metrics import WRITE_BEHIND_DELAY
+from sqlalchemy import event
+
+
+RESULTS = 5_000
+CONCURRENCY = 50
+
+
+async def save_all(entries, scraper_waits: list):
+    queue = asyncio.Queue()
+    for entry in entries:
+        queue.put_nowait(entry)
+
+    async def scraper():
+        async with db_session.AsyncSessionLocal() as session:
+            while not queue.empty():
+                entry = queue.get_nowait()
+                start = time.perf_counter()
+                await og_scraper.save_result(
+                    session, entry, entry.url + ".jpg", URLStatus.SUCCESS.value,
+                    max_age=3600, validated_at=datetime.now(timezone.utc), metadata={"title": entry.url},
+                )
+                scraper_waits.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(scraper() for _ in range(CONCURRENCY)))
+
+
+async def run(entries, write_behind: bool, commits: list) -> tuple:
+    og_scraper.WRITE_BEHIND_ENABLED = write_behind
+    scraper_waits = []
+    delay = WRITE_BEHIND_DELAY._default()
+    delay_sum, delay_count = delay.sum, delay.count
+    commits.clear()
+    start = time.perf_counter()
+    await save_all(entries, scraper_waits)
+    await og_scraper.close_write_behind()
+    seconds = time.perf_counter() - start
+    if write_behind:
+        commit_latency = (delay.sum - delay_sum) / (delay.count - delay_count)
+    else:
+        commit_latency = sum(scraper_waits) / len(scraper_waits)
+    return (
+        len(entries) / seconds, len(commits), len(commits) / seconds, commit_latency * 1000,
+        sum(scraper_waits) / len(scraper_waits) * 1000,
+    )
+
+
+async def main(database_url: str = None, redis_url: str = None):
+    logging.disable(logging.INFO)
+    engine = await use_local_stand_ins(database_url, redis_url)
+    commits = []
+    event.listen(engine.sync_engine, "commit", lambda conn: commits.append(1))
+    async with db_session.AsyncSessionLocal() as session:
+        entries = await crud.upsert_url_entries(session, [f"https://site{i}.com/article" for i in range(RESULTS)])
+
+    print(f"{RESULTS} results, {CONCURRENCY} scrapers, flush every {og_scraper.get_write_behind().interval * 1000:.0f} ms "
+          f"or {og_scraper.get_write_behind().max_records} records, {engine.dialect.name}")
+    print(f"{'':8} {'results/s':>10} {'DB tx':>6} {'DB tx/s':>8} {'commit ms':>10} {'scraper wait ms':>16}")
+    for name, write_behind in (("before", False), ("after", True)):
+        rate, transactions, transactions_rate, commit_ms, wait_ms = await run(entries, write_behind, commits)
+        print(f"{name:8} {rate:>10.0f} {transactions:>6} {transactions_rate:>8.0f} {commit_ms:>10.2f} {wait_ms:>16.3f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--database-url", help="scratch Postgres to write to, wiped first (default: temporary sqlite)")
+    parser.add_argument("--redis-url", help="scratch Redis to write to, flushed first (default: fakeredis)")
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.redis_url))
@@ -0,0 +1,40 @@
+import fakeredis
+import os
+import redis.asyncio as redis
+import tempfile
+from api import routes
+from database import session
+from database.models import Base
+from services import og_scraper
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+from typing import Optional
+
+
+async def use_local_stand_ins(database_url: Optional[str] = None, redis_url: Optional[str] = None):
+    """
+    Point the app at a temporary sqlite file DB and fakeredis.
+    A file DB gives each concurrent session its own connection, like the Postgres pool.
+    database_url and redis_url point it at a local Postgres and Redis instead, both are wiped first: use scratch ones.
+    Returns the engine, so benchmarks can count statements and dispose it.
+    """
+    if database_url:
+        engine = create_async_engine(database_url, **session.engine_options(database_url))
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+    else:
+        path = os.path.join(tempfile.mkdtemp(), "og.db")
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}", connect_args={"timeout": 30})
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    session_local = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    session.AsyncSessionLocal = session_local
+    routes.AsyncSessionLocal = session_local
+    og_scraper.AsyncSessionLocal = session_local
+    if redis_url:
+        og_scraper.REDIS_CLIENT = redis.from_url(redis_url, decode_responses=True)
+        await og_scraper.REDIS_CLIENT.flushdb()
+    else:
+        og_scraper.REDIS_CLIENT = fakeredis.FakeAsyncRedis(decode_responses=True)
+    return engine
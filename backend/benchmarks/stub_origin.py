@@ -0,0 +1,120 @@
+import asyncio
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Dict
+from typing import Optional
+
+
+OG_PAGE = (
+    '<html><head><title>Stub</title>'
+    '<meta property="og:image" content="https://stub.local/image.jpg">'
+    '</head><body><p>stub page</p></body></html>'
+)
+
+
+@dataclass
+class StubPage:
+    body: bytes = OG_PAGE.encode()
+    status: int = 200
+    content_type: str = "text/html; charset=utf-8"
+    delay: float = 0.0  # seconds before the response headers are sent
+    headers: Dict[str, str] = field(default_factory=dict)
+    drip_bytes: int = 0  # slow drip: send the body in chunks of drip_bytes, drip_delay seconds apart
+    drip_delay: float = 0.0
+
+
+def article_page(size_bytes: int = 0, og: bool = True, image_url: str = "https://stub.local/image.jpg") -> bytes:
+    """
+    Html page of about size_bytes, with or without og tags in its head
+    """
+    head = "<title>Stub article</title>" + (f'<meta property="og:image" content="{image_url}">' if og else "")
+    paragraph = "<p>" + "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 20 + "</p>\n"
+    body = paragraph * max(1, size_bytes // len(paragraph))
+    return f"<html><head>{head}</head><body>{body}</body></html>".encode()
+
+
+def redirect_to(location: str, status: int = 301) -> StubPage:
+    return StubPage(body=b"", status=status, content_type="text/plain", headers={"Location": location})
+
+
+class StubOrigin:
+    """
+    Minimal keep-alive HTTP/1.1 origin served from the local event loop.
+    Used by benchmarks and tests so scrapes never leave the machine.
+    """
+    def __init__(self, pages: Optional[Dict[str, StubPage]] = None, host: str = "127.0.0.1"):
+        self.pages = {"/": StubPage()} if pages is None else pages
+        self.host = host
+        self.port: Optional[int] = None
+        self.connections = 0  # total accepted connections
+        self.requests = 0  # total served requests
+        self.open_connections = 0
+        self.max_open_connections = 0  # peak of concurrently open connections
+        self.in_flight = 0
+        self.max_in_flight = 0  # peak of requests being answered at the same time
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def __aenter__(self):
+        self._server = await asyncio.start_server(self._handle, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        self.open_connections += 1
+        self.max_open_connections = max(self.max_open_connections, self.open_connections)
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                path = request_line.split()[1].decode()
+                page = self.pages.get(path.split("?")[0])
+                self.requests += 1
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                if page is None:
+                    page = StubPage(body=b"not found", status=404, content_type="text/plain")
+                try:
+                    if page.delay:
+                        await asyncio.sleep(page.delay)
+                finally:
+                    self.in_flight -= 1
+
+                head = [f"HTTP/1.1 {page.status} STUB", f"Content-Type: {page.content_type}",
+                        f"Content-Length: {len(page.body)}"]
+                head += [f"{k}: {v}" for k, v in page.headers.items()]
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                if page.drip_bytes:
+                    for i in range(0, len(page.body), page.drip_bytes):
+                        if reader.at_eof():
+                            break  # the client stopped reading after the head and closed the connection
+                        writer.write(page.body[i:i + page.drip_bytes])
+                        await writer.drain()
+                        await asyncio.sleep(page.drip_delay)
+                else:
+                    writer.write(page.body)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.open_connections -= 1
+            writer.close()
@@ -0,0 +1,272 @@
+"""
+Repeatable benchmark suite: the real FastAPI app in-process (ASGI transport), against local stand-ins
+(a temporary sqlite file DB or a local Postgres, fakeredis or a local Redis, and the stub HTTP origin).
+Reports p50/p95/p99 latency and throughput per scenario, and writes them as JSON to compare commits.
+Run from backend/:
+    python -m benchmarks.suite --output before.json
+    python -m benchmarks.suite --output after.json --compare before.json
+    python -m benchmarks.suite --only submit_cache_hit --requests 5000
+"""
+import os
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+# Every scrape goes to the one local origin, measure the app and not the politeness pacing
+os.environ.setdefault("SCRAPER_HOST_RATE_PER_SECOND", "0")
+os.environ.setdefault("SCRAPER_MAX_CONNECTIONS_PER_HOST", "100")
+
+import argparse
+import asyncio
+import httpx
+import json
+import logging
+import math
+import platform
+import subprocess
+import time
+from benchmarks.stand_ins import use_local_stand_ins
+from benchmarks.stub_origin import StubOrigin
+from benchmarks.stub_origin import StubPage
+from benchmarks.stub_origin import article_page
+from benchmarks.stub_origin import redirect_to
+from database import crud
+from database import session as db_session
+from datetime import datetime
+from datetime import timezone
+from main import app
+from services.http_client import close_http_client
+from services.http_client import open_http_client
+from services.local_cache import local_cache
+from services.og_scraper import extract_og_image
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+SCENARIOS = (
+    "submit_cache_hit", "submit_miss", "submit_miss_redirect", "submit_miss_no_og", "submit_miss_slow_drip",
+    "history_paging", "extract_og_image_50kb", "extract_og_image_1mb",
+)
+# Fewer requests for the scenarios dominated by origin latency
+SLOW_SCENARIO_SHARE = {"submit_miss_slow_drip": 0.1, "extract_og_image_1mb": 0.2}
+HISTORY_ROWS = 20_000
+HISTORY_PAGE_SIZE = 20
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(p / 100 * len(sorted_values)) - 1))]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_per_second": round(len(values) / elapsed, 1) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+    }
+
+
+async def run_load(call: Callable[[int], Awaitable[bool]], requests: int, concurrency: int) -> Dict[str, float]:
+    """
+    Run call(0..requests-1) with at most concurrency calls in flight, timing each one.
+    A call returning False or raising counts as an error.
+    """
+    latencies: List[float] = []
+    errors = 0
+    next_index = 0
+
+    async def worker():
+        nonlocal errors, next_index
+        while next_index < requests:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                ok = await call(index)
+            except Exception:
+                ok = False
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+class Suite:
+    def __init__(self, client: httpx.AsyncClient, origin: StubOrigin, requests: int, concurrency: int):
+        self.client = client
+        self.origin = origin
+        self.requests = requests
+        self.concurrency = concurrency
+
+    def share(self, name: str) -> int:
+        return max(1, int(self.requests * SLOW_SCENARIO_SHARE.get(name, 1)))
+
+    async def submit(self, url: str) -> bool:
+        response = await self.client.post("/api/submit", json={"url": url})
+        return response.status_code == 200
+
+    async def submit_cache_hit(self) -> Dict[str, float]:
+        urls = [f"{self.origin.base_url}/article/hit{i}" for i in range(100)]
+        for url in urls:
+            assert await self.submit(url)
+        return await run_load(lambda i: self.submit(urls[i % len(urls)]), self.requests, self.concurrency)
+
+    async def submit_misses(self, prefix: str, name: str) -> Dict[str, float]:
+        return await run_load(
+            lambda i: self.submit(f"{self.origin.base_url}/{prefix}/{name}{i}"), self.share(name), self.concurrency
+        )
+
+    async def submit_miss(self) -> Dict[str, float]:
+        return await self.submit_misses("article", "miss")
+
+    async def submit_miss_redirect(self) -> Dict[str, float]:
+        return await self.submit_misses("moved", "redirect")
+
+    async def submit_miss_no_og(self) -> Dict[str, float]:
+        return await self.submit_misses("no-og", "none")
+
+    async def submit_miss_slow_drip(self) -> Dict[str, float]:
+        return await self.submit_misses("drip", "slow")
+
+    async def history_paging(self) -> Dict[str, float]:
+        async with db_session.AsyncSessionLocal() as session:
+            for offset in range(0, HISTORY_ROWS, 5000):
+                await crud.upsert_url_entries(
+                    session, [f"https://history{i}.com/" for i in range(offset, min(offset + 5000, HISTORY_ROWS))]
+                )
+        cursor: Optional[str] = None
+
+        async def page(_) -> bool:
+            nonlocal cursor
+            params = {"limit": HISTORY_PAGE_SIZE}
+            if cursor:
+                params["cursor"] = cursor
+            response = await self.client.get("/api/history", params=params)
+            cursor = response.json()["next_cursor"]  # walks the listing, back to the first page at the end
+            return response.status_code == 200
+
+        # Pages follow each other, like a client scrolling
+        return await run_load(page, min(self.requests, HISTORY_ROWS // HISTORY_PAGE_SIZE), 1)
+
+    async def extract_og_image_50kb(self) -> Dict[str, float]:
+        url = f"{self.origin.base_url}/raw/50kb"
+        return await run_load(lambda i: extract_og_image(url), self.requests, self.concurrency)
+
+    async def extract_og_image_1mb(self) -> Dict[str, float]:
+        url = f"{self.origin.base_url}/raw/1mb"
+        return await run_load(lambda i: extract_og_image(url), self.share("extract_og_image_1mb"), self.concurrency)
+
+
+class StubPages(dict):
+    """
+    Origin pages by path prefix, so every miss can use a url of its own
+    """
+    def __init__(self, latency: float):
+        super().__init__()
+        self.by_prefix = {
+            "/article/": StubPage(body=article_page(50 * 1024), delay=latency),
+            "/moved/": redirect_to("/article/target"),
+            "/no-og/": StubPage(body=article_page(50 * 1024, og=False), delay=latency),
+            "/drip/": StubPage(body=article_page(8 * 1024), delay=latency, drip_bytes=32, drip_delay=0.005),
+            "/raw/50kb": StubPage(body=article_page(50 * 1024)),
+            "/raw/1mb": StubPage(body=article_page(1024 * 1024)),
+        }
+
+    def get(self, path, default=None):
+        for prefix, page in self.by_prefix.items():
+            if path.startswith(prefix):
+                return page
+        return default
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results: Dict[str, Dict[str, float]], baseline: Optional[dict]):
+    header = f"{'scenario':<24} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    print(header + ("   vs baseline p50 / p99 / req/s" if baseline else ""))
+    for name, stats in results.items():
+        line = (f"{name:<24} {stats['throughput_per_second']:>9.1f} {stats['p50_ms']:>9.3f} "
+                f"{stats['p95_ms']:>9.3f} {stats['p99_ms']:>9.3f} {stats['errors']:>7}")
+        before = (baseline or {}).get("results", {}).get(name)
+        if before:
+            deltas = [
+                f"{(stats[key] - before[key]) / before[key] * 100:+.1f}%" if before[key] else "n/a"
+                for key in ("p50_ms", "p99_ms", "throughput_per_second")
+            ]
+            line += "   " + " / ".join(deltas)
+        print(line)
+
+
+async def main(args):
+    logging.disable(logging.INFO)
+    engine = await use_local_stand_ins(args.database_url, args.redis_url)
+    await open_http_client()
+    scenarios = args.only or list(SCENARIOS)
+
+    results = {}
+    async with StubOrigin(StubPages(args.origin_latency)) as origin, \
+            httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://app") as client:
+        suite = Suite(client, origin, args.requests, args.concurrency)
+        for name in scenarios:
+            local_cache.clear()
+            results[name] = await getattr(suite, name)()
+
+    await close_http_client()
+    await engine.dispose()
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "origin_latency_seconds": args.origin_latency,
+            "database": "postgresql" if args.database_url else "sqlite",
+            "redis": "redis" if args.redis_url else "fakeredis",
+        },
+        "results": results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {args.output}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    parser.add_argument("--compare", help="JSON results of a previous run, to print the change")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, help="scenarios to run, all by default")
+    parser.add_argument("--requests", type=int, default=1000, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20, help="requests in flight")
+    parser.add_argument("--origin-latency", type=float, default=0.005, help="seconds before the origin answers")
+    parser.add_argument("--database-url", help="local Postgres instead of sqlite, e.g. postgresql+asyncpg://...")
+    parser.add_argument("--redis-url", help="local Redis instead of fakeredis, e.g. redis://localhost:6379/15")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
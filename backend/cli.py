@@ -0,0 +1,381 @@
+"""
+Bulk import and export of url records, run from backend/:
+    python cli.py import urls.txt.gz --concurrency 50 --checkpoint urls.checkpoint
+    python cli.py import crawl.csv --column url --no-scrape
+    python cli.py export records.ndjson.gz --status success
+    python cli.py export - --format csv > records.csv
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from database import crud
+from database.session import AsyncSessionLocal
+from database.session import engine
+from database.session import init_db
+from datetime import datetime
+from services.http_client import close_http_client
+from services.http_client import open_http_client
+from services.og_scraper import close_write_behind
+from services.og_scraper import fresh_seconds_left
+from services.og_scraper import is_retry_deferred
+from services.og_scraper import process_og_url_by_entry_id
+from services.parse_pool import close_parse_pool
+from services.url_normalizer import normalize_url
+from typing import Dict
+from typing import IO
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger("cli")
+
+
+def open_text(path: str, mode: str = "r") -> IO[str]:
+    """
+    Open a text file, gzipped if the name ends with .gz, "-" is stdin / stdout
+    """
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer if mode == "r" else sys.stdout.buffer, encoding="utf-8", newline="")
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def file_format(path: str, format: str) -> str:
+    if format != "auto":
+        return format
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "lines"
+
+
+def read_urls(path: str, format: str = "auto", column: str = "url", skip: int = 0) -> Iterator[Tuple[int, str]]:
+    """
+    Stream the urls of a file, one per line or one column of a CSV, as (position, url).
+    The position counts the records read, a resumed import skips the first skip records.
+    Empty lines and lines starting with # are skipped.
+    Args:
+        Input:
+            path: newline or CSV file, gzipped if it ends with .gz
+            format: "lines", "csv" or "auto" from the file name
+            column: CSV column name if the first row is a header with it, else a column index (0 by default)
+            skip: records already imported
+    """
+    with open_text(path) as f:
+        if file_format(path, format) == "csv":
+            rows = csv.reader(f)
+            first = next(rows, None)
+            if first is None:
+                return
+            if column in first:
+                index = first.index(column)
+            else:
+                index = int(column) if column.isdigit() else 0
+                rows = _chain([first], rows)
+            values = (row[index] if len(row) > index else "" for row in rows)
+        else:
+            values = (line.rstrip("\r\n") for line in f)
+
+        position = 0
+        for value in values:
+            position += 1
+            if position <= skip:
+                continue
+            value = value.strip()
+            if value and not value.startswith("#"):
+                yield position, value
+
+
+def _chain(first: List[list], rows: Iterator[list]) -> Iterator[list]:
+    yield from first
+    yield from rows
+
+
+def needs_scrape(entry) -> bool:
+    """
+    Check if an imported record has to be scraped: new, failed out of its backoff, or stale.
+    An alias is served its canonical record, it is not scraped.
+    """
+    if entry.canonical_url:
+        return False
+    if entry.image_url and fresh_seconds_left(entry) > 0:
+        return False
+    return not is_retry_deferred(entry)
+
+
+@dataclass
+class ImportProgress:
+    read: int = 0  # urls read from the file
+    invalid: int = 0  # not http(s) urls
+    duplicates: int = 0  # seen earlier in the file
+    upserted: int = 0  # rows inserted or already in the DB
+    scraped: int = 0
+    scraped_with_image: int = 0
+    position: int = 0  # records of the file fully done, the checkpoint
+
+    def report(self, elapsed: float) -> str:
+        rate = self.scraped / elapsed if elapsed else 0.0
+        return (f"read: {self.read}, invalid: {self.invalid}, duplicates: {self.duplicates}, "
+                f"upserted: {self.upserted}, scraped: {self.scraped} ({self.scraped_with_image} with image), "
+                f"{rate:.1f} scrapes/s, checkpoint: {self.position}")
+
+
+class Checkpoint:
+    """
+    Position of a resumable import, saved atomically to a JSON file with the progress counters
+    """
+    def __init__(self, path: Optional[str], source: str):
+        self.path = path
+        self.source = source
+
+    def load(self) -> int:
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        with open(self.path) as f:
+            state = json.load(f)
+        if state.get("source") != self.source:
+            raise ValueError(f"Checkpoint {self.path} is for {state.get('source')}, not {self.source}")
+        return int(state["position"])
+
+    def save(self, progress: ImportProgress):
+        if not self.path:
+            return
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"source": self.source, **asdict(progress)}, f)
+        os.replace(tmp, self.path)
+
+
+class BatchTracker:
+    """
+    Moves the checkpoint past a batch once it and every batch before it are done,
+    while the scrapes of several batches finish out of order.
+    """
+    def __init__(self, progress: ImportProgress, checkpoint: Checkpoint):
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self._pending: Dict[int, int] = {}  # batch index -> scrapes left
+        self._end: Dict[int, int] = {}  # batch index -> file position after the batch
+        self._next = 0
+
+    def add(self, index: int, end_position: int, scrapes: int):
+        self._pending[index] = scrapes
+        self._end[index] = end_position
+        self._advance()
+
+    def done(self, index: int):
+        self._pending[index] -= 1
+        self._advance()
+
+    def _advance(self):
+        moved = False
+        while self._pending.get(self._next) == 0:
+            del self._pending[self._next]
+            self.progress.position = self._end.pop(self._next)
+            self._next += 1
+            moved = True
+        if moved:
+            self.checkpoint.save(self.progress)
+
+
+async def import_urls(
+    path: str,
+    format: str = "auto",
+    column: str = "url",
+    batch_size: int = 1000,
+    concurrency: int = 20,
+    scrape: bool = True,
+    checkpoint_path: Optional[str] = None,
+    progress_interval: float = 5,
+) -> ImportProgress:
+    """
+    Import the urls of a file: normalize and dedupe them, insert them with one multi-row upsert per batch,
+    then scrape the new and stale ones, concurrency at a time, while the next batches are read.
+    Memory stays bounded: at most two batches of scrapes are queued ahead of the workers.
+    With a checkpoint file, a stopped import resumes after the last batch whose scrapes all finished.
+    Args:
+        Input:
+            path, format, column: the file, see read_urls
+            batch_size: urls per upsert
+            concurrency: scrapes in flight
+            scrape: if False, only insert the records, as pending
+            checkpoint_path: JSON file of the resumable position
+            progress_interval: seconds between two progress reports
+        Output:
+            ImportProgress
+    """
+    checkpoint = Checkpoint(checkpoint_path, os.path.abspath(path))
+    progress = ImportProgress()
+    progress.position = checkpoint.load()
+    if progress.position:
+        logger.info(f"Import - resuming {path} after record {progress.position}")
+    tracker = BatchTracker(progress, checkpoint)
+    jobs: asyncio.Queue = asyncio.Queue(maxsize=max(1, 2 * batch_size))
+    start = time.monotonic()
+    seen = set()  # 8 byte digests of the normalized urls, a fraction of the memory of the urls
+
+    async def work():
+        while True:
+            index, id = await jobs.get()
+            try:
+                entry = await process_og_url_by_entry_id(id)
+                progress.scraped += 1
+                progress.scraped_with_image += bool(entry and entry.image_url)
+            except Exception as e:
+                logger.exception(f"Import - entry id: {id} error: {e}")
+            finally:
+                tracker.done(index)
+                jobs.task_done()
+
+    async def report():
+        while True:
+            await asyncio.sleep(progress_interval)
+            logger.info(f"Import - {progress.report(time.monotonic() - start)}")
+
+    async def upsert(index: int, urls: List[str], end_position: int):
+        async with AsyncSessionLocal() as session:
+            entries = await crud.upsert_url_entries(session, urls)
+        progress.upserted += len(entries)
+        to_scrape = [entry.id for entry in entries if needs_scrape(entry)] if scrape else []
+        # Registered first, a worker may finish a scrape before the last one is queued
+        tracker.add(index, end_position, len(to_scrape))
+        for id in to_scrape:
+            await jobs.put((index, id))
+
+    workers = [asyncio.ensure_future(work()) for _ in range(concurrency if scrape else 0)]
+    reporter = asyncio.ensure_future(report())
+    try:
+        index = 0
+        batch: List[str] = []
+        position = progress.position
+        for position, value in read_urls(path, format, column, skip=progress.position):
+            progress.read += 1
+            url = normalize_url(value)
+            if not url.startswith(("http://", "https://")):
+                progress.invalid += 1
+                continue
+            digest = hashlib.blake2b(url.encode(), digest_size=8).digest()
+            if digest in seen:
+                progress.duplicates += 1
+                continue
+            seen.add(digest)
+            batch.append(url)
+            if len(batch) >= batch_size:
+                await upsert(index, batch, position)
+                index, batch = index + 1, []
+        if batch:
+            await upsert(index, batch, position)
+        else:
+            # Nothing left to upsert, the trailing invalid or duplicate records are done too
+            tracker.add(index, position, 0)
+        await jobs.join()
+    finally:
+        for task in workers + [reporter]:
+            task.cancel()
+        await asyncio.gather(*workers, reporter, return_exceptions=True)
+    logger.info(f"Import - done - {progress.report(time.monotonic() - start)}")
+    return progress
+
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def export_records(
+    path: str, format: str = "auto", status: Optional[str] = None, batch_size: int = 1000, progress_interval: float = 5
+) -> int:
+    """
+    Export the url records to NDJSON or CSV, streamed from a server-side cursor so memory stays constant
+    Args:
+        Input:
+            path: output file, gzipped if it ends with .gz, "-" for stdout
+            format: "ndjson", "csv" or "auto" from the file name (NDJSON unless .csv)
+            status: only export records with this status
+            batch_size: rows fetched per round trip
+        Output:
+            number of exported records
+    """
+    format = "csv" if file_format(path, format) == "csv" else "ndjson" if format == "auto" else format
+    columns = [column.key for column in crud.EXPORT_COLUMNS]
+    count = 0
+    start = last_report = time.monotonic()
+    with open_text(path, "w") as f:
+        writer = csv.writer(f) if format == "csv" else None
+        if writer:
+            writer.writerow(columns)
+        async with AsyncSessionLocal() as session:
+            async for row in crud.stream_url_entries(session, status=status, batch_size=batch_size):
+                values = [export_value(value) for value in row]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    f.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False) + "\n")
+                count += 1
+                if time.monotonic() - last_report >= progress_interval:
+                    last_report = time.monotonic()
+                    logger.info(f"Export - {count} records, {count / (last_report - start):.0f} records/s")
+    logger.info(f"Export - done - {count} records in {time.monotonic() - start:.1f}s")
+    return count
+
+
+async def run(args):
+    await init_db()
+    try:
+        if args.command == "import":
+            await open_http_client()
+            try:
+                await import_urls(
+                    args.path, args.format, args.column, args.batch_size, args.concurrency,
+                    scrape=not args.no_scrape, checkpoint_path=args.checkpoint, progress_interval=args.progress_interval,
+                )
+            finally:
+                await close_write_behind()
+                await close_http_client()
+                close_parse_pool()
+        else:
+            await export_records(args.path, args.format, args.status, args.batch_size, args.progress_interval)
+    finally:
+        await engine.dispose()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="insert and scrape the urls of a file")
+    importer.add_argument("path", help="newline or CSV file of urls, gzipped if it ends with .gz, - for stdin")
+    importer.add_argument("--format", choices=("auto", "lines", "csv"), default="auto")
+    importer.add_argument("--column", default="url", help="CSV column name or index")
+    importer.add_argument("--batch-size", type=int, default=1000, help="urls per multi-row insert")
+    importer.add_argument("--concurrency", type=int, default=20, help="scrapes in flight")
+    importer.add_argument("--no-scrape", action="store_true", help="only insert the records, as pending")
+    importer.add_argument("--checkpoint", help="JSON file to resume the import from")
+    importer.add_argument("--progress-interval", type=float, default=5, help="seconds between progress reports")
+
+    exporter = commands.add_parser("export", help="write the url records to NDJSON or CSV")
+    exporter.add_argument("path", help="output file, gzipped if it ends with .gz, - for stdout")
+    exporter.add_argument("--format", choices=("auto", "ndjson", "csv"), default="auto")
+    exporter.add_argument("--status", choices=("pending", "success", "failed"), help="only records with this status")
+    exporter.add_argument("--batch-size", type=int, default=1000, help="rows fetched per round trip")
+    exporter.add_argument("--progress-interval", type=float, default=5, help="seconds between progress reports")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
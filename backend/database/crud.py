@@ -1,100 +1,339 @@
+import base64
+from datetime import datetime
+from database.enums import URLStatus
 from database.models import URLRecord
-from database.session import AsyncSessionLocal
+from sqlalchemy import Row
 from sqlalchemy import select
+from sqlalchemy import tuple_
+from sqlalchemy import update
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
 from typing import List
 from typing import Optional
 from typing import Tuple
 
 
-async def create_url_entry(url: str) -> URLRecord:
+# Page metadata columns, written together with image_url
+METADATA_COLUMNS = (
+    URLRecord.title,
+    URLRecord.description,
+    URLRecord.site_name,
+    URLRecord.image_width,
+    URLRecord.image_height,
+    URLRecord.image_type,
+    URLRecord.twitter_card,
+    URLRecord.icon_url,
+)
+
+
+async def create_url_entry(session: AsyncSession, url: str) -> URLRecord:
     """
     Create url data record
     Args:
+        session: DB session
         url: input url
     """
-    async with AsyncSessionLocal() as session:
-        entry = URLRecord(url=url, status="pending")
-        session.add(entry)
-        await session.commit()
-        await session.refresh(entry)
-        return entry
+    entry = URLRecord(url=url, status="pending")
+    session.add(entry)
+    await session.commit()
+    await session.refresh(entry)
+    return entry
+
+
+def _insert_missing_statement(session: AsyncSession, urls: List[str]):
+    """
+    INSERT ... ON CONFLICT (url) DO NOTHING RETURNING for the session dialect.
+    Only the rows it creates are returned, an existing row is neither written nor locked.
+    """
+    dialects = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+    insert = dialects[session.bind.dialect.name]
+    stmt = insert(URLRecord).values([{"url": url, "status": URLStatus.PENDING.value} for url in urls])
+    return stmt.on_conflict_do_nothing(index_elements=[URLRecord.url]).returning(URLRecord)
+
+
+async def _select_by_urls(session: AsyncSession, urls: List[str]) -> List[URLRecord]:
+    result = await session.scalars(
+        select(URLRecord).where(URLRecord.url.in_(urls)), execution_options={"populate_existing": True}
+    )
+    return list(result.all())
+
+
+async def upsert_url_entry(session: AsyncSession, url: str) -> URLRecord:
+    """
+    Get the url data record, creating it if missing.
+    Concurrent calls for the same url never raise on the unique url constraint.
+    Args:
+        session: DB session
+        url: input url
+    """
+    return (await upsert_url_entries(session, [url]))[0]
+
+
+async def upsert_url_entries(session: AsyncSession, urls: List[str]) -> List[URLRecord]:
+    """
+    Get many url data records, creating the missing ones.
+    The existing rows are read first, so a submit of known urls stays a read. Only the missing ones are inserted,
+    with ON CONFLICT DO NOTHING, and the few a concurrent session inserted meanwhile are read after it.
+    Args:
+        session: DB session
+        urls: input urls
+    """
+    if not urls:
+        return []
+    entries = await _select_by_urls(session, urls)
+    missing = set(urls) - {entry.url for entry in entries}
+    if missing:
+        # Rows are inserted (and wait on each other's uncommitted inserts) in url order,
+        # two batches sharing urls in a different order can not deadlock
+        result = await session.scalars(
+            _insert_missing_statement(session, sorted(missing)), execution_options={"populate_existing": True}
+        )
+        created = list(result.all())
+        raced = missing - {entry.url for entry in created}
+        entries += created
+        if raced:
+            entries += await _select_by_urls(session, sorted(raced))
+    await session.commit()
+    return entries
+
+
+def url_entry_values(
+    image_url: Optional[str],
+    status: str,
+    attempt_count: int = 0,
+    next_retry_at: Optional[datetime] = None,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    max_age: Optional[int] = None,
+    validated_at: Optional[datetime] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Column values of a scrape result, see update_url_entry for the arguments
+    """
+    metadata = metadata or {}
+    return dict(
+        image_url=image_url,
+        status=status,
+        attempt_count=attempt_count,
+        next_retry_at=next_retry_at,
+        etag=etag,
+        last_modified=last_modified,
+        max_age=max_age,
+        validated_at=validated_at,
+        **{column.key: metadata.get(column.key) for column in METADATA_COLUMNS},
+    )
 
 
-async def update_url_entry(id: int, image_url: str, status: str):
+async def update_url_entry(
+    session: AsyncSession,
+    id: int,
+    image_url: Optional[str],
+    status: str,
+    attempt_count: int = 0,
+    next_retry_at: Optional[datetime] = None,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+    max_age: Optional[int] = None,
+    validated_at: Optional[datetime] = None,
+    metadata: Optional[Dict[str, Any]] = None,
+) -> Optional[URLRecord]:
     """
-    Update url data record
+    Update url data record with one UPDATE ... RETURNING, return the updated record
     Args:
+        session: DB session
         id: URLRecord id
         image_url: image url
         status: processing status
+        attempt_count: failed attempts in a row, reset by default
+        next_retry_at: earliest retry time after a failure, cleared by default
+        etag, last_modified, max_age: origin cache validators of the page, cleared by default
+        validated_at: time the origin last confirmed the content, cleared by default
+        metadata: page metadata by METADATA_COLUMNS key, missing keys are cleared
+    """
+    values = url_entry_values(
+        image_url, status, attempt_count, next_retry_at, etag, last_modified, max_age, validated_at, metadata
+    )
+    stmt = update(URLRecord).where(URLRecord.id == id).values(**values).returning(URLRecord)
+    result = await session.scalars(stmt, execution_options={"populate_existing": True})
+    entry = result.one_or_none()
+    await session.commit()
+    return entry
+
+
+async def update_url_entries(session: AsyncSession, rows: List[Dict[str, Any]]):
+    """
+    Update many url data records in one transaction, one UPDATE ... WHERE id executed for every row (executemany)
+    Args:
+        session: DB session
+        rows: the id and url_entry_values of each record
+    """
+    if not rows:
+        return
+    await session.execute(update(URLRecord), rows)
+    await session.commit()
+
+
+async def set_canonical_url(session: AsyncSession, id: int, canonical_url: Optional[str]):
+    """
+    Make the url data record an alias of its canonical url, or a record of its own again with None
+    Args:
+        session: DB session
+        id: URLRecord id
+        canonical_url: normalized canonical url
     """
-    async with AsyncSessionLocal() as session:
-        entry = await session.get(URLRecord, id)
-        if entry:
-            entry.image_url = image_url
-            entry.status = status
-            await session.commit()
+    await session.execute(update(URLRecord).where(URLRecord.id == id).values(canonical_url=canonical_url))
+    await session.commit()
 
 
-async def get_url_entry_by_url(url: str) -> Optional[URLRecord]:
+async def get_url_entry_by_url(session: AsyncSession, url: str) -> Optional[URLRecord]:
     """
     Get url data record by url
     Args:
+        session: DB session
         url: input url
     """
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(URLRecord).where(URLRecord.url == url))
-        return result.scalar_one_or_none()
+    result = await session.execute(select(URLRecord).where(URLRecord.url == url))
+    return result.scalar_one_or_none()
 
 
-async def get_url_entry_by_id(id: int) -> Optional[URLRecord]:
+async def get_url_entries_by_urls(session: AsyncSession, urls: List[str]) -> List[URLRecord]:
+    """
+    Get url data records of many urls with one SELECT ... WHERE url IN (...)
+    Args:
+        session: DB session
+        urls: input urls
+    """
+    if not urls:
+        return []
+    result = await session.execute(select(URLRecord).where(URLRecord.url.in_(urls)))
+    return result.scalars().all()
+
+
+async def get_url_entry_by_id(session: AsyncSession, id: int) -> Optional[URLRecord]:
     """
     Get url data record by id
     Args:
+        session: DB session
         url: URLRecord id
     """
-    async with AsyncSessionLocal() as session:
-        result = await session.execute(select(URLRecord).where(URLRecord.id == id))
-        return result.scalar_one_or_none()
+    result = await session.execute(select(URLRecord).where(URLRecord.id == id))
+    return result.scalar_one_or_none()
+
+
+# Columns returned by the history listing, projected into plain rows
+HISTORY_COLUMNS = (
+    URLRecord.id,
+    URLRecord.url,
+    URLRecord.image_url,
+    URLRecord.status,
+    URLRecord.next_retry_at,
+    URLRecord.title,
+    URLRecord.description,
+    URLRecord.site_name,
+    URLRecord.icon_url,
+    URLRecord.created_at,
+)
+
+
+# Columns written by the bulk export
+EXPORT_COLUMNS = (
+    URLRecord.id,
+    URLRecord.url,
+    URLRecord.image_url,
+    URLRecord.status,
+    *METADATA_COLUMNS,
+    URLRecord.canonical_url,
+    URLRecord.attempt_count,
+    URLRecord.next_retry_at,
+    URLRecord.validated_at,
+    URLRecord.created_at,
+)
+
+
+async def stream_url_entries(
+    session: AsyncSession, status: Optional[str] = None, batch_size: int = 1000
+) -> AsyncIterator[Row]:
+    """
+    Stream all url data records in id order with a server-side cursor, batch_size rows in memory at a time
+    Args:
+        session: DB session
+        status: only stream records with this status
+        batch_size: rows fetched per round trip
+    """
+    stmt = select(*EXPORT_COLUMNS).order_by(URLRecord.id)
+    if status:
+        stmt = stmt.where(URLRecord.status == status)
+    result = await session.stream(stmt.execution_options(yield_per=batch_size))
+    async for row in result:
+        yield row
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """
+    Opaque keyset cursor of a record: its (created_at, id) position
+    """
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Position of an opaque keyset cursor, raise ValueError if malformed
+    """
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except (TypeError, UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
 
 
 async def get_all_entries(
+    session: AsyncSession,
     limit: int = 10,
-    cursor: Optional[int] = None,
+    cursor: Optional[str] = None,
     is_desc_order: bool = True,
-) -> Tuple[List[URLRecord], Optional[int]]:
+    status: Optional[str] = None,
+) -> Tuple[List[Row], Optional[str]]:
     """
-    Get all entries
+    Get all entries, keyset paginated on (created_at, id), so a deep page costs the same as the first one
     Args:
     Inputs:
+        session: DB session
         limit: size per page
-        cursor: URLRecord id.
-            If invalid, get the first limit number of records, else, filter from cursor
-            Note: the output will include this cursor's URLRecord
-        is_desc_order: if False, sort in descending order, else, sort in ascending order
+        cursor: next_cursor of the previous page, None for the first page.
+            Raise ValueError if malformed
+        is_desc_order: if True, newest first, else, oldest first
+        status: only list records with this status
     Outputs:
-        list of URLRecord
-        next cursor
-    """
-    async with AsyncSessionLocal() as session:
-        stmt = select(URLRecord)
-        if cursor:
-            if is_desc_order:
-                stmt = stmt.where(URLRecord.id <= cursor)
-            else:
-                stmt = stmt.where(URLRecord.id >= cursor)
-
-        stmt = stmt.order_by(URLRecord.id.desc() if is_desc_order else URLRecord.id.asc())
-        stmt = stmt.limit(limit + 1) # fetch one extra to determine if next_cursor is available
-
-        result = await session.execute(stmt)
-        entries = result.scalars().all()
-
-        # Check for next cursor
-        has_more = len(entries) > limit
-        if has_more:
-            next_cursor = entries[-1].id
-            entries = entries[:-1]  # Remove the extra one
-        else:
-            next_cursor = None
-        return entries, next_cursor
+        list of rows with the HISTORY_COLUMNS, no ORM objects
+        next cursor, None on the last page
+    """
+    stmt = select(*HISTORY_COLUMNS)
+    if status:
+        stmt = stmt.where(URLRecord.status == status)
+    if cursor:
+        position = tuple_(URLRecord.created_at, URLRecord.id)
+        after = tuple_(*decode_cursor(cursor))
+        stmt = stmt.where(position < after if is_desc_order else position > after)
+
+    if is_desc_order:
+        stmt = stmt.order_by(URLRecord.created_at.desc(), URLRecord.id.desc())
+    else:
+        stmt = stmt.order_by(URLRecord.created_at.asc(), URLRecord.id.asc())
+    stmt = stmt.limit(limit + 1) # fetch one extra to determine if next_cursor is available
+
+    result = await session.execute(stmt)
+    entries = result.all()
+
+    # Check for next cursor
+    has_more = len(entries) > limit
+    if has_more:
+        entries = entries[:-1]  # Remove the extra one
+        next_cursor = encode_cursor(entries[-1].created_at, entries[-1].id)
+    else:
+        next_cursor = None
+    return entries, next_cursor
@@ -1,9 +1,12 @@
+from datetime import datetime
+from datetime import timezone
 from database.enums import URLStatus
 from sqlalchemy import Column
 from sqlalchemy import Integer
 from sqlalchemy import String
 from sqlalchemy import DateTime
 from sqlalchemy import Enum
+from sqlalchemy import Index
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.sql import func
 
@@ -21,4 +24,28 @@ class URLRecord(Base):
     url = Column(String, unique=True, nullable=False) # user input url
     image_url = Column(String, nullable=True) # og tag scrapped image_url
     status = Column(String, default=URLStatus.PENDING.value, nullable=False)
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    attempt_count = Column(Integer, default=0, nullable=False) # failed scrape attempts in a row
+    next_retry_at = Column(DateTime(timezone=True), nullable=True) # no re-scrape before this time after a failure
+    etag = Column(String, nullable=True) # origin ETag of the scraped page, sent back as If-None-Match
+    last_modified = Column(String, nullable=True) # origin Last-Modified, sent back as If-Modified-Since
+    max_age = Column(Integer, nullable=True) # origin freshness lifetime in seconds, from Cache-Control / Expires
+    validated_at = Column(DateTime(timezone=True), nullable=True) # last time the origin confirmed the content (200 or 304)
+    # Page metadata, read in the same pass as image_url
+    title = Column(String, nullable=True) # og:title, else twitter:title, else <title>
+    description = Column(String, nullable=True) # og:description, else twitter:description, else meta description
+    site_name = Column(String, nullable=True) # og:site_name
+    image_width = Column(Integer, nullable=True) # og:image:width of the og image
+    image_height = Column(Integer, nullable=True) # og:image:height of the og image
+    image_type = Column(String, nullable=True) # og:image:type of the og image
+    twitter_card = Column(String, nullable=True) # twitter:card
+    icon_url = Column(String, nullable=True) # <link rel="icon">, absolute
+    # Set on an alias: the page declared this <link rel="canonical">, submits of the url are served its record
+    canonical_url = Column(String, nullable=True)
+    # Set by the app too, so every row carries the same precision and keyset cursors compare exactly
+    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), server_default=func.now())
+
+    __table_args__ = (
+        # /history keyset pagination, newest first, optionally filtered by status
+        Index("ix_url_records_created_at_id", "created_at", "id"),
+        Index("ix_url_records_status_created_at_id", "status", "created_at", "id"),
+    )
@@ -1,14 +1,47 @@
 from database.models import Base
 from settings import DATABASE_URL
+from settings import DB_MAX_OVERFLOW
+from settings import DB_POOL_PRE_PING
+from settings import DB_POOL_RECYCLE_SECONDS
+from settings import DB_POOL_SIZE
+from settings import DB_POOL_TIMEOUT_SECONDS
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.ext.asyncio import AsyncSession
+from typing import AsyncIterator
+
+
+def engine_options(url: str) -> dict:
+    """
+    Connection pool settings. SQLite (unit tests) keeps the SQLAlchemy defaults.
+    """
+    if url.startswith("sqlite"):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_SECONDS,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_recycle": DB_POOL_RECYCLE_SECONDS,
+    }
 
 
 # Create database connection sessions
-engine = create_async_engine(DATABASE_URL) # Optional: Add echo=True to see all print logging
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL)) # Optional: Add echo=True to see all print logging
 AsyncSessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
 
 async def init_db():
+    """
+    Create the schema, run once at startup
+    """
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+
+
+async def get_session() -> AsyncIterator[AsyncSession]:
+    """
+    FastAPI dependency: one session per request, shared by every crud call of the request.
+    The connection is only checked out on the first query.
+    """
+    async with AsyncSessionLocal() as session:
+        yield session
@@ -1,8 +1,32 @@
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi import Response
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router
+from database.session import engine
 from database.session import init_db
+from services.host_scheduler import get_host_scheduler
+from services.http_client import close_http_client
+from services.hot_urls import HotURLRefresher
+from services.http_client import open_http_client
+from services.image_proxy import close_resize_pool
+from services.local_cache import cache_invalidator
+from services.local_cache import local_cache
+from services.metrics import CONTENT_TYPE
+from services.metrics import HOST_SLOTS_ACTIVE
+from services.metrics import HOST_SLOTS_WAITING
+from services.metrics import LOCAL_CACHE_SIZE
+from services.metrics import REGISTRY
+from services.metrics import instrument_engine
+from services.og_scraper import close_write_behind
+from services.parse_pool import close_parse_pool
+from services.scrape_queue import ScrapeWorkerPool
+from services.scrape_queue import get_scrape_queue
+from settings import HOT_REFRESH_ENABLED
+from settings import LOCAL_CACHE_ENABLED
+from settings import LOCAL_CACHE_INVALIDATION_ENABLED
+from settings import SCRAPE_WORKERS_IN_APP
 
 
 logging.basicConfig(
@@ -11,9 +35,47 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await init_db()
+    await open_http_client()
+    if LOCAL_CACHE_ENABLED and LOCAL_CACHE_INVALIDATION_ENABLED:
+        cache_invalidator.start()
+    worker_pool = ScrapeWorkerPool(get_scrape_queue()) if SCRAPE_WORKERS_IN_APP else None
+    if worker_pool:
+        worker_pool.start()
+    refresher = HotURLRefresher() if HOT_REFRESH_ENABLED else None
+    if refresher:
+        refresher.start()
+    yield
+    if refresher:
+        await refresher.stop()
+    if worker_pool:
+        await worker_pool.stop()
+    await close_write_behind()
+    await cache_invalidator.stop()
+    await close_http_client()
+    close_resize_pool()
+    close_parse_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 app.include_router(router, prefix="/api")
 
+instrument_engine(engine)
+HOST_SLOTS_ACTIVE.set_function(lambda: get_host_scheduler().active)
+HOST_SLOTS_WAITING.set_function(lambda: get_host_scheduler().waiting())
+LOCAL_CACHE_SIZE.set_function(lambda: len(local_cache))
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """
+    Metrics of this worker in the Prometheus text format
+    """
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
+
 # Note: after deploy to the prod, we can add the prod host
 origins = [
     "http://localhost:5173", # Vite dev server
@@ -25,8 +87,3 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-
-@app.on_event("startup")
-async def startup():
-    await init_db()
@@ -0,0 +1,264 @@
+import asyncio
+import httpcore
+import ipaddress
+import logging
+import socket
+import time
+from services.local_cache import LocalTTLCache
+from services.metrics import DNS_BLOCKED
+from services.metrics import DNS_CACHE_HIT
+from services.metrics import DNS_CACHE_MISS
+from services.metrics import DNS_CACHE_NEGATIVE_HIT
+from services.metrics import DNS_LOOKUP_ERROR
+from services.metrics import DNS_LOOKUP_NXDOMAIN
+from services.metrics import DNS_LOOKUP_OK
+from services.single_flight import SingleFlight
+from settings import DNS_CACHE_DEFAULT_TTL_SECONDS
+from settings import DNS_CACHE_MAX_SIZE
+from settings import DNS_CACHE_MAX_TTL_SECONDS
+from settings import DNS_CACHE_MIN_TTL_SECONDS
+from settings import DNS_CACHE_NEGATIVE_TTL_SECONDS
+from settings import DNS_CACHE_REFRESH_AHEAD_SECONDS
+from settings import DNS_RESOLVER
+from settings import SCRAPER_BLOCK_PRIVATE_ADDRESSES
+from typing import Awaitable
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# A resolver returns the addresses of a host and their TTL, None if it does not know it.
+# It raises socket.gaierror, with one of NXDOMAIN_ERRORS when the host does not exist.
+Resolver = Callable[[str], Awaitable[Tuple[List[str], Optional[float]]]]
+NXDOMAIN_ERRORS = frozenset(
+    code for code in (socket.EAI_NONAME, getattr(socket, "EAI_NODATA", None)) if code is not None
+)
+
+
+class BlockedAddress(httpcore.ConnectError):
+    """
+    The host only resolves to addresses the scraper must not connect to, httpx raises it as a ConnectError
+    """
+
+
+def aiodns_available() -> bool:
+    """
+    The aiodns resolver needs the optional aiodns package (pip install aiodns)
+    """
+    try:
+        import aiodns  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+async def system_resolve(host: str) -> Tuple[List[str], Optional[float]]:
+    """
+    Resolve with getaddrinfo, in the default executor of the loop. The system resolver gives no TTL.
+    """
+    infos = await asyncio.get_running_loop().getaddrinfo(host, None, type=socket.SOCK_STREAM)
+    return list(dict.fromkeys(info[4][0] for info in infos)), None
+
+
+class AIODNSResolver:
+    """
+    Resolve A and AAAA records with c-ares, the TTL is the lowest TTL of the answers
+    """
+    def __init__(self):
+        import aiodns
+        self._resolver = aiodns.DNSResolver()
+        self._error = aiodns.error.DNSError
+        # c-ares codes of a name without the queried records, or without any
+        self._not_found = (aiodns.error.ARES_ENOTFOUND, aiodns.error.ARES_ENODATA)
+
+    async def _query(self, host: str, record_type: str) -> list:
+        try:
+            return await self._resolver.query(host, record_type)
+        except self._error as e:
+            if e.args and e.args[0] in self._not_found:
+                return []
+            raise socket.gaierror(socket.EAI_AGAIN, f"{host}: {e}") from e
+
+    async def __call__(self, host: str) -> Tuple[List[str], Optional[float]]:
+        answers = [answer for answers in await asyncio.gather(self._query(host, "A"), self._query(host, "AAAA"))
+                   for answer in answers]
+        if not answers:
+            raise socket.gaierror(socket.EAI_NONAME, f"{host}: not found")
+        return list(dict.fromkeys(answer.host for answer in answers)), min(answer.ttl for answer in answers)
+
+
+def is_public_address(address: str) -> bool:
+    """
+    Check an address is globally routable: not loopback, private, link-local, shared, reserved or multicast
+    """
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def _ip_literal(host: str) -> Optional[str]:
+    try:
+        return str(ipaddress.ip_address(host.strip("[]")))
+    except ValueError:
+        return None
+
+
+class DNSCache:
+    """
+    Bounded cache of host addresses in front of a resolver, for the scraper connections.
+    Answers are kept for their TTL (clamped to min_ttl / max_ttl, default_ttl when the resolver has none),
+    hosts that do not exist for negative_ttl. Concurrent lookups of a host share one resolver call.
+    A host used within refresh_ahead seconds of its expiry is resolved again in the background,
+    so the hosts scraped all the time never wait for the resolver.
+    With block_private, addresses that are not public are dropped and a host left without any raises
+    BlockedAddress, every connection goes through here, redirects included, so this is the SSRF guard.
+    Args:
+        clock: monotonic seconds, for tests
+    """
+    def __init__(
+        self,
+        resolver: Optional[Resolver] = None,
+        max_size: int = DNS_CACHE_MAX_SIZE,
+        default_ttl: float = DNS_CACHE_DEFAULT_TTL_SECONDS,
+        min_ttl: float = DNS_CACHE_MIN_TTL_SECONDS,
+        max_ttl: float = DNS_CACHE_MAX_TTL_SECONDS,
+        negative_ttl: float = DNS_CACHE_NEGATIVE_TTL_SECONDS,
+        refresh_ahead: float = DNS_CACHE_REFRESH_AHEAD_SECONDS,
+        block_private: bool = SCRAPER_BLOCK_PRIVATE_ADDRESSES,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.resolver = resolver or system_resolve
+        self.default_ttl = default_ttl
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        self.refresh_ahead = refresh_ahead
+        self.block_private = block_private
+        self.clock = clock
+        # host -> (addresses, None for a host that does not exist, and when to refresh it ahead)
+        self._cache = LocalTTLCache(max_size, clock=clock)
+        self._flight = SingleFlight()
+        self._refreshing: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def resolve(self, host: str) -> List[str]:
+        """
+        Addresses to connect to for a host, from the cache or the resolver.
+        Raise socket.gaierror if it can not be resolved, BlockedAddress if none of its addresses is allowed.
+        """
+        literal = _ip_literal(host)
+        if literal is not None:
+            return self._allowed(host, [literal])
+        host = host.lower().rstrip(".")
+        item = self._cache.get(host)
+        if item is None:
+            DNS_CACHE_MISS.inc()
+            item = await self._flight.do(host, lambda: self._lookup(host))
+        else:
+            addresses, refresh_at = item
+            (DNS_CACHE_HIT if addresses is not None else DNS_CACHE_NEGATIVE_HIT).inc()
+            if addresses is not None and refresh_at <= self.clock() and host not in self._refreshing:
+                self._refreshing.add(host)
+                asyncio.ensure_future(self._refresh(host))
+        addresses, _ = item
+        if addresses is None:
+            raise socket.gaierror(socket.EAI_NONAME, f"{host}: not found")
+        return self._allowed(host, addresses)
+
+    async def _lookup(self, host: str) -> Tuple[Optional[List[str]], float]:
+        start = time.perf_counter()
+        try:
+            addresses, ttl = await self.resolver(host)
+        except socket.gaierror as e:
+            if e.errno not in NXDOMAIN_ERRORS:
+                DNS_LOOKUP_ERROR.observe(time.perf_counter() - start)
+                raise
+            DNS_LOOKUP_NXDOMAIN.observe(time.perf_counter() - start)
+            item = (None, float("inf"))
+            self._cache.set(host, item, self.negative_ttl)
+            return item
+        except Exception:
+            DNS_LOOKUP_ERROR.observe(time.perf_counter() - start)
+            raise
+        DNS_LOOKUP_OK.observe(time.perf_counter() - start)
+        ttl = min(self.max_ttl, max(self.min_ttl, self.default_ttl if ttl is None else ttl))
+        item = (addresses, self.clock() + ttl - self.refresh_ahead if self.refresh_ahead > 0 else float("inf"))
+        self._cache.set(host, item, ttl)
+        return item
+
+    async def _refresh(self, host: str):
+        try:
+            await self._flight.do(host, lambda: self._lookup(host))
+        except Exception as e:
+            # The cached answer is kept until it expires
+            logger.info(f"DNS refresh of {host} failed: {e}")
+        finally:
+            self._refreshing.discard(host)
+
+    def _allowed(self, host: str, addresses: List[str]) -> List[str]:
+        if not self.block_private:
+            return addresses
+        allowed = [address for address in addresses if is_public_address(address)]
+        if not allowed:
+            DNS_BLOCKED.inc()
+            raise BlockedAddress(f"{host} resolves to non public addresses only: {', '.join(addresses)}")
+        return allowed
+
+
+class CachedDNSBackend(httpcore.AsyncNetworkBackend):
+    """
+    httpcore network backend connecting to the addresses of the DNS cache, one after the other.
+    TLS still verifies and sends the host name (SNI), only the TCP connection uses the address.
+    """
+    def __init__(self, dns_cache: DNSCache, backend: Optional[httpcore.AsyncNetworkBackend] = None):
+        self.dns_cache = dns_cache
+        self._backend = backend or httpcore.AnyIOBackend()
+
+    async def connect_tcp(self, host, port, timeout=None, local_address=None, socket_options=None):
+        try:
+            addresses = await asyncio.wait_for(self.dns_cache.resolve(host), timeout)
+        except asyncio.TimeoutError as e:
+            raise httpcore.ConnectTimeout(f"Resolving {host} timed out") from e
+        except socket.gaierror as e:
+            raise httpcore.ConnectError(f"Resolving {host} failed: {e}") from e
+        error = None
+        for address in addresses:
+            try:
+                return await self._backend.connect_tcp(
+                    address, port, timeout=timeout, local_address=local_address, socket_options=socket_options
+                )
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        raise error
+
+    async def connect_unix_socket(self, path, timeout=None, socket_options=None):
+        return await self._backend.connect_unix_socket(path, timeout=timeout, socket_options=socket_options)
+
+    async def sleep(self, seconds: float):
+        await self._backend.sleep(seconds)
+
+
+_dns_cache: Optional[DNSCache] = None
+
+
+def get_dns_cache() -> DNSCache:
+    """
+    Get the process wide DNS cache of the scraper, on the DNS_RESOLVER resolver
+    """
+    global _dns_cache
+    if _dns_cache is None:
+        resolver = None
+        if DNS_RESOLVER == "aiodns":
+            if aiodns_available():
+                resolver = AIODNSResolver()
+            else:
+                logger.warning("DNS_RESOLVER is aiodns but the aiodns package is missing, using the system resolver")
+        _dns_cache = DNSCache(resolver)
+    return _dns_cache
@@ -0,0 +1,43 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import BrokenExecutor
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any
+from typing import Callable
+from typing import Optional
+
+
+class LazyExecutor:
+    """
+    Executor for CPU bound work off the event loop, created on first use.
+    If a worker dies (killed, out of memory or crashed on its input) the call raises,
+    and the next call starts a new executor.
+    """
+    def __init__(self, factory: Callable[[], Executor]):
+        self._factory = factory
+        self._executor: Optional[Executor] = None
+
+    async def run(self, fn: Callable[[], Any]) -> Any:
+        if self._executor is None:
+            self._executor = self._factory()
+        executor = self._executor
+        try:
+            return await asyncio.get_running_loop().run_in_executor(executor, fn)
+        except BrokenExecutor:
+            if self._executor is executor:
+                self._executor = None
+            raise
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def spawn_process_pool(workers: int) -> LazyExecutor:
+    """
+    Process pool of workers processes. They are spawned, not forked: the API process runs an event loop
+    and threads, a forked child would inherit their state half way through.
+    """
+    return LazyExecutor(lambda: ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")))
@@ -0,0 +1,372 @@
+import asyncio
+import httpx
+import logging
+import math
+import time
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from settings import REDIS_CLIENT
+from settings import SCRAPER_HOST_BURST
+from settings import SCRAPER_HOST_LIMITS_REDIS_ENABLED
+from settings import SCRAPER_HOST_LIMITS_REDIS_PREFIX
+from settings import SCRAPER_HOST_QUEUE_TIMEOUT_SECONDS
+from settings import SCRAPER_HOST_RATE_PER_SECOND
+from settings import SCRAPER_MAX_ACTIVE_SCRAPES
+from settings import SCRAPER_MAX_CONNECTIONS_PER_HOST
+from settings import SCRAPER_TOTAL_TIMEOUT_SECONDS
+from typing import AsyncIterator
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import TypeVar
+
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Returns 0 once a lease is taken, the milliseconds to wait for a token or the end of a Retry-After block,
+# or -1 when the host already has max_concurrency leases. Leases expire, so a dead worker frees its slot.
+ACQUIRE_HOST_SCRIPT = """
+local now = tonumber(ARGV[1])
+local blocked = redis.call("pttl", KEYS[3])
+if blocked > 0 then
+    return blocked
+end
+redis.call("zremrangebyscore", KEYS[1], "-inf", now)
+if redis.call("zcard", KEYS[1]) >= tonumber(ARGV[2]) then
+    return -1
+end
+local rate = tonumber(ARGV[3])
+if rate > 0 then
+    local burst = tonumber(ARGV[4])
+    local bucket = redis.call("hmget", KEYS[2], "tokens", "ts")
+    local tokens = tonumber(bucket[1]) or burst
+    local ts = tonumber(bucket[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+    if tokens < 1 then
+        redis.call("hset", KEYS[2], "tokens", tostring(tokens), "ts", now)
+        return math.ceil((1 - tokens) * 1000 / rate)
+    end
+    redis.call("hset", KEYS[2], "tokens", tostring(tokens - 1), "ts", now)
+    redis.call("pexpire", KEYS[2], math.ceil(burst * 1000 / rate) + 1000)
+end
+redis.call("zadd", KEYS[1], now + tonumber(ARGV[6]), ARGV[5])
+redis.call("pexpire", KEYS[1], ARGV[6])
+return 0
+"""
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header, either delay seconds or an HTTP date. None if missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+def url_host(url: str) -> str:
+    """
+    Host the url is scheduled under, empty for urls httpx can not parse (their fetch fails anyway)
+    """
+    try:
+        return httpx.URL(url).host
+    except Exception:
+        return ""
+
+
+def interleave_by_host(items: Iterable[T], host_of: Callable[[T], Hashable]) -> List[T]:
+    """
+    Reorder items round-robin across their hosts, keeping the order within a host.
+    Jobs started in this order do not wait behind every url of the biggest host.
+    """
+    by_host: Dict[Hashable, Deque[T]] = {}
+    for item in items:
+        by_host.setdefault(host_of(item), deque()).append(item)
+    queues = deque(by_host.values())
+    ordered = []
+    while queues:
+        queue = queues.popleft()
+        ordered.append(queue.popleft())
+        if queue:
+            queues.append(queue)
+    return ordered
+
+
+class HostQueueTimeout(asyncio.TimeoutError):
+    """
+    No slot of the host was granted within the queue timeout, the request was not sent
+    """
+
+
+class RedisHostLimiter:
+    """
+    Per host concurrency, request rate and Retry-After blocks shared by every worker through Redis.
+    """
+    def __init__(
+        self,
+        redis_client,
+        max_per_host: int,
+        rate_per_second: float,
+        burst: int,
+        prefix: str = SCRAPER_HOST_LIMITS_REDIS_PREFIX,
+        lease_ttl: float = SCRAPER_TOTAL_TIMEOUT_SECONDS * 2,
+        poll_interval: float = 0.05,
+    ):
+        self.redis = redis_client
+        self.max_per_host = max_per_host
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.prefix = prefix
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+
+    def _keys(self, host: str) -> List[str]:
+        return [f"{self.prefix}{host}:leases", f"{self.prefix}{host}:bucket", f"{self.prefix}{host}:blocked"]
+
+    async def acquire(self, host: str, timeout: Optional[float] = None) -> str:
+        """
+        Wait for a shared slot of the host, return the lease to release.
+        Raise HostQueueTimeout if none was granted within timeout seconds.
+        """
+        lease = uuid.uuid4().hex
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait_ms = await self.redis.eval(
+                ACQUIRE_HOST_SCRIPT, 3, *self._keys(host),
+                int(time.time() * 1000), self.max_per_host, self.rate_per_second, self.burst,
+                lease, int(self.lease_ttl * 1000),
+            )
+            wait_ms = int(wait_ms)
+            if wait_ms == 0:
+                return lease
+            delay = self.poll_interval if wait_ms < 0 else wait_ms / 1000
+            if deadline is not None:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise HostQueueTimeout(f"No shared slot of {host} within {timeout}s")
+                delay = min(delay, left)
+            await asyncio.sleep(delay)
+
+    async def release(self, host: str, lease: str):
+        await self.redis.zrem(self._keys(host)[0], lease)
+
+    async def block(self, host: str, seconds: float):
+        if seconds > 0:
+            await self.redis.set(self._keys(host)[2], "1", px=max(1, int(seconds * 1000)))
+
+
+class _HostState:
+    __slots__ = ("waiters", "active", "tokens", "updated_at", "blocked_until", "queued")
+
+    def __init__(self, burst: int, now: float):
+        self.waiters: Deque[asyncio.Future] = deque()
+        self.active = 0
+        self.tokens = float(burst)
+        self.updated_at = now
+        self.blocked_until = 0.0
+        self.queued = False  # in the round-robin ring
+
+
+class HostScheduler:
+    """
+    Politeness scheduler for outbound scrapes, one slot per request:
+    - at most max_per_host requests in flight per host
+    - a token bucket per host, rate_per_second requests with bursts of burst (0 rate disables it)
+    - a host answering 429/503 is paused for its Retry-After (see penalize)
+    - slots are handed out round-robin across the waiting hosts, within max_active for the process,
+      so a batch of thousands of links to one host can not starve the other hosts
+    With a RedisHostLimiter, the host limits are also shared by every worker.
+    """
+    def __init__(
+        self,
+        max_per_host: int = SCRAPER_MAX_CONNECTIONS_PER_HOST,
+        rate_per_second: float = SCRAPER_HOST_RATE_PER_SECOND,
+        burst: int = SCRAPER_HOST_BURST,
+        max_active: int = SCRAPER_MAX_ACTIVE_SCRAPES,
+        shared: Optional[RedisHostLimiter] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_per_host = max_per_host
+        self.rate_per_second = rate_per_second
+        self.burst = max(1, burst)
+        self.max_active = max_active
+        self.shared = shared
+        self.clock = clock
+        self._hosts: Dict[str, _HostState] = {}
+        self._ring: Deque[str] = deque()
+        self._active = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._prune_at = 1024
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    def waiting(self) -> int:
+        return sum(len(state.waiters) for state in self._hosts.values())
+
+    @asynccontextmanager
+    async def slot(self, host: str, timeout: Optional[float] = SCRAPER_HOST_QUEUE_TIMEOUT_SECONDS) -> AsyncIterator[None]:
+        """
+        Hold a request slot of the host. Raise HostQueueTimeout if none was granted within timeout seconds,
+        the shared slot included: the local slot, counted against max_active, is not held past the timeout.
+        """
+        start = time.monotonic()
+        try:
+            await self._acquire(host, timeout)
+        except asyncio.TimeoutError:
+            raise HostQueueTimeout(f"No slot of {host} within {timeout}s") from None
+        try:
+            if self.shared:
+                left = None if timeout is None else max(0.0, timeout - (time.monotonic() - start))
+                lease = await self.shared.acquire(host, left)
+            else:
+                lease = None
+            try:
+                yield
+            finally:
+                if lease:
+                    await self.shared.release(host, lease)
+        finally:
+            self._release(host)
+
+    async def penalize(self, host: str, seconds: float):
+        """
+        Pause the host, after a 429/503 or its Retry-After
+        """
+        state = self._state(host, self.clock())
+        state.blocked_until = max(state.blocked_until, self.clock() + seconds)
+        if self.shared:
+            await self.shared.block(host, seconds)
+        logger.info(f"Host scheduler - host: {host} paused for {seconds:.1f}s")
+
+    def _state(self, host: str, now: float) -> _HostState:
+        state = self._hosts.get(host)
+        if state is None:
+            if len(self._hosts) >= self._prune_at:
+                self._prune(now)
+            state = self._hosts[host] = _HostState(self.burst, now)
+        return state
+
+    async def _acquire(self, host: str, timeout: Optional[float]):
+        state = self._state(host, self.clock())
+        waiter = asyncio.get_running_loop().create_future()
+        state.waiters.append(waiter)
+        if not state.queued:
+            state.queued = True
+            self._ring.append(host)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except BaseException:
+            if waiter.done() and not waiter.cancelled():
+                self._release(host)  # granted while being cancelled
+            elif waiter in state.waiters:
+                state.waiters.remove(waiter)
+            raise
+
+    def _release(self, host: str):
+        self._hosts[host].active -= 1
+        self._active -= 1
+        self._dispatch()
+
+    def _wait_seconds(self, state: _HostState, now: float) -> float:
+        """
+        0 if the host can start a request now, else the seconds until it can (inf until a slot is released)
+        """
+        if state.blocked_until > now:
+            return state.blocked_until - now
+        if state.active >= self.max_per_host:
+            return math.inf
+        if self.rate_per_second > 0:
+            state.tokens = min(self.burst, state.tokens + (now - state.updated_at) * self.rate_per_second)
+            state.updated_at = now
+            if state.tokens < 1:
+                return (1 - state.tokens) / self.rate_per_second
+        return 0
+
+    def _dispatch(self):
+        """
+        Grant slots, one per host per round, while the process has slots left
+        """
+        now = self.clock()
+        wake_in = math.inf
+        granted = True
+        while granted and self._ring and self._active < self.max_active:
+            granted = False
+            for _ in range(len(self._ring)):
+                if self._active >= self.max_active:
+                    break
+                host = self._ring.popleft()
+                state = self._hosts[host]
+                while state.waiters and state.waiters[0].done():
+                    state.waiters.popleft()  # timed out or cancelled
+                if not state.waiters:
+                    state.queued = False
+                    continue
+                wait = self._wait_seconds(state, now)
+                if wait == 0:
+                    if self.rate_per_second > 0:
+                        state.tokens -= 1
+                    state.active += 1
+                    self._active += 1
+                    state.waiters.popleft().set_result(None)
+                    granted = True
+                else:
+                    wake_in = min(wake_in, wait)
+                if state.waiters:
+                    self._ring.append(host)
+                else:
+                    state.queued = False
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if wake_in != math.inf and self._ring:
+            self._timer = asyncio.get_running_loop().call_later(wake_in, self._dispatch)
+
+    def _prune(self, now: float):
+        """
+        Forget idle hosts whose bucket is full again, so the map does not grow with every domain we ever scraped
+        """
+        for host, state in list(self._hosts.items()):
+            refilled = self.rate_per_second <= 0 or \
+                state.tokens + (now - state.updated_at) * self.rate_per_second >= self.burst
+            if not state.waiters and not state.active and state.blocked_until <= now and refilled:
+                del self._hosts[host]
+        self._prune_at = max(1024, len(self._hosts) * 2)
+
+
+_scheduler: Optional[HostScheduler] = None
+
+
+def get_host_scheduler() -> HostScheduler:
+    """
+    Get the process wide host scheduler, shared through Redis when SCRAPER_HOST_LIMITS_REDIS_ENABLED
+    """
+    global _scheduler
+    if _scheduler is None:
+        shared = None
+        if SCRAPER_HOST_LIMITS_REDIS_ENABLED:
+            shared = RedisHostLimiter(
+                REDIS_CLIENT, SCRAPER_MAX_CONNECTIONS_PER_HOST, SCRAPER_HOST_RATE_PER_SECOND, SCRAPER_HOST_BURST
+            )
+        _scheduler = HostScheduler(shared=shared)
+    return _scheduler
@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime
+from datetime import timezone
+from database import crud
+from database.enums import URLStatus
+from database.session import AsyncSessionLocal
+from services.metrics import HOT_REFRESHED
+from services.metrics import HOT_REWARMED
+from services.og_scraper import cache_key
+from services.og_scraper import cache_save
+from services.og_scraper import fresh_seconds_left
+from services.og_scraper import process_og_url_by_entry_id
+from settings import HOT_REFRESH_AHEAD_SECONDS
+from settings import HOT_REFRESH_CONCURRENCY
+from settings import HOT_REFRESH_INTERVAL_SECONDS
+from settings import HOT_REFRESH_LOCK_TTL_SECONDS
+from settings import HOT_REFRESH_MAX_PER_CYCLE
+from settings import HOT_REFRESH_TOP_K
+from settings import HOT_URLS_DECAY
+from settings import HOT_URLS_KEY
+from settings import HOT_URLS_MAX_TRACKED
+from settings import HOT_URLS_MIN_SCORE
+from settings import REDIS_CLIENT
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Hot urls whose score decayed below this are forgotten
+FORGET_SCORE = 1
+
+# End the refresh cycle of ARGV[1]: its lock is kept for the ARGV[2] milliseconds left of the interval,
+# so no other worker starts a second cycle in it, or deleted if the cycle outlasted the interval
+RELEASE_CYCLE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(ARGV[2]) > 0 then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return redis.call("del", KEYS[1])
+"""
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class AccessTracker:
+    """
+    Access counts of the submitted urls in this worker, drained into the Redis sorted set of hot urls by the refresher.
+    record() is a dict update, the submit path makes no Redis call for it.
+    At most max_size urls are counted between two drains, new urls past it are dropped.
+    """
+    def __init__(self, max_size: int = HOT_URLS_MAX_TRACKED):
+        self.max_size = max_size
+        self._counts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def record(self, url: str):
+        counts = self._counts
+        if url in counts:
+            counts[url] += 1
+        elif len(counts) < self.max_size:
+            counts[url] = 1
+
+    def drain(self) -> Dict[str, int]:
+        counts, self._counts = self._counts, {}
+        return counts
+
+
+access_tracker = AccessTracker()
+
+
+class HotURLRefresher:
+    """
+    Keeps the hottest urls warm: every interval, the access counts of the workers are added to a decaying score
+    in a Redis sorted set, and the top_k urls scored at least min_score are checked against their freshness.
+    A url whose record goes stale within ahead_seconds is re-scraped (conditionally) before it expires,
+    a url whose record is still fresh in the DB but gone from the cache is saved to the cache again.
+    Re-scrapes are bounded to max_per_cycle per interval, the outbound budget, and go through the host scheduler.
+    Each worker drains its counts every interval, a Redis lock lets one worker per interval decay and refresh.
+    The lock is held for the whole cycle, lock_ttl only bounds the lock of a worker that died mid-cycle.
+    Args:
+        clock: current utc datetime, for tests
+    """
+    def __init__(
+        self,
+        redis_client=REDIS_CLIENT,
+        tracker: AccessTracker = access_tracker,
+        key: str = HOT_URLS_KEY,
+        interval: float = HOT_REFRESH_INTERVAL_SECONDS,
+        lock_ttl: float = HOT_REFRESH_LOCK_TTL_SECONDS,
+        top_k: int = HOT_REFRESH_TOP_K,
+        ahead_seconds: float = HOT_REFRESH_AHEAD_SECONDS,
+        max_per_cycle: int = HOT_REFRESH_MAX_PER_CYCLE,
+        concurrency: int = HOT_REFRESH_CONCURRENCY,
+        min_score: float = HOT_URLS_MIN_SCORE,
+        decay: float = HOT_URLS_DECAY,
+        max_tracked: int = HOT_URLS_MAX_TRACKED,
+        clock: Callable[[], datetime] = utc_now,
+    ):
+        self.redis = redis_client
+        self.tracker = tracker
+        self.key = key
+        self.lock_key = f"{key}:lock"
+        self.interval = interval
+        self.lock_ttl = max(lock_ttl, interval)
+        self.top_k = top_k
+        self.ahead_seconds = ahead_seconds
+        self.max_per_cycle = max_per_cycle
+        self.concurrency = concurrency
+        self.min_score = min_score
+        self.decay = decay
+        self.max_tracked = max_tracked
+        self.clock = clock
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+            logger.info(f"Hot url refresher started - interval: {self.interval}s, top: {self.top_k}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception(f"Hot url refresher error: {e}")
+
+    async def flush(self):
+        """
+        Add the access counts of this worker to the hot url scores
+        """
+        counts = self.tracker.drain()
+        if counts:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for url, count in counts.items():
+                    pipe.zincrby(self.key, count, url)
+                await pipe.execute()
+
+    async def hot_urls(self) -> List[Tuple[str, float]]:
+        """
+        The top_k urls with their score, hottest first, only those scored at least min_score
+        """
+        ranked = await self.redis.zrevrange(self.key, 0, self.top_k - 1, withscores=True)
+        return [(url, score) for url, score in ranked if score >= self.min_score]
+
+    async def run_once(self) -> Dict[str, int]:
+        """
+        One refresh cycle: flush the counts, then, if no other worker did it this interval,
+        decay the scores and refresh the hot urls close to expiry.
+        Returns the counts of refreshed (re-scraped) and rewarmed (saved to the cache again) urls.
+        """
+        await self.flush()
+        token = uuid.uuid4().hex
+        if not await self.redis.set(self.lock_key, token, nx=True, px=max(1, int(self.lock_ttl * 1000))):
+            return {"refreshed": 0, "rewarmed": 0}
+        start = time.monotonic()
+        try:
+            return await self._refresh()
+        finally:
+            left_ms = int((self.interval - (time.monotonic() - start)) * 1000)
+            await self.redis.eval(RELEASE_CYCLE_LOCK_SCRIPT, 1, self.lock_key, token, left_ms)
+
+    async def _refresh(self) -> Dict[str, int]:
+        result = {"refreshed": 0, "rewarmed": 0}
+        hot = await self.hot_urls()
+        await self._decay()
+        if not hot:
+            return result
+
+        urls = [url for url, _ in hot]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for url in urls:
+                pipe.exists(cache_key(url))
+            cached = dict(zip(urls, await pipe.execute()))
+        async with AsyncSessionLocal() as session:
+            entries = {entry.url: entry for entry in await crud.get_url_entries_by_urls(session, urls)}
+
+        now = self.clock()
+        to_refresh = []
+        for url in urls:
+            entry = entries.get(url)
+            # Failed urls keep their backoff, pending ones are being scraped
+            if entry is None or entry.status != URLStatus.SUCCESS.value or not entry.image_url:
+                continue
+            fresh_seconds = fresh_seconds_left(entry, now)
+            if fresh_seconds <= self.ahead_seconds:
+                to_refresh.append(entry)
+            elif not cached[url]:
+                await cache_save(entry, ttl=max(1, int(fresh_seconds)))
+                result["rewarmed"] += 1
+
+        # Hottest first, within the outbound budget
+        to_refresh = to_refresh[:self.max_per_cycle]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def refresh(entry):
+            async with semaphore:
+                try:
+                    await process_og_url_by_entry_id(entry.id)
+                except Exception as e:
+                    logger.exception(f"Hot url refresher - url: {entry.url} error: {e}")
+
+        await asyncio.gather(*(refresh(entry) for entry in to_refresh))
+        result["refreshed"] = len(to_refresh)
+        HOT_REFRESHED.inc(result["refreshed"])
+        HOT_REWARMED.inc(result["rewarmed"])
+        logging.info(f"Hot url refresher - hot: {len(hot)}, refreshed: {result['refreshed']}, rewarmed: {result['rewarmed']}")
+        return result
+
+    async def _decay(self):
+        # Older accesses count less every interval, the urls that cooled down are forgotten
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.zunionstore(self.key, {self.key: self.decay})
+            pipe.zremrangebyscore(self.key, "-inf", f"({FORGET_SCORE}")
+            pipe.zremrangebyrank(self.key, 0, -self.max_tracked - 1)
+            await pipe.execute()
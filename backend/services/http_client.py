@@ -0,0 +1,170 @@
+import contextlib
+import httpcore
+import httpx
+import logging
+from services.dns_cache import CachedDNSBackend
+from services.dns_cache import get_dns_cache
+from settings import SCRAPER_CONNECT_TIMEOUT_SECONDS
+from settings import SCRAPER_HTTP2_ENABLED
+from settings import SCRAPER_MAX_CONNECTIONS
+from settings import SCRAPER_MAX_KEEPALIVE_CONNECTIONS
+from settings import SCRAPER_READ_TIMEOUT_SECONDS
+from settings import SCRAPER_TOTAL_TIMEOUT_SECONDS
+from typing import Iterator
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def http2_available() -> bool:
+    """
+    HTTP/2 needs the optional h2 package (pip install httpx[http2])
+    """
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+# httpcore errors as the httpx errors callers catch, most specific first
+_HTTPCORE_ERRORS = (
+    (httpcore.ConnectTimeout, httpx.ConnectTimeout),
+    (httpcore.ReadTimeout, httpx.ReadTimeout),
+    (httpcore.WriteTimeout, httpx.WriteTimeout),
+    (httpcore.PoolTimeout, httpx.PoolTimeout),
+    (httpcore.TimeoutException, httpx.TimeoutException),
+    (httpcore.ConnectError, httpx.ConnectError),
+    (httpcore.ReadError, httpx.ReadError),
+    (httpcore.WriteError, httpx.WriteError),
+    (httpcore.NetworkError, httpx.NetworkError),
+    (httpcore.ProxyError, httpx.ProxyError),
+    (httpcore.UnsupportedProtocol, httpx.UnsupportedProtocol),
+    (httpcore.LocalProtocolError, httpx.LocalProtocolError),
+    (httpcore.RemoteProtocolError, httpx.RemoteProtocolError),
+    (httpcore.ProtocolError, httpx.ProtocolError),
+)
+
+
+@contextlib.contextmanager
+def _httpx_errors() -> Iterator[None]:
+    try:
+        yield
+    except Exception as e:
+        for httpcore_error, httpx_error in _HTTPCORE_ERRORS:
+            if isinstance(e, httpcore_error):
+                raise httpx_error(str(e)) from e
+        raise
+
+
+class _PoolResponseStream(httpx.AsyncByteStream):
+    def __init__(self, stream):
+        self._stream = stream
+
+    async def __aiter__(self):
+        with _httpx_errors():
+            async for chunk in self._stream:
+                yield chunk
+
+    async def aclose(self):
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+
+class PoolTransport(httpx.AsyncBaseTransport):
+    """
+    httpx transport on a given httpcore connection pool.
+    httpx.AsyncHTTPTransport builds its own pool and takes no network backend,
+    this one lets the scraper pool connect through the DNS cache.
+    """
+    def __init__(self, pool: httpcore.AsyncConnectionPool):
+        self.pool = pool
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        core_request = httpcore.Request(
+            method=request.method,
+            url=httpcore.URL(
+                scheme=request.url.raw_scheme,
+                host=request.url.raw_host,
+                port=request.url.port,
+                target=request.url.raw_path,
+            ),
+            headers=request.headers.raw,
+            content=request.stream,
+            extensions=request.extensions,
+        )
+        with _httpx_errors():
+            core_response = await self.pool.handle_async_request(core_request)
+        return httpx.Response(
+            status_code=core_response.status,
+            headers=core_response.headers,
+            stream=_PoolResponseStream(core_response.stream),
+            extensions=core_response.extensions,
+        )
+
+    async def aclose(self):
+        await self.pool.aclose()
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """
+    Build the pooled scraper client from settings.
+    The total timeout is enforced by the caller, httpx only supports per-phase timeouts.
+    Hosts are resolved through the DNS cache, which also refuses non public addresses.
+    """
+    http2 = SCRAPER_HTTP2_ENABLED and http2_available()
+    limits = httpx.Limits(
+        max_connections=SCRAPER_MAX_CONNECTIONS,
+        max_keepalive_connections=SCRAPER_MAX_KEEPALIVE_CONNECTIONS,
+    )
+    timeout = httpx.Timeout(
+        SCRAPER_TOTAL_TIMEOUT_SECONDS,
+        connect=SCRAPER_CONNECT_TIMEOUT_SECONDS,
+        read=SCRAPER_READ_TIMEOUT_SECONDS,
+    )
+    pool = httpcore.AsyncConnectionPool(
+        ssl_context=httpx.create_ssl_context(),
+        max_connections=limits.max_connections,
+        max_keepalive_connections=limits.max_keepalive_connections,
+        keepalive_expiry=limits.keepalive_expiry,
+        http2=http2,
+        network_backend=CachedDNSBackend(get_dns_cache()),
+    )
+    # Requests per host are limited by the host scheduler the callers go through, not here
+    return httpx.AsyncClient(transport=PoolTransport(pool), timeout=timeout, follow_redirects=True)
+
+
+async def open_http_client() -> httpx.AsyncClient:
+    """
+    Open the app lifetime scraper client. Called from the FastAPI lifespan.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_http_client()
+        logger.info(f"Scraper http client opened - http2: {http2_available() and SCRAPER_HTTP2_ENABLED}")
+    return _client
+
+
+async def close_http_client():
+    """
+    Close the app lifetime scraper client and its pooled connections.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        logger.info("Scraper http client closed")
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the shared scraper client.
+    Lazily created for scripts and tests that run without the app lifespan.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = build_http_client()
+    return _client
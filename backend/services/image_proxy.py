@@ -0,0 +1,263 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from services.executors import LazyExecutor
+from services.executors import spawn_process_pool
+from services.host_scheduler import HostQueueTimeout
+from services.host_scheduler import get_host_scheduler
+from services.host_scheduler import url_host
+from services.http_client import get_http_client
+from services.local_cache import LocalTTLCache
+from services.single_flight import SingleFlight
+from services.thumbnailer import make_thumbnail
+from settings import IMAGE_CACHE_DIR
+from settings import IMAGE_CACHE_MAX_BYTES
+from settings import IMAGE_PROXY_MAX_BYTES
+from settings import IMAGE_PROXY_MAX_PIXELS
+from settings import IMAGE_PROXY_NEGATIVE_TTL_SECONDS
+from settings import IMAGE_RESIZE_WORKERS
+from settings import IMAGE_THUMBNAIL_QUALITY
+from settings import IMAGE_THUMBNAIL_WIDTH
+from settings import SCRAPER_TOTAL_TIMEOUT_SECONDS
+from typing import Optional
+from typing import Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# Source image types the thumbnailer can decode
+IMAGE_CONTENT_TYPES = ("image/jpeg", "image/png", "image/gif", "image/webp", "image/bmp")
+
+
+class ImageProxyError(Exception):
+    """
+    The og image could not be fetched or turned into a thumbnail
+    """
+
+
+class ThumbnailCache:
+    """
+    Content-addressed on-disk thumbnail cache, bounded to max_bytes with LRU eviction.
+    A thumbnail is stored under the sha256 of its bytes, which is also its strong ETag,
+    and a ref file per source (image url and width) points to it, so an image shared by many urls is stored once.
+    Files are written to a temp file then renamed, readers never see a partial file.
+    Sizes are accounted per process, the directory is scanned again on start.
+    Called from threads, so disk reads and writes stay off the event loop.
+    """
+    def __init__(self, directory: str = IMAGE_CACHE_DIR, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._blobs: "OrderedDict[str, int]" = OrderedDict()  # digest -> size, least recently used first
+        self._size = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.directory / "blobs" / digest[:2] / f"{digest}.webp"
+
+    def _ref_path(self, key: str) -> Path:
+        return self.directory / "refs" / key[:2] / key
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        blobs = []
+        for path in self.directory.glob("blobs/*/*.webp"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            blobs.append((stat.st_mtime, path.stem, stat.st_size))
+        for _, digest, size in sorted(blobs):
+            self._blobs[digest] = size
+            self._size += size
+        self._evict()
+
+    def _write(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def get(self, key: str) -> Optional[Tuple[str, bytes]]:
+        """
+        Digest and bytes of the cached thumbnail of the source key, None on a miss
+        """
+        with self._lock:
+            self._load()
+            try:
+                digest = self._ref_path(key).read_text()
+                data = self._blob_path(digest).read_bytes()
+                os.utime(self._blob_path(digest))  # recency survives restarts
+            except FileNotFoundError:
+                return None
+            if digest not in self._blobs:
+                # Written by another worker
+                self._blobs[digest] = len(data)
+                self._size += len(data)
+            self._blobs.move_to_end(digest)
+            return digest, data
+
+    def put(self, key: str, data: bytes) -> str:
+        """
+        Store the thumbnail of the source key, return its digest
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._load()
+            if digest not in self._blobs:
+                self._write(self._blob_path(digest), data)
+                self._blobs[digest] = len(data)
+                self._size += len(data)
+            self._blobs.move_to_end(digest)
+            self._write(self._ref_path(key), digest.encode())
+            self._evict()
+        return digest
+
+    def _evict(self):
+        # Refs of an evicted thumbnail are left behind, they are misses and get overwritten
+        while self._size > self.max_bytes and len(self._blobs) > 1:
+            digest, size = self._blobs.popitem(last=False)
+            self._size -= size
+            try:
+                self._blob_path(digest).unlink()
+            except FileNotFoundError:
+                pass
+
+
+def source_key(image_url: str, width: int = IMAGE_THUMBNAIL_WIDTH, quality: int = IMAGE_THUMBNAIL_QUALITY) -> str:
+    # Every setting the thumbnail is made with, so changing one makes new thumbnails
+    return hashlib.sha256(f"{image_url}\n{width}\n{quality}".encode()).hexdigest()
+
+
+async def fetch_image(
+    url: str, max_bytes: int = IMAGE_PROXY_MAX_BYTES, timeout: float = SCRAPER_TOTAL_TIMEOUT_SECONDS
+) -> bytes:
+    """
+    Download an image through the host scheduler, refusing non-image content types and bodies over max_bytes.
+    The timeout starts once the host slot is granted, the queue wait is bounded by the scheduler.
+    """
+    async with get_host_scheduler().slot(url_host(url)):
+        return await asyncio.wait_for(_download_image(url, max_bytes), timeout=timeout)
+
+
+async def _download_image(url: str, max_bytes: int) -> bytes:
+    async with get_http_client().stream("GET", url, headers={"Accept": "image/webp,image/*"}) as response:
+        if response.status_code != 200:
+            raise ImageProxyError(f"origin answered {response.status_code}")
+        content_type = response.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+        if content_type not in IMAGE_CONTENT_TYPES:
+            raise ImageProxyError(f"unsupported content type: {content_type}")
+        content_length = response.headers.get("content-length", "")
+        if content_length.isdigit() and int(content_length) > max_bytes:
+            raise ImageProxyError(f"image larger than {max_bytes} bytes")
+        chunks = []
+        async for chunk in response.aiter_bytes():
+            chunks.append(chunk)
+            if response.num_bytes_downloaded > max_bytes:
+                raise ImageProxyError(f"image larger than {max_bytes} bytes")
+        return b"".join(chunks)
+
+
+_resize_pool: Optional[LazyExecutor] = None
+
+
+def get_resize_pool() -> Optional[LazyExecutor]:
+    """
+    Get the process pool running the resizes, None if IMAGE_RESIZE_WORKERS is 0
+    """
+    global _resize_pool
+    if _resize_pool is None and IMAGE_RESIZE_WORKERS > 0:
+        _resize_pool = spawn_process_pool(IMAGE_RESIZE_WORKERS)
+    return _resize_pool
+
+
+def close_resize_pool():
+    """
+    Shut the resize pool down. Called from the FastAPI lifespan.
+    """
+    global _resize_pool
+    if _resize_pool is not None:
+        _resize_pool.close()
+        _resize_pool = None
+
+
+async def resize_image(data: bytes) -> bytes:
+    """
+    Make the WebP thumbnail of an image off the event loop, raise ValueError if it is not a valid image
+    """
+    resize = functools.partial(
+        make_thumbnail, data, IMAGE_THUMBNAIL_WIDTH, IMAGE_THUMBNAIL_QUALITY, IMAGE_PROXY_MAX_PIXELS
+    )
+    pool = get_resize_pool()
+    if pool is None:
+        return await asyncio.to_thread(resize)
+    return await pool.run(resize)
+
+
+_thumbnail_cache: Optional[ThumbnailCache] = None
+# Sources whose fetch or resize failed recently, so a broken origin is not hit on every page view
+_failed_sources = LocalTTLCache(max_size=10000)
+# Concurrent requests of one image fetch and resize it once
+_thumbnail_flight = SingleFlight()
+
+
+def get_thumbnail_cache() -> ThumbnailCache:
+    global _thumbnail_cache
+    if _thumbnail_cache is None:
+        _thumbnail_cache = ThumbnailCache()
+    return _thumbnail_cache
+
+
+async def get_thumbnail(image_url: str) -> Tuple[str, bytes]:
+    """
+    Get the thumbnail of an og image, from the disk cache or fetched and resized once
+    Args:
+        Input:
+            image_url: og image url
+        Output:
+            digest (the strong ETag) and WebP bytes of the thumbnail, raise ImageProxyError if it can not be made
+    """
+    key = source_key(image_url)
+    cache = get_thumbnail_cache()
+    cached = await asyncio.to_thread(cache.get, key)
+    if cached:
+        return cached
+    error = _failed_sources.get(key)
+    if error:
+        raise ImageProxyError(error)
+    return await _thumbnail_flight.do(key, lambda: _make_thumbnail(image_url, key))
+
+
+async def _make_thumbnail(image_url: str, key: str) -> Tuple[str, bytes]:
+    try:
+        data = await fetch_image(image_url)
+        thumbnail = await resize_image(data)
+    except HostQueueTimeout as e:
+        # Our own host queue was full, the image is not at fault and not negatively cached
+        logging.info(f"Image proxy - image_url: {image_url} not fetched - host queue timeout")
+        raise ImageProxyError("image fetch failed: host queue timeout") from e
+    except Exception as e:
+        error = str(e) if isinstance(e, (ImageProxyError, ValueError)) else f"image fetch failed: {type(e).__name__}"
+        logging.info(f"Image proxy - image_url: {image_url} failed - {error}")
+        _failed_sources.set(key, error, ttl=IMAGE_PROXY_NEGATIVE_TTL_SECONDS)
+        raise ImageProxyError(error) from e
+    digest = await asyncio.to_thread(get_thumbnail_cache().put, key, thumbnail)
+    logging.info(f"Image proxy - image_url: {image_url}, {len(data)} bytes to a {len(thumbnail)} bytes thumbnail")
+    return digest, thumbnail
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from settings import LOCAL_CACHE_INVALIDATION_CHANNEL
+from settings import LOCAL_CACHE_MAX_SIZE
+from settings import REDIS_CLIENT
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class LocalTTLCache:
+    """
+    Bounded in-process cache with LRU eviction and a TTL per entry.
+    Sits in front of Redis for the hottest urls, so a hit needs no network round trip.
+    Not thread safe, it is only used from the event loop.
+    """
+    def __init__(self, max_size: int = LOCAL_CACHE_MAX_SIZE, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.clock = clock
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str) -> Optional[Any]:
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= self.clock():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: str, value: Any, ttl: float):
+        if self.max_size <= 0:
+            return
+        self._data[key] = (self.clock() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CacheInvalidator:
+    """
+    Keeps the local caches of several workers coherent over Redis pub/sub.
+    A worker saving a key publishes it, the other workers drop their local copy and read it from Redis again.
+    Publishing only happens while the listener runs (started in the app lifespan).
+    """
+    def __init__(self, cache: LocalTTLCache, redis_client, channel: str = LOCAL_CACHE_INVALIDATION_CHANNEL):
+        self.cache = cache
+        self.redis = redis_client
+        self.channel = channel
+        self.node_id = uuid.uuid4().hex
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None
+
+    async def publish(self, key: str):
+        if self._task is not None:
+            await self.redis.publish(self.channel, f"{self.node_id} {key}")
+
+    async def publish_many(self, keys: List[str]):
+        if self._task is not None and keys:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.publish(self.channel, f"{self.node_id} {key}")
+                await pipe.execute()
+
+    def handle_message(self, data: str):
+        node_id, _, key = data.partition(" ")
+        if node_id != self.node_id:
+            self.cache.delete(key)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                logger.info(f"Local cache invalidation listening on {self.channel}")
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        self.handle_message(message["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages may have been missed while disconnected, start over from Redis
+                logger.exception(f"Local cache invalidation error: {e}")
+                self.cache.clear()
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+local_cache = LocalTTLCache()
+cache_invalidator = CacheInvalidator(local_cache, REDIS_CLIENT)
@@ -0,0 +1,317 @@
+import bisect
+import math
+import time
+from sqlalchemy import event
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """
+    Base of the metric families: one child per label set.
+    Bind the children once at import time with labels(...), the hot path then only touches plain numbers.
+    Not thread safe, metrics are only updated from the event loop.
+    """
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        if not self.labelnames:
+            self.labels()  # exposed as 0 before the first update
+        (REGISTRY if registry is None else registry).register(self)
+
+    def labels(self, *values: str):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        # A metric without labels is its own single child
+        return self.labels()
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]):
+        """
+        Read the value from function when the metrics are collected, for values kept elsewhere
+        """
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function else self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in self._children.items()
+        ]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._default().dec(amount)
+
+    def set(self, value: float):
+        self._default().set(value)
+
+    def set_function(self, function: Callable[[], float]):
+        self._default().set_function(function)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, values)} {_format_value(child.get())}"
+            for values, child in self._children.items()
+        ]
+
+
+class _Timer:
+    __slots__ = ("child", "start")
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # per bucket, the last one is +Inf, made cumulative on render
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        """
+        Observe the duration of a with block, in seconds
+        """
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry=None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._default().observe(value)
+
+    def time(self) -> _Timer:
+        return self._default().time()
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+# Metrics of this worker, each label set bound once
+SUBMIT_DURATION = Histogram("og_submit_duration_seconds", "Submit latency by path", ["path"])
+SUBMIT_CACHE_HIT = SUBMIT_DURATION.labels("cache_hit")
+SUBMIT_DB_HIT = SUBMIT_DURATION.labels("db_hit")
+SUBMIT_STALE = SUBMIT_DURATION.labels("stale")
+SUBMIT_DEFERRED = SUBMIT_DURATION.labels("deferred")
+SUBMIT_SCRAPE = SUBMIT_DURATION.labels("scrape")
+# Submit paths to their bound child, the submit route observes through it with no label lookup
+SUBMIT_BY_PATH = {
+    "cache_hit": SUBMIT_CACHE_HIT,
+    "db_hit": SUBMIT_DB_HIT,
+    "stale": SUBMIT_STALE,
+    "deferred": SUBMIT_DEFERRED,
+    "scrape": SUBMIT_SCRAPE,
+}
+
+SCRAPE_FETCH_DURATION = Histogram("og_scrape_fetch_duration_seconds", "Page fetch time by result", ["result"])
+SCRAPE_FETCH_OK = SCRAPE_FETCH_DURATION.labels("ok")
+SCRAPE_FETCH_NOT_MODIFIED = SCRAPE_FETCH_DURATION.labels("not_modified")
+SCRAPE_FETCH_THROTTLED = SCRAPE_FETCH_DURATION.labels("throttled")
+SCRAPE_FETCH_ERROR = SCRAPE_FETCH_DURATION.labels("error")
+SCRAPE_BYTES = Histogram("og_scrape_bytes", "Page bytes downloaded per fetch", buckets=BYTES_BUCKETS)
+PARSE_DURATION = Histogram("og_parse_duration_seconds", "HTML parse time per page")
+PARSES_OFFLOADED = Counter("og_parses_offloaded", "Page heads parsed in the parse pool, past the inline size")
+SCRAPES_IN_FLIGHT = Gauge("og_scrapes_in_flight", "Page fetches in flight")
+
+DNS_CACHE_REQUESTS = Counter("og_dns_cache_requests", "DNS cache lookups by result", ["result"])
+DNS_CACHE_HIT = DNS_CACHE_REQUESTS.labels("hit")
+DNS_CACHE_NEGATIVE_HIT = DNS_CACHE_REQUESTS.labels("negative_hit")
+DNS_CACHE_MISS = DNS_CACHE_REQUESTS.labels("miss")
+DNS_LOOKUP_DURATION = Histogram("og_dns_lookup_duration_seconds", "Resolver latency by result", ["result"])
+DNS_LOOKUP_OK = DNS_LOOKUP_DURATION.labels("ok")
+DNS_LOOKUP_NXDOMAIN = DNS_LOOKUP_DURATION.labels("nxdomain")
+DNS_LOOKUP_ERROR = DNS_LOOKUP_DURATION.labels("error")
+DNS_BLOCKED = Counter("og_dns_blocked", "Connections refused to non public addresses")
+
+WRITE_BEHIND_FLUSH_DURATION = Histogram("og_write_behind_flush_duration_seconds", "Write-behind flush time per batch")
+WRITE_BEHIND_DELAY = Histogram("og_write_behind_delay_seconds", "Time a scrape result waited in the write-behind buffer")
+WRITE_BEHIND_RECORDS = Counter("og_write_behind_records", "Scrape results of the write-behind buffer by result", ["result"])
+WRITE_BEHIND_WRITTEN = WRITE_BEHIND_RECORDS.labels("written")
+WRITE_BEHIND_DROPPED = WRITE_BEHIND_RECORDS.labels("dropped")
+
+REDIS_DURATION = Histogram("og_redis_duration_seconds", "Redis call latency by command", ["command"])
+REDIS_GET = REDIS_DURATION.labels("get")
+REDIS_MGET = REDIS_DURATION.labels("mget")
+REDIS_SET = REDIS_DURATION.labels("set")
+
+DB_DURATION = Histogram("og_db_duration_seconds", "DB statement latency by statement type", ["statement"])
+DB_STATEMENTS = {kind: DB_DURATION.labels(kind.lower()) for kind in ("SELECT", "INSERT", "UPDATE", "DELETE")}
+DB_OTHER = DB_DURATION.labels("other")
+
+CACHE_REQUESTS = Counter("og_cache_requests", "Record cache lookups by layer and result", ["layer", "result"])
+CACHE_LOCAL_HIT = CACHE_REQUESTS.labels("local", "hit")
+CACHE_REDIS_HIT = CACHE_REQUESTS.labels("redis", "hit")
+CACHE_MISS = CACHE_REQUESTS.labels("redis", "miss")
+
+HOT_REFRESHES = Counter("og_hot_refreshes", "Hot urls kept warm by the refresher", ["action"])
+HOT_REFRESHED = HOT_REFRESHES.labels("refreshed")
+HOT_REWARMED = HOT_REFRESHES.labels("rewarmed")
+
+# Read when collected, see main.py
+HOST_SLOTS_ACTIVE = Gauge("og_host_slots_active", "Scrapes holding a host scheduler slot")
+HOST_SLOTS_WAITING = Gauge("og_host_slots_waiting", "Scrapes waiting for a host scheduler slot")
+LOCAL_CACHE_SIZE = Gauge("og_local_cache_size", "Entries of the in-process record cache")
+
+
+def instrument_engine(engine):
+    """
+    Time every statement of a SQLAlchemy (async) engine into DB_DURATION
+    """
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("og_statement_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["og_statement_start"].pop()
+        DB_STATEMENTS.get(statement.lstrip()[:6].upper(), DB_OTHER).observe(time.perf_counter() - start)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def error(context):
+        starts = context.connection.info.get("og_statement_start") if context.connection else None
+        if starts:
+            starts.pop()
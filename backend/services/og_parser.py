@@ -0,0 +1,349 @@
+import html
+import re
+import time
+from html.parser import HTMLParser
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from urllib.parse import urljoin
+
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+def is_html_content_type(content_type: Optional[str]) -> bool:
+    """
+    Check the response Content-Type header before downloading the body.
+    A missing header is allowed since many origins omit it for html pages.
+    """
+    if not content_type:
+        return True
+    media_type = content_type.split(";", 1)[0].strip().lower()
+    return media_type in HTML_CONTENT_TYPES
+
+
+# Tags of the head section, any other start tag means the body has begun, even without a <body> tag
+HEAD_TAGS = frozenset(("html", "head", "title", "base", "meta", "link", "script", "style", "noscript", "template"))
+# og:image structured properties, they describe the og:image they follow
+OG_IMAGE_PROPERTIES = {"og:image:width": "image_width", "og:image:height": "image_height", "og:image:type": "image_type"}
+# Meta tags read in the pass, besides og:image. og: tags are matched on property, the others on property or name.
+META_KEYS = frozenset((
+    "og:title", "og:description", "og:site_name",
+    "twitter:card", "twitter:title", "twitter:description", "twitter:image", "twitter:image:src",
+    "description",
+))
+
+
+def _text(value: Optional[str]) -> Optional[str]:
+    value = " ".join(value.split()) if value else None
+    return value or None
+
+
+def _int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value.strip())
+    except (AttributeError, ValueError):
+        return None
+
+
+class HeadMetadata:
+    """
+    Page metadata read from the head tags, shared by the parser backends:
+    og:title, og:description, og:image with its width, height and type, og:site_name,
+    twitter:card and twitter: fallbacks, <title>, <meta name="description">, <link rel="icon"> and <link rel="canonical">.
+    A backend feeds it the start tags of the head (tag names and attribute names lowercase) and sets done
+    once the head section is over, so the caller can stop reading the body.
+    Args:
+        base_url: final url of the page, relative image and icon urls are resolved against it (and <base href>)
+    """
+    def __init__(self, base_url: Optional[str] = None):
+        self.base_url = base_url
+        self.done = False
+        self.meta: Dict[str, str] = {}  # first value of each of the META_KEYS and OG_IMAGE_PROPERTIES
+        self.og_image: Optional[str] = None
+        self.title: Optional[str] = None
+        self.icon: Optional[str] = None
+        self.canonical: Optional[str] = None
+        self.base_href: Optional[str] = None
+        self._in_og_image = False  # structured properties apply to the chosen og:image only
+        self._in_noscript = False
+
+    def start_tag(self, tag: str, attrs: Dict[str, Optional[str]]):
+        """
+        Handle a start tag of the head, any tag but <title> whose text the backend reads
+        """
+        if tag == "meta":
+            self._meta(attrs)
+        elif tag == "link":
+            rel = (attrs.get("rel") or "").lower().split()
+            if self.icon is None and attrs.get("href") and "icon" in rel:
+                self.icon = attrs["href"]
+            if self.canonical is None and attrs.get("href") and "canonical" in rel:
+                self.canonical = attrs["href"]
+        elif tag == "base":
+            if self.base_href is None and attrs.get("href"):
+                self.base_href = attrs["href"]
+        elif tag == "noscript":
+            self._in_noscript = True
+        elif tag not in HEAD_TAGS and not self._in_noscript:
+            self.done = True
+
+    def end_tag(self, tag: str):
+        if tag == "noscript":
+            self._in_noscript = False
+        elif tag == "head":
+            self.done = True
+
+    def set_title(self, text: str):
+        if self.title is None:
+            self.title = _text(text) or ""
+
+    def _meta(self, attrs):
+        content = attrs.get("content")
+        key = attrs.get("property")
+        if key == "og:image":
+            # The first og:image with a content wins, a later one starts an image we do not keep
+            self._in_og_image = self.og_image is None and bool(content and content.strip())
+            if self._in_og_image:
+                self.og_image = content
+            return
+        if key in OG_IMAGE_PROPERTIES:
+            if self._in_og_image:
+                self.meta.setdefault(key, content)
+            return
+        if key not in META_KEYS:
+            key = attrs.get("name")
+            if key not in META_KEYS or key.startswith("og:"):
+                return
+        if content and content.strip():
+            self.meta.setdefault(key, content)
+
+    def resolve(self, url: Optional[str]) -> Optional[str]:
+        """
+        Absolute form of a url found in the page
+        """
+        if not url or not url.strip():
+            return None
+        base = urljoin(self.base_url or "", self.base_href.strip()) if self.base_href else self.base_url
+        return urljoin(base, url.strip()) if base else url.strip()
+
+    @property
+    def image_url(self) -> Optional[str]:
+        return self.resolve(self.og_image or self.meta.get("twitter:image") or self.meta.get("twitter:image:src"))
+
+    @property
+    def canonical_url(self) -> Optional[str]:
+        return self.resolve(self.canonical)
+
+    def metadata(self) -> Dict[str, Any]:
+        """
+        Page metadata besides the image url, the keys are the URLRecord metadata columns
+        """
+        meta = self.meta
+        return {
+            "title": _text(meta.get("og:title") or meta.get("twitter:title") or self.title),
+            "description": _text(meta.get("og:description") or meta.get("twitter:description") or meta.get("description")),
+            "site_name": _text(meta.get("og:site_name")),
+            "image_width": _int(meta.get("og:image:width")),
+            "image_height": _int(meta.get("og:image:height")),
+            "image_type": _text(meta.get("og:image:type")),
+            "twitter_card": _text(meta.get("twitter:card")),
+            "icon_url": self.resolve(self.icon),
+        }
+
+
+class OGHeadParser(HTMLParser, HeadMetadata):
+    """
+    Incremental head parser on the standard library html.parser, the "html.parser" backend.
+    Feed it chunks as they arrive, see HeadMetadata.
+    """
+    def __init__(self, base_url: Optional[str] = None):
+        HeadMetadata.__init__(self, base_url)
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self._title_parts: Optional[List[str]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return  # the rest of the chunk is body
+        if tag == "title":
+            if self.title is None and self._title_parts is None:
+                self._title_parts = []
+        else:
+            self.start_tag(tag, dict(attrs))
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+
+    def handle_data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._title_parts is not None:
+            self.set_title("".join(self._title_parts))
+            self._title_parts = None
+        else:
+            self.end_tag(tag)
+
+
+def lxml_available() -> bool:
+    """
+    The lxml backend needs the optional lxml package (pip install lxml)
+    """
+    try:
+        import lxml  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class LxmlHeadParser(HeadMetadata):
+    """
+    Incremental head parser on the lxml (libxml2) HTML feed parser, the "lxml" backend.
+    Tokenizing runs in C and the parser calls back its target, this object, no tree is built.
+    """
+    def __init__(self, base_url: Optional[str] = None):
+        super().__init__(base_url)
+        from lxml import etree
+        self._parser = etree.HTMLParser(target=self)
+        self._title_parts: Optional[List[str]] = None
+
+    def feed(self, text: str):
+        if self.done:
+            return
+        self._parser.feed(text)
+        if self.done:
+            self._parser = None  # the parser refers to its target
+
+    # lxml parser target interface
+    def start(self, tag, attrib):
+        if self.done:
+            return  # the rest of the chunk is body
+        if tag == "title":
+            if self.title is None and self._title_parts is None:
+                self._title_parts = []
+        else:
+            self.start_tag(tag, dict(attrib))
+
+    def data(self, data):
+        if self._title_parts is not None:
+            self._title_parts.append(data)
+
+    def end(self, tag):
+        if tag == "title" and self._title_parts is not None:
+            self.set_title("".join(self._title_parts))
+            self._title_parts = None
+        else:
+            self.end_tag(tag)
+
+    def close(self):
+        return None
+
+
+# Tokens of the regex backend: a comment, or a start or end tag name
+_TOKEN = re.compile(r"<(!--|/?[a-zA-Z][a-zA-Z0-9:-]*)")
+# Rest of a tag up to its >, quoted attribute values may contain >
+_TAG_REST = re.compile(r"""(?:[^>"']|"[^"]*"|'[^']*')*>""")
+_ATTRIBUTE = re.compile(r"""([^\s"'=<>/]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'=<>`]+)))?""")
+# Elements whose content is text up to their end tag, not markup
+_RAW_TEXT_TAGS = frozenset(("script", "style", "title", "textarea"))
+_RAW_TEXT_END = {tag: re.compile(f"</{tag}\\s*>", re.I) for tag in _RAW_TEXT_TAGS}
+
+
+def _attributes(text: str) -> Dict[str, Optional[str]]:
+    attrs = {}
+    for match in _ATTRIBUTE.finditer(text):
+        name, value = match.group(1).lower(), next((v for v in match.group(2, 3, 4) if v is not None), None)
+        attrs.setdefault(name, html.unescape(value) if value is not None else None)
+    return attrs
+
+
+class RegexHeadParser(HeadMetadata):
+    """
+    Incremental head tokenizer on regular expressions, the "regex" backend, the fastest one.
+    It only finds tags, comments and the text of script, style and title, which is all the head metadata needs.
+    Markup it does not understand is skipped rather than repaired like a browser would.
+    """
+    def __init__(self, base_url: Optional[str] = None):
+        super().__init__(base_url)
+        self._buffer = ""
+
+    def feed(self, text: str):
+        if self.done:
+            return
+        buffer = self._buffer + text
+        position = 0
+        while not self.done:
+            token = _TOKEN.search(buffer, position)
+            if token is None:
+                # Keep a trailing "<" that may start a token in the next chunk
+                position = max(position, buffer.rfind("<", position))
+                if position < 0 or buffer.find("<", position) < 0:
+                    position = len(buffer)
+                break
+            name = token.group(1).lower()
+            if name == "!--":
+                end = buffer.find("-->", token.end())
+                if end < 0:
+                    position = token.start()
+                    break
+                position = end + 3
+                continue
+            rest = _TAG_REST.match(buffer, token.end())
+            if rest is None:
+                position = token.start()
+                break
+            if name.startswith("/"):
+                position = rest.end()
+                self.end_tag(name[1:])
+                continue
+            if name in _RAW_TEXT_TAGS and not rest.group().endswith("/>"):
+                end = _RAW_TEXT_END[name].search(buffer, rest.end())
+                if end is None:
+                    position = token.start()
+                    break
+                if name == "title":
+                    self.set_title(html.unescape(buffer[rest.end():end.start()]))
+                position = end.end()
+                continue
+            position = rest.end()
+            self.start_tag(name, _attributes(buffer[token.end():rest.end() - 1]))
+        self._buffer = "" if self.done else buffer[position:]
+
+
+PARSER_BACKENDS = {"html.parser": OGHeadParser, "lxml": LxmlHeadParser, "regex": RegexHeadParser}
+
+
+def make_head_parser(base_url: Optional[str] = None, backend: str = "html.parser") -> HeadMetadata:
+    """
+    Incremental head parser of a backend: "html.parser", "lxml" or "regex".
+    Raise ValueError for an unknown backend, or lxml when it is not installed.
+    """
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(f"Unknown HTML parser backend: {backend}, expected one of {', '.join(PARSER_BACKENDS)}")
+    if backend == "lxml" and not lxml_available():
+        raise ValueError("HTML parser backend lxml needs the lxml package")
+    return PARSER_BACKENDS[backend](base_url=base_url)
+
+
+def parse_head(text: str, base_url: Optional[str] = None, backend: str = "html.parser") -> Dict[str, Any]:
+    """
+    Parse the head of a whole (partial) document at once, run in the parse pool for large pages
+    Args:
+        Input:
+            text: the page text downloaded so far
+            base_url: final url of the page
+            backend: parser backend, see make_head_parser
+        Output:
+            dict with image_url, metadata, canonical_url and the parse seconds, plain values the pool can pickle
+    """
+    start = time.perf_counter()
+    parser = make_head_parser(base_url, backend)
+    parser.feed(text)
+    return {
+        "image_url": parser.image_url,
+        "metadata": parser.metadata(),
+        "canonical_url": parser.canonical_url,
+        "seconds": time.perf_counter() - start,
+    }
@@ -1,62 +1,764 @@
+import asyncio
 import httpx
 import logging
-from bs4 import BeautifulSoup
+import re
+import time
+from dataclasses import dataclass
+from dataclasses import field
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from api.schemas import URLInfo
 from database.enums import URLStatus
 from database.models import URLRecord
 from database.session import AsyncSessionLocal
-from database.session import init_db
 from database import crud
+from email.utils import parsedate_to_datetime
+from services.host_scheduler import HostQueueTimeout
+from services.host_scheduler import get_host_scheduler
+from services.host_scheduler import parse_retry_after
+from services.host_scheduler import url_host
+from services.http_client import get_http_client
+from services.local_cache import cache_invalidator
+from services.local_cache import local_cache
+from services.metrics import CACHE_LOCAL_HIT
+from services.metrics import CACHE_MISS
+from services.metrics import CACHE_REDIS_HIT
+from services.metrics import PARSE_DURATION
+from services.metrics import PARSES_OFFLOADED
+from services.metrics import REDIS_GET
+from services.metrics import REDIS_MGET
+from services.metrics import REDIS_SET
+from services.metrics import SCRAPE_BYTES
+from services.metrics import SCRAPE_FETCH_ERROR
+from services.metrics import SCRAPE_FETCH_NOT_MODIFIED
+from services.metrics import SCRAPE_FETCH_OK
+from services.metrics import SCRAPE_FETCH_THROTTLED
+from services.metrics import SCRAPES_IN_FLIGHT
+from services.og_parser import is_html_content_type
+from services.og_parser import make_head_parser
+from services.parse_pool import parse_head_in_pool
+from services.url_normalizer import canonical_alias_target
+from services.write_behind import WriteBehindBuffer
+from settings import HTML_PARSE_INLINE_MAX_BYTES
+from settings import HTML_PARSE_POOL
+from settings import HTML_PARSER_BACKEND
+from settings import LOCAL_CACHE_ENABLED
 from settings import REDIS_CLIENT
+from settings import REDIS_OG_NEGATIVE_EXPIRATION_SECONDS
+from settings import SCRAPE_CACHE_TTL_DEFAULT_SECONDS
+from settings import SCRAPE_CACHE_TTL_MAX_SECONDS
+from settings import SCRAPE_CACHE_TTL_MIN_SECONDS
+from settings import SCRAPE_RETRY_BACKOFF_BASE_SECONDS
+from settings import SCRAPE_RETRY_BACKOFF_MAX_SECONDS
+from settings import SCRAPE_STALE_WHILE_REVALIDATE_SECONDS
+from settings import SCRAPER_CHUNK_SIZE_BYTES
+from settings import SCRAPER_MAX_BYTES
+from settings import SCRAPER_RETRY_AFTER_DEFAULT_SECONDS
+from settings import SCRAPER_RETRY_AFTER_MAX_SECONDS
+from settings import SCRAPER_THROTTLE_MAX_RETRIES
+from settings import SCRAPER_TOTAL_TIMEOUT_SECONDS
+from settings import URL_CANONICAL_ALIASES_ENABLED
+from settings import WRITE_BEHIND_ENABLED
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
 from typing import Optional
+from typing import Set
 
 
-REDIS_OG_PROCESS_EXPIRATION_SECONDS = 60 * 5
+# Cache values are the URLInfo json of the record, keyed by url
+REDIS_OG_CACHE_KEY_PREFIX = "og:info:"
+# With stale-while-revalidate, set while the cached value is fresh, the value itself outlives it by the stale window
+REDIS_OG_FRESH_KEY_PREFIX = "og:fresh:"
+# Alias url to its canonical url, the alias row in the DB keeps the mapping too
+REDIS_OG_ALIAS_KEY_PREFIX = "og:alias:"
+# model_dump_json is compact, a failed record always contains this exact text
+FAILED_STATUS_JSON = f'"status":"{URLStatus.FAILED.value}"'
+# Origin answers asking us to slow down
+THROTTLE_STATUS_CODES = (429, 503)
+# End of the head in the text of a page whose head is parsed in the pool, the chunks overlap to find it across two
+HEAD_END = re.compile(r"</head\s*>|<body[\s>]", re.IGNORECASE)
+HEAD_END_OVERLAP = 16
 
 logger = logging.getLogger(__name__)
 
-async def extract_og_image(url: str) -> Optional[str]:
+
+class OriginThrottled(Exception):
     """
-    Extract the OG image from the url
+    The origin answered 429/503, retry_after is the seconds it asked us to wait (None if it did not say)
+    """
+    def __init__(self, status_code: int, retry_after: Optional[float]):
+        super().__init__(f"origin throttled with {status_code}")
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+@dataclass
+class OGPage:
+    """
+    Result of one page fetch: the og image, the page metadata and the origin cache validators
+    """
+    image_url: Optional[str] = None
+    metadata: Dict[str, Any] = field(default_factory=dict)  # by crud.METADATA_COLUMNS key
+    canonical_url: Optional[str] = None  # <link rel="canonical">, absolute
+    not_modified: bool = False  # 304, the stored record is still valid
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    max_age: Optional[int] = None
+
+
+def parse_max_age(headers) -> Optional[int]:
+    """
+    Freshness lifetime of a response in seconds: Cache-Control s-maxage / max-age, else Expires - Date.
+    no-store / no-cache count as 0, None if the origin did not say.
+    """
+    directives = {}
+    for directive in headers.get("cache-control", "").split(","):
+        name, _, value = directive.strip().partition("=")
+        if name:
+            directives[name.lower()] = value.strip().strip('"')
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    for name in ("s-maxage", "max-age"):
+        if name in directives:
+            try:
+                return max(0, int(directives[name]))
+            except ValueError:
+                pass
+    expires = headers.get("expires")
+    if expires:
+        try:
+            date = parsedate_to_datetime(headers["date"]) if headers.get("date") else datetime.now(timezone.utc)
+            return max(0, int((parsedate_to_datetime(expires) - date).total_seconds()))
+        except (TypeError, ValueError, IndexError):
+            return 0  # an invalid Expires means already expired
+    return None
+
+
+async def iter_text_pieces(response: httpx.Response, max_chars: int) -> AsyncIterator[str]:
+    """
+    Decoded text of the body as it arrives from the network, a large network chunk split in pieces of max_chars.
+    aiter_text(chunk_size) would hold the text back until chunk_size is buffered,
+    so the end of the head of a short or slowly sent page would only be seen with the rest of the body.
+    """
+    async for text in response.aiter_text():
+        for i in range(0, len(text), max_chars):
+            yield text[i:i + max_chars]
+
+
+async def stream_og_page(
+    url: str,
+    max_bytes: int = SCRAPER_MAX_BYTES,
+    etag: Optional[str] = None,
+    last_modified: Optional[str] = None,
+) -> Optional[OGPage]:
+    """
+    Stream the page body and parse it incrementally.
+    Stops reading, and closes the connection, once the head section is over
+    or max_bytes were downloaded. Non-html responses are refused before the body is read.
+    A head still open past HTML_PARSE_INLINE_MAX_BYTES is parsed at once in the parse pool, off the event loop.
+    With validators the request is conditional, a 304 has no body to parse.
+    Any other non-2xx answer is an error page, it is not parsed.
     Args:
         Input:
             url: input url
+            max_bytes: download budget for the body
+            etag, last_modified: validators of the stored page, sent as If-None-Match / If-Modified-Since
         Output:
-            image_url
+            OGPage, None for an error status
     """
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    client = get_http_client()
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code in THROTTLE_STATUS_CODES:
+            raise OriginThrottled(response.status_code, parse_retry_after(response.headers.get("retry-after")))
+        page = OGPage(
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+            max_age=parse_max_age(response.headers),
+        )
+        if response.status_code == 304 and headers:
+            page.not_modified = True
+            return page
+        if not response.is_success:
+            logging.info(f"Extract og tag from url: {url} failed - status: {response.status_code}")
+            return None
+        content_type = response.headers.get("content-type")
+        if not is_html_content_type(content_type):
+            logging.info(f"Extract og tag from url: {url} skipped - content type: {content_type}")
+            return page
+
+        # Relative urls of the page are resolved against its final url, after redirects
+        base_url = str(response.url)
+        parser = make_head_parser(base_url, HTML_PARSER_BACKEND)
+        parse_seconds = 0.0
+        can_offload = HTML_PARSE_POOL != "inline"
+        texts: List[str] = []  # the page so far, parsed again in the pool if its head is large
+        offloaded = False
+        async for text in iter_text_pieces(response, SCRAPER_CHUNK_SIZE_BYTES):
+            if can_offload:
+                texts.append(text)
+            if offloaded:
+                # Only look for the end of the head, the pool parses it all at once
+                if HEAD_END.search(texts[-2][-HEAD_END_OVERLAP:] + text):
+                    break
+            else:
+                start = time.perf_counter()
+                parser.feed(text)
+                parse_seconds += time.perf_counter() - start
+                if parser.done:
+                    break
+            if response.num_bytes_downloaded >= max_bytes:
+                logging.info(f"Extract og tag from url: {url} stopped - byte budget {max_bytes} reached")
+                break
+            # Still in the head and within the budget: the rest of the head is parsed in the pool
+            offloaded = offloaded or (can_offload and response.num_bytes_downloaded >= HTML_PARSE_INLINE_MAX_BYTES)
+        if offloaded:
+            result = await parse_head_in_pool("".join(texts), base_url, HTML_PARSER_BACKEND)
+            page.image_url = result["image_url"]
+            page.metadata = result["metadata"]
+            page.canonical_url = result["canonical_url"]
+            PARSES_OFFLOADED.inc()
+            PARSE_DURATION.observe(parse_seconds + result["seconds"])
+        else:
+            start = time.perf_counter()
+            page.image_url = parser.image_url
+            page.metadata = parser.metadata()
+            page.canonical_url = parser.canonical_url
+            PARSE_DURATION.observe(parse_seconds + time.perf_counter() - start)
+        SCRAPE_BYTES.observe(response.num_bytes_downloaded)
+        return page
+
+
+async def stream_og_image(url: str, max_bytes: int = SCRAPER_MAX_BYTES) -> Optional[str]:
+    """
+    Stream the page and return its og image, see stream_og_page
+    """
+    page = await stream_og_page(url, max_bytes)
+    return page.image_url if page else None
+
+
+async def fetch_og_page(url: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> Optional[OGPage]:
+    """
+    Fetch the page of the url, conditionally if validators are given.
+    Each fetch waits for a slot of the host scheduler first, the total timeout only covers the fetch.
+    A 429/503 pauses the host for its Retry-After, then the fetch is retried up to SCRAPER_THROTTLE_MAX_RETRIES times.
+    Raise HostQueueTimeout when no host slot was granted in time: the url was not fetched, that is not its failure.
+    Args:
+        Input:
+            url: input url
+            etag, last_modified: validators of the stored page
+        Output:
+            OGPage, None if the fetch failed
+    """
+    scheduler = get_host_scheduler()
+    host = url_host(url)
     try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.get(url)
-            soup = BeautifulSoup(response.text, "html.parser")
-            tag = soup.find("meta", property="og:image")
-            image_url = tag["content"] if tag else None
-            logging.info(f"Extract og tag from url: {url}, image_url: {image_url}")
-            return image_url
+        for attempt in range(SCRAPER_THROTTLE_MAX_RETRIES + 1):
+            try:
+                async with scheduler.slot(host):
+                    page = await timed_fetch(url, etag, last_modified)
+                if page is None:
+                    return None
+                logging.info(f"Extract og tag from url: {url}, image_url: {page.image_url}, not modified: {page.not_modified}")
+                return page
+            except OriginThrottled as e:
+                delay = SCRAPER_RETRY_AFTER_DEFAULT_SECONDS if e.retry_after is None else e.retry_after
+                await scheduler.penalize(host, min(delay, SCRAPER_RETRY_AFTER_MAX_SECONDS))
+                logging.info(f"Extract og tag from url: {url} throttled - status: {e.status_code}, attempt: {attempt + 1}")
+        return None
+    except HostQueueTimeout:
+        raise
     except Exception as e:
         logging.exception(f"Extract og tag from url: {url} error: {e}")
         return None
 
 
-async def cache_save(url: str, image_url: str, ttl: int = REDIS_OG_PROCESS_EXPIRATION_SECONDS):
+async def timed_fetch(url: str, etag: Optional[str], last_modified: Optional[str]) -> Optional[OGPage]:
+    """
+    stream_og_page within the total timeout, counted in the in-flight scrapes and the fetch time metrics
+    """
+    SCRAPES_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    metric = SCRAPE_FETCH_ERROR
+    try:
+        page = await asyncio.wait_for(
+            stream_og_page(url, etag=etag, last_modified=last_modified), timeout=SCRAPER_TOTAL_TIMEOUT_SECONDS
+        )
+        if page is not None:
+            metric = SCRAPE_FETCH_NOT_MODIFIED if page.not_modified else SCRAPE_FETCH_OK
+        return page
+    except OriginThrottled:
+        metric = SCRAPE_FETCH_THROTTLED
+        raise
+    finally:
+        metric.observe(time.perf_counter() - start)
+        SCRAPES_IN_FLIGHT.dec()
+
+
+async def extract_og_image(url: str) -> Optional[str]:
+    """
+    Extract the OG image from the url
+    Args:
+        Input:
+            url: input url
+        Output:
+            image_url
+    """
+    page = await fetch_og_page(url)
+    return page.image_url if page else None
+
+
+def cache_key(url: str) -> str:
+    return REDIS_OG_CACHE_KEY_PREFIX + url
+
+
+def fresh_key(url: str) -> str:
+    return REDIS_OG_FRESH_KEY_PREFIX + url
+
+
+def alias_key(url: str) -> str:
+    return REDIS_OG_ALIAS_KEY_PREFIX + url
+
+
+def cache_ttl_seconds(max_age: Optional[int]) -> int:
+    """
+    Freshness lifetime of a record: the origin max age (the default if unknown) within the configured bounds
+    """
+    ttl = SCRAPE_CACHE_TTL_DEFAULT_SECONDS if max_age is None else max_age
+    return min(max(ttl, SCRAPE_CACHE_TTL_MIN_SECONDS), SCRAPE_CACHE_TTL_MAX_SECONDS)
+
+
+def as_utc(value: datetime) -> datetime:
+    """
+    A stored datetime as an aware one, sqlite drops the timezone and values are stored in utc
+    """
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def fresh_seconds_left(entry, now: Optional[datetime] = None) -> float:
+    """
+    Seconds until the record must be revalidated with the origin, negative once stale.
+    A record never validated (scraped before validators were stored) is stale.
+    """
+    validated_at = getattr(entry, "validated_at", None)
+    if validated_at is None:
+        return -SCRAPE_CACHE_TTL_MAX_SECONDS
+    age = ((now or datetime.now(timezone.utc)) - as_utc(validated_at)).total_seconds()
+    return cache_ttl_seconds(getattr(entry, "max_age", None)) - age
+
+
+def is_stale_servable(entry, now: Optional[datetime] = None) -> bool:
+    """
+    Check if a stale record may still be served while it is revalidated in the background
+    """
+    return bool(SCRAPE_STALE_WHILE_REVALIDATE_SECONDS) and \
+        fresh_seconds_left(entry, now) > -SCRAPE_STALE_WHILE_REVALIDATE_SECONDS
+
+
+async def cache_get(url: str) -> Optional[str]:
+    """
+    Get the cached URLInfo json of the url, ready to be sent as the response body.
+    Reads the local cache first, then Redis, and keeps Redis hits locally.
+    With stale-while-revalidate, a stale value is returned as is and revalidated in the background.
+    """
+    key = cache_key(url)
+    if LOCAL_CACHE_ENABLED:
+        value = local_cache.get(key)
+        if value is not None:
+            CACHE_LOCAL_HIT.inc()
+            return value
+
+    start = time.perf_counter()
+    if SCRAPE_STALE_WHILE_REVALIDATE_SECONDS:
+        value, fresh = await REDIS_CLIENT.mget([key, fresh_key(url)])
+        REDIS_MGET.observe(time.perf_counter() - start)
+        if value is not None and fresh is None and FAILED_STATUS_JSON not in value:
+            revalidate_in_background(url)
+    else:
+        value = await REDIS_CLIENT.get(key)
+        REDIS_GET.observe(time.perf_counter() - start)
+    if value is None:
+        CACHE_MISS.inc()
+    else:
+        CACHE_REDIS_HIT.inc()
+        if LOCAL_CACHE_ENABLED:
+            keep_local(key, value)
+    return value
+
+
+async def cache_get_many(urls: List[str]) -> Dict[str, Optional[str]]:
+    """
+    Get the cached URLInfo json of many urls: local cache first, then one Redis MGET for the rest.
+    """
+    values: Dict[str, Optional[str]] = {}
+    missing = []
+    for url in urls:
+        value = local_cache.get(cache_key(url)) if LOCAL_CACHE_ENABLED else None
+        values[url] = value
+        if value is None:
+            missing.append(url)
+    CACHE_LOCAL_HIT.inc(len(urls) - len(missing))
+
+    if missing:
+        keys = [cache_key(url) for url in missing]
+        start = time.perf_counter()
+        if SCRAPE_STALE_WHILE_REVALIDATE_SECONDS:
+            found = await REDIS_CLIENT.mget(keys + [fresh_key(url) for url in missing])
+            cached, fresh = found[:len(keys)], found[len(keys):]
+        else:
+            cached = await REDIS_CLIENT.mget(keys)
+            fresh = cached
+        REDIS_MGET.observe(time.perf_counter() - start)
+        hits = sum(value is not None for value in cached)
+        CACHE_REDIS_HIT.inc(hits)
+        CACHE_MISS.inc(len(missing) - hits)
+        for url, key, value, is_fresh in zip(missing, keys, cached, fresh):
+            values[url] = value
+            if value is not None and is_fresh is None and FAILED_STATUS_JSON not in value:
+                revalidate_in_background(url)
+            if value is not None and LOCAL_CACHE_ENABLED:
+                keep_local(key, value)
+    return values
+
+
+def keep_local(key: str, value: str):
+    """
+    Keep a Redis hit in the local cache, failed records with the shorter negative TTL.
+    The Redis TTL left is unknown here, the shortest freshness lifetime bounds how stale the copy can get.
+    """
+    is_failed = FAILED_STATUS_JSON in value
+    local_cache.set(key, value, REDIS_OG_NEGATIVE_EXPIRATION_SECONDS if is_failed else SCRAPE_CACHE_TTL_MIN_SECONDS)
+
+
+def entry_cache_ttl(entry) -> int:
+    """
+    Cache TTL of a record: the freshness left, from the origin cache headers
+    """
+    if getattr(entry, "validated_at", None) is None:
+        return cache_ttl_seconds(getattr(entry, "max_age", None))
+    return max(1, int(fresh_seconds_left(entry)))
+
+
+def queue_cache_set(pipe, url: str, value: str, ttl: int):
+    """
+    Queue the cache write of a URLInfo json value on a Redis pipeline
+    """
+    if SCRAPE_STALE_WHILE_REVALIDATE_SECONDS and FAILED_STATUS_JSON not in value:
+        # The value outlives its freshness by the stale window, the marker tells fresh from stale
+        pipe.set(cache_key(url), value, ex=ttl + SCRAPE_STALE_WHILE_REVALIDATE_SECONDS)
+        pipe.set(fresh_key(url), "1", ex=ttl)
+    else:
+        pipe.set(cache_key(url), value, ex=ttl)
+
+
+async def cache_save(entry, ttl: Optional[int] = None):
+    """
+    Save the full record (URLRecord or URLInfo) as URLInfo json with TTL to the cache,
+    so a cache hit needs no DB query.
+    The TTL defaults to the freshness left of the record, from the origin cache headers.
+    Other workers are told to drop their local copy.
+    """
+    if ttl is None:
+        ttl = entry_cache_ttl(entry)
+    key = cache_key(entry.url)
+    value = URLInfo.model_validate(entry).model_dump_json()
+    start = time.perf_counter()
+    if SCRAPE_STALE_WHILE_REVALIDATE_SECONDS and FAILED_STATUS_JSON not in value:
+        async with REDIS_CLIENT.pipeline(transaction=False) as pipe:
+            queue_cache_set(pipe, entry.url, value, ttl)
+            await pipe.execute()
+    else:
+        await REDIS_CLIENT.set(key, value, ex=ttl)
+    REDIS_SET.observe(time.perf_counter() - start)
+    if LOCAL_CACHE_ENABLED:
+        local_cache.set(key, value, ttl)
+        await cache_invalidator.publish(key)
+
+
+async def cache_save_negative(entry, ttl: int = REDIS_OG_NEGATIVE_EXPIRATION_SECONDS):
+    """
+    Save a failed record, with its own (shorter) TTL.
+    """
+    await cache_save(entry, ttl=ttl)
+
+
+async def alias_get(url: str) -> Optional[str]:
     """
-    Save the url, image_url as key, value with TTL to the cache.
+    Get the canonical url the url is an alias of, None if it is not an alias (or its Redis key expired,
+    the alias row then leads to the canonical record and saves the alias again)
     """
-    await REDIS_CLIENT.set(url, image_url, ex=ttl)
+    key = alias_key(url)
+    if LOCAL_CACHE_ENABLED:
+        value = local_cache.get(key)
+        if value is not None:
+            return value
+    start = time.perf_counter()
+    value = await REDIS_CLIENT.get(key)
+    REDIS_GET.observe(time.perf_counter() - start)
+    if value is not None and LOCAL_CACHE_ENABLED:
+        local_cache.set(key, value, SCRAPE_CACHE_TTL_MAX_SECONDS)
+    return value
 
 
-async def process_og_url_by_entry_id(id: int):
+async def alias_save(url: str, canonical_url: str):
+    """
+    Save the alias url to canonical url mapping, so a submit of the alias is one lookup away from the canonical record
+    """
+    key = alias_key(url)
+    start = time.perf_counter()
+    await REDIS_CLIENT.set(key, canonical_url, ex=SCRAPE_CACHE_TTL_MAX_SECONDS)
+    REDIS_SET.observe(time.perf_counter() - start)
+    if LOCAL_CACHE_ENABLED:
+        local_cache.set(key, canonical_url, SCRAPE_CACHE_TTL_MAX_SECONDS)
+
+
+def retry_backoff_seconds(attempt_count: int) -> float:
+    """
+    Exponential backoff after attempt_count failed scrapes in a row
     """
-    Process the og tag based on entry id and save the value to the cache
+    return min(SCRAPE_RETRY_BACKOFF_BASE_SECONDS * 2 ** (attempt_count - 1), SCRAPE_RETRY_BACKOFF_MAX_SECONDS)
+
+
+def is_retry_deferred(entry, now: Optional[datetime] = None) -> bool:
+    """
+    Check if a failed entry is still in its backoff window
+    """
+    if entry.next_retry_at is None:
+        return False
+    return as_utc(entry.next_retry_at) > (now or datetime.now(timezone.utc))
+
+
+async def process_og_url_entry(session: AsyncSession, entry: URLRecord) -> URLRecord:
+    """
+    Process the og tag of a loaded entry and save the value to the cache.
+    An entry with an image is revalidated: the fetch is conditional, and a 304 only refreshes its freshness.
+    A url without og image is persisted as failed, negatively cached and retried with backoff.
+    Args:
+        Input:
+            session: DB session holding the entry
+            entry: URLRecord to scrape
+        Output:
+            the updated URLRecord
+    """
+    id, url = entry.id, entry.url
+    etag, last_modified = (entry.etag, entry.last_modified) if entry.image_url else (None, None)
+    # End the read transaction first, so no DB connection is held during the fetch
+    await session.commit()
+    try:
+        page = await fetch_og_page(url, etag, last_modified)
+    except HostQueueTimeout:
+        # Our own host queue was full, the entry is left as is and no attempt is counted
+        logging.info(f"Process og url: {url} not fetched - host queue timeout")
+        return entry
+    now = datetime.now(timezone.utc)
+    if page and page.not_modified:
+        updated = await save_result(
+            session, entry, entry.image_url, URLStatus.SUCCESS.value,
+            etag=page.etag or etag,
+            last_modified=page.last_modified or last_modified,
+            max_age=entry.max_age if page.max_age is None else page.max_age,
+            validated_at=now,
+            metadata={column.key: getattr(entry, column.key) for column in crud.METADATA_COLUMNS},
+        )
+        logging.info(f"Process og url: {url} not modified")
+    elif page and page.image_url:
+        values = dict(
+            etag=page.etag, last_modified=page.last_modified, max_age=page.max_age, validated_at=now,
+            metadata=page.metadata,
+        )
+        canonical_url = canonical_alias_target(url, page.canonical_url) if URL_CANONICAL_ALIASES_ENABLED else None
+        if canonical_url:
+            # Aliases are rare, their writes are not deferred
+            updated = await crud.update_url_entry(session, id, page.image_url, URLStatus.SUCCESS.value, **values)
+            if updated:
+                updated = await save_canonical_alias(session, updated, canonical_url, page, now)
+            if updated:
+                await cache_save(updated)
+        else:
+            updated = await save_result(session, entry, page.image_url, URLStatus.SUCCESS.value, **values)
+    elif page is None and entry.image_url:
+        # The revalidation failed, keep serving the stored image and try again after the shortest lifetime
+        updated = entry
+        await cache_save(entry, ttl=SCRAPE_CACHE_TTL_MIN_SECONDS)
+        logging.info(f"Process og url: {url} revalidation failed, stored image kept")
+    else:
+        attempt_count = (entry.attempt_count or 0) + 1
+        next_retry_at = datetime.now(timezone.utc) + timedelta(seconds=retry_backoff_seconds(attempt_count))
+        updated = await save_result(
+            session, entry, None, URLStatus.FAILED.value, attempt_count=attempt_count, next_retry_at=next_retry_at
+        )
+        logging.info(f"Process og url: {url} failed - attempt: {attempt_count}, next retry at: {next_retry_at}")
+    return updated
+
+
+@dataclass
+class PendingResult:
+    """
+    Scrape result waiting in the write-behind buffer
+    """
+    id: int
+    url: str
+    columns: Dict[str, Any]  # crud.url_entry_values
+    value: str  # URLInfo json of the cache
+    ttl: int
+
+
+async def save_result(
+    session: AsyncSession, entry: URLRecord, image_url: Optional[str], status: str, **values
+) -> Optional[URLRecord]:
+    """
+    Write the scrape result of an entry to the DB, then the cache (negatively for a failure).
+    With WRITE_BEHIND_ENABLED the writes are queued to the write-behind buffer instead,
+    this worker serves the result from its local cache until they are flushed.
+    Args:
+        Input:
+            session: DB session holding the entry
+            entry: the scraped URLRecord
+            image_url, status, values: the result, see crud.update_url_entry
+        Output:
+            the updated URLRecord, a transient one not attached to the session with the write-behind
+    """
+    failed = status == URLStatus.FAILED.value
+    if not WRITE_BEHIND_ENABLED:
+        updated = await crud.update_url_entry(session, entry.id, image_url, status, **values)
+        if updated:
+            await (cache_save_negative(updated) if failed else cache_save(updated))
+        return updated
+
+    columns = crud.url_entry_values(image_url, status, **values)
+    record = URLRecord(
+        id=entry.id, url=entry.url, canonical_url=entry.canonical_url, created_at=entry.created_at, **columns
+    )
+    ttl = REDIS_OG_NEGATIVE_EXPIRATION_SECONDS if failed else entry_cache_ttl(record)
+    value = URLInfo.model_validate(record).model_dump_json()
+    if LOCAL_CACHE_ENABLED:
+        local_cache.set(cache_key(record.url), value, ttl)
+    get_write_behind().add(record.id, PendingResult(record.id, record.url, columns, value, ttl))
+    return record
+
+
+async def write_results(results: List[PendingResult]):
+    """
+    Write a batch of the write-behind buffer: the records in one transaction, then the cache in one pipeline
+    """
+    async with AsyncSessionLocal() as session:
+        await crud.update_url_entries(session, [{"id": result.id, **result.columns} for result in results])
+    start = time.perf_counter()
+    async with REDIS_CLIENT.pipeline(transaction=False) as pipe:
+        for result in results:
+            queue_cache_set(pipe, result.url, result.value, result.ttl)
+        await pipe.execute()
+    REDIS_SET.observe(time.perf_counter() - start)
+    if LOCAL_CACHE_ENABLED:
+        await cache_invalidator.publish_many([cache_key(result.url) for result in results])
+
+
+_write_behind: Optional[WriteBehindBuffer] = None
+
+
+def get_write_behind() -> WriteBehindBuffer:
+    """
+    Get the write-behind buffer of the scrape results of this process
+    """
+    global _write_behind
+    if _write_behind is None:
+        _write_behind = WriteBehindBuffer(write_results)
+    return _write_behind
+
+
+async def close_write_behind():
+    """
+    Write the pending scrape results and stop the buffer. Called at shutdown, once no scrape is running.
+    """
+    global _write_behind
+    if _write_behind is not None:
+        await _write_behind.stop()
+        _write_behind = None
+
+
+async def save_canonical_alias(
+    session: AsyncSession, entry: URLRecord, canonical_url: str, page: OGPage, now: datetime
+) -> Optional[URLRecord]:
+    """
+    Make a scraped entry an alias of the canonical url its page declared.
+    The canonical record gets the scrape result, it is the same page, without the validators of the alias response.
+    Args:
+        Input:
+            session: DB session
+            entry: the updated alias URLRecord
+            canonical_url: normalized canonical url
+            page: the scraped page
+            now: validation time of the scrape
+        Output:
+            the updated canonical URLRecord
+    """
+    await crud.set_canonical_url(session, entry.id, canonical_url)
+    canonical = await crud.upsert_url_entry(session, canonical_url)
+    updated = await crud.update_url_entry(
+        session, canonical.id, page.image_url, URLStatus.SUCCESS.value,
+        max_age=page.max_age, validated_at=now, metadata=page.metadata,
+    )
+    await alias_save(entry.url, canonical_url)
+    logging.info(f"Process og url: {entry.url} is an alias of {canonical_url}")
+    return updated
+
+
+async def process_og_url_by_entry_id(id: int) -> Optional[URLRecord]:
+    """
+    Process the og tag based on entry id in its own DB session, for workers outside of a request
     Args:
         Input:
             id: input URLRecord id
+        Output:
+            the updated URLRecord, None if not found
     """
-    await init_db()
     async with AsyncSessionLocal() as session:
         entry = await session.get(URLRecord, id)
         if entry:
-            url = entry.url
-            image_url = await extract_og_image(url)
-            if image_url:
-                status = URLStatus.SUCCESS.value if image_url else URLStatus.FAILED.value
-                await cache_save(url, image_url)
-                await crud.update_url_entry(id, image_url or "", status)
+            return await process_og_url_entry(session, entry)
+    return None
+
+
+_revalidating: Set[str] = set()
+_revalidation_tasks: Set[asyncio.Task] = set()
+
+
+def revalidate_in_background(url: str):
+    """
+    Revalidate a stale record without making the caller wait, once per url at a time in this process
+    """
+    if url in _revalidating:
+        return
+    _revalidating.add(url)
+    task = asyncio.ensure_future(revalidate_url(url))
+    _revalidation_tasks.add(task)
+
+    def done(_):
+        _revalidation_tasks.discard(task)
+        _revalidating.discard(url)
+    task.add_done_callback(done)
+
+
+async def revalidate_url(url: str) -> Optional[URLRecord]:
+    """
+    Revalidate the record of the url if it is stale, in its own DB session.
+    The freshness marker is taken for the length of a fetch, so one worker revalidates while the others serve stale.
+    """
+    try:
+        if not await REDIS_CLIENT.set(fresh_key(url), "revalidating", nx=True, ex=int(SCRAPER_TOTAL_TIMEOUT_SECONDS) + 1):
+            return None
+        async with AsyncSessionLocal() as session:
+            entry = await crud.get_url_entry_by_url(session, url)
+            if entry and entry.image_url and fresh_seconds_left(entry) <= 0:
+                return await process_og_url_entry(session, entry)
+    except Exception as e:
+        logging.exception(f"Revalidate url: {url} error: {e}")
+    return None
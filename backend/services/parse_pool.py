@@ -0,0 +1,51 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from services.executors import LazyExecutor
+from services.executors import spawn_process_pool
+from services.og_parser import parse_head
+from settings import HTML_PARSE_POOL
+from settings import HTML_PARSE_WORKERS
+from settings import HTML_PARSER_BACKEND
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+
+PARSE_POOLS = ("process", "thread", "inline")
+
+_parse_pool: Optional[LazyExecutor] = None
+
+
+def get_parse_pool() -> Optional[LazyExecutor]:
+    """
+    Get the pool parsing the large page heads, None if HTML_PARSE_POOL is "inline"
+    """
+    global _parse_pool
+    if HTML_PARSE_POOL not in PARSE_POOLS:
+        raise ValueError(f"Unknown HTML parse pool: {HTML_PARSE_POOL}, expected one of {', '.join(PARSE_POOLS)}")
+    if _parse_pool is None and HTML_PARSE_POOL == "process":
+        _parse_pool = spawn_process_pool(HTML_PARSE_WORKERS)
+    elif _parse_pool is None and HTML_PARSE_POOL == "thread":
+        _parse_pool = LazyExecutor(lambda: ThreadPoolExecutor(HTML_PARSE_WORKERS, thread_name_prefix="og-parse"))
+    return _parse_pool
+
+
+def close_parse_pool():
+    """
+    Shut the parse pool down. Called from the FastAPI lifespan and the worker.
+    """
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.close()
+        _parse_pool = None
+
+
+async def parse_head_in_pool(text: str, base_url: Optional[str], backend: str = HTML_PARSER_BACKEND) -> Dict[str, Any]:
+    """
+    Parse the head of a page off the event loop, see og_parser.parse_head
+    """
+    parse = functools.partial(parse_head, text, base_url, backend)
+    pool = get_parse_pool()
+    if pool is None:
+        return parse()
+    return await pool.run(parse)
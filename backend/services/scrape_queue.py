@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from database.models import URLRecord
+from services.og_scraper import process_og_url_by_entry_id
+from settings import REDIS_CLIENT
+from settings import SCRAPE_QUEUE_BACKEND
+from settings import SCRAPE_QUEUE_KEY
+from settings import SCRAPE_QUEUE_MAX_SIZE
+from settings import SCRAPE_WORKER_CONCURRENCY
+from typing import Awaitable
+from typing import Callable
+from typing import List
+from typing import Optional
+from typing import Set
+
+
+logger = logging.getLogger(__name__)
+
+# Queue ARGV[1] in one step. Returns 1 once queued, 0 if it already is, -1 when the list holds ARGV[2] jobs.
+# An id left in the set without a list entry (a worker died between its pop and srem) is queued again.
+ENQUEUE_SCRIPT = """
+if redis.call("sismember", KEYS[2], ARGV[1]) == 1 and redis.call("lpos", KEYS[1], ARGV[1]) then
+    return 0
+end
+if redis.call("llen", KEYS[1]) >= tonumber(ARGV[2]) then
+    return -1
+end
+redis.call("sadd", KEYS[2], ARGV[1])
+redis.call("lpush", KEYS[1], ARGV[1])
+return 1
+"""
+
+
+class ScrapeQueueFull(Exception):
+    pass
+
+
+class InMemoryScrapeQueue:
+    """
+    Scrape job queue inside this process, for single worker deployments and tests.
+    A URLRecord id is only queued once until a worker picks it up.
+    """
+    def __init__(self, max_size: int = SCRAPE_QUEUE_MAX_SIZE):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._queued: Set[int] = set()
+
+    async def put(self, id: int) -> bool:
+        """
+        Queue a URLRecord id. Returns False if it is already queued.
+        """
+        if id in self._queued:
+            return False
+        try:
+            self._queue.put_nowait(id)
+        except asyncio.QueueFull:
+            raise ScrapeQueueFull(f"Scrape queue is full ({self._queue.maxsize} jobs)")
+        self._queued.add(id)
+        return True
+
+    async def get(self, timeout: float = 1) -> Optional[int]:
+        """
+        Take the next URLRecord id, or None after timeout seconds.
+        """
+        try:
+            id = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+        except asyncio.TimeoutError:
+            return None
+        self._queued.discard(id)
+        return id
+
+    async def size(self) -> int:
+        return self._queue.qsize()
+
+
+class RedisScrapeQueue:
+    """
+    Scrape job queue on a Redis list, so separate worker processes can drain it.
+    A Redis set tracks queued ids, a URLRecord id is only queued once until a worker picks it up.
+    Delivery is at most once: a job is off the list as soon as a worker takes it, if that worker dies mid-job
+    the job is lost and the record stays pending until it is submitted again.
+    """
+    def __init__(self, redis_client, key: str = SCRAPE_QUEUE_KEY, max_size: int = SCRAPE_QUEUE_MAX_SIZE):
+        self.redis = redis_client
+        self.key = key
+        self.queued_key = f"{key}:queued"
+        self.max_size = max_size
+
+    async def put(self, id: int) -> bool:
+        queued = int(await self.redis.eval(ENQUEUE_SCRIPT, 2, self.key, self.queued_key, id, self.max_size))
+        if queued < 0:
+            raise ScrapeQueueFull(f"Scrape queue is full ({self.max_size} jobs)")
+        return queued == 1
+
+    async def get(self, timeout: float = 1) -> Optional[int]:
+        item = await self.redis.brpop(self.key, timeout=timeout)
+        if item is None:
+            return None
+        _, id = item
+        await self.redis.srem(self.queued_key, id)
+        return int(id)
+
+    async def size(self) -> int:
+        return await self.redis.llen(self.key)
+
+
+class ScrapeWorkerPool:
+    """
+    Bounded pool of workers draining a scrape queue.
+    Each worker handles one job at a time, so concurrency is the max number of in-flight scrapes.
+    """
+    def __init__(
+        self,
+        queue,
+        concurrency: int = SCRAPE_WORKER_CONCURRENCY,
+        handler: Callable[[int], Awaitable[Optional[URLRecord]]] = process_og_url_by_entry_id,
+    ):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.handler = handler
+        self._tasks: List[asyncio.Task] = []
+        self._running = False
+
+    def start(self):
+        self._running = True
+        self._tasks = [asyncio.ensure_future(self._work(i)) for i in range(self.concurrency)]
+        logger.info(f"Scrape worker pool started - concurrency: {self.concurrency}")
+
+    async def stop(self, timeout: float = 10):
+        """
+        Stop taking jobs and let in-flight jobs finish for up to timeout seconds.
+        """
+        self._running = False
+        _, pending = await asyncio.wait(self._tasks, timeout=timeout) if self._tasks else (None, [])
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._tasks = []
+        logger.info("Scrape worker pool stopped")
+
+    async def _work(self, index: int):
+        while self._running:
+            id = await self.queue.get(timeout=1)
+            if id is None:
+                continue
+            try:
+                await self.handler(id)
+            except Exception as e:
+                logger.exception(f"Scrape worker {index} - entry id: {id} error: {e}")
+
+
+_queue = None
+
+
+def get_scrape_queue():
+    """
+    Get the shared scrape queue for the configured backend
+    """
+    global _queue
+    if _queue is None:
+        if SCRAPE_QUEUE_BACKEND == "redis":
+            _queue = RedisScrapeQueue(REDIS_CLIENT)
+        else:
+            _queue = InMemoryScrapeQueue()
+    return _queue
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import uuid
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+
+
+logger = logging.getLogger(__name__)
+
+# Delete the lock only if we still own it, so a slow leader never frees a lock re-acquired by someone else
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+# Push the expiry of the lock back, only if we still own it
+EXTEND_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("pexpire", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class SingleFlight:
+    """
+    In-process call coalescing.
+    Concurrent calls with the same key share one running call and its result.
+    The call runs as its own task, so a cancelled caller does not cancel it for the other waiters.
+    """
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._forget(key, task))
+        return await asyncio.shield(task)
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+
+
+class RedisSingleFlight:
+    """
+    Call coalescing across processes and nodes with a Redis lock.
+    The lock owner runs the call and publishes its result for a short time,
+    the other callers poll for that result instead of running the call again.
+    The owner refreshes the lock every third of lock_ttl while the call runs, however long it takes.
+    If the owner dies, the lock expires within lock_ttl and a waiter takes over.
+    Results go through dumps/loads, so they must be serializable.
+    """
+    def __init__(
+        self,
+        redis_client,
+        prefix: str = "singleflight",
+        lock_ttl: float = 15,
+        result_ttl: float = 5,
+        poll_interval: float = 0.05,
+        dumps: Callable[[Any], str] = json.dumps,
+        loads: Callable[[str], Any] = json.loads,
+    ):
+        self.redis = redis_client
+        self.prefix = prefix
+        self.lock_ttl_ms = int(lock_ttl * 1000)
+        self.result_ttl_ms = int(result_ttl * 1000)
+        self.poll_interval = poll_interval
+        self.dumps = dumps
+        self.loads = loads
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        lock_key = f"{self.prefix}:lock:{key}"
+        result_key = f"{self.prefix}:result:{key}"
+        token = uuid.uuid4().hex
+
+        while True:
+            published = await self.redis.get(result_key)
+            if published is not None:
+                return self.loads(published)
+
+            if await self.redis.set(lock_key, token, nx=True, px=self.lock_ttl_ms):
+                keep_lock = asyncio.ensure_future(self._keep_lock(lock_key, token))
+                try:
+                    result = await fn()
+                    await self.redis.set(result_key, self.dumps(result), px=self.result_ttl_ms)
+                    return result
+                finally:
+                    keep_lock.cancel()
+                    await asyncio.gather(keep_lock, return_exceptions=True)
+                    await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def _keep_lock(self, lock_key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl_ms / 3000)
+            try:
+                if not await self.redis.eval(EXTEND_LOCK_SCRIPT, 1, lock_key, token, self.lock_ttl_ms):
+                    logger.warning(f"Single flight lock {lock_key} lost while its call runs")
+                    return
+            except Exception as e:
+                # Redis unreachable for now, the next refresh may still make it before the expiry
+                logger.warning(f"Single flight lock {lock_key} refresh failed: {e}")
@@ -0,0 +1,44 @@
+import io
+import warnings
+from PIL import Image
+from PIL import ImageOps
+
+
+# A thumbnail is cut at this height to width ratio, so a very tall image does not make a huge preview
+MAX_HEIGHT_RATIO = 4
+
+
+def make_thumbnail(data: bytes, width: int, quality: int, max_pixels: int) -> bytes:
+    """
+    Resize an image to width, keeping its aspect ratio (never upscaled), and encode it as WebP.
+    Runs in the resize process pool, so this module only imports Pillow.
+    Args:
+        Input:
+            data: source image bytes
+            width: thumbnail width
+            quality: WebP quality
+            max_pixels: larger images are refused before being decoded (decompression bombs)
+        Output:
+            WebP bytes, raise ValueError if data is not a decodable image or is too large
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", Image.DecompressionBombWarning)
+            with Image.open(io.BytesIO(data)) as source:
+                # JPEG decodes at a reduced scale directly, still at least width wide
+                source.draft("RGB", (width, 1))
+                image = ImageOps.exif_transpose(source)
+                if image.mode not in ("RGB", "RGBA"):
+                    # Palette images would be resized without filtering
+                    image = image.convert("RGBA" if "transparency" in image.info or "A" in image.mode else "RGB")
+                if image.width > width:
+                    height = max(1, round(image.height * width / image.width))
+                    image = image.resize((width, height), Image.Resampling.LANCZOS)
+                if image.height > image.width * MAX_HEIGHT_RATIO:
+                    image = image.crop((0, 0, image.width, image.width * MAX_HEIGHT_RATIO))
+                output = io.BytesIO()
+                image.save(output, "WEBP", quality=quality)
+                return output.getvalue()
+    except (OSError, ValueError, Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ValueError(f"invalid image: {e}") from e
@@ -0,0 +1,106 @@
+from settings import URL_STRIP_TRAILING_SLASH
+from settings import URL_TRACKING_PARAMS
+from typing import Iterable
+from typing import Optional
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Characters left as is in query values, the others are percent-encoded
+QUERY_SAFE = "/:@!$'()*,;?"
+
+
+class TrackingParams:
+    """
+    Query param denylist, names ending with * match as prefixes, case insensitive
+    """
+    def __init__(self, patterns: Iterable[str]):
+        patterns = [pattern.strip().lower() for pattern in patterns if pattern.strip()]
+        self.names = frozenset(pattern for pattern in patterns if not pattern.endswith("*"))
+        self.prefixes = tuple(pattern[:-1] for pattern in patterns if pattern.endswith("*"))
+
+    def __contains__(self, name: str) -> bool:
+        name = name.lower()
+        return name in self.names or name.startswith(self.prefixes)
+
+
+tracking_params = TrackingParams(URL_TRACKING_PARAMS)
+
+
+def normalize_url(url: str, strip_trailing_slash: bool = URL_STRIP_TRAILING_SLASH) -> str:
+    """
+    Canonical form of a submitted url, used as the cache and DB key, so variants of one page are scraped once:
+    lowercase scheme and host, no default port, no fragment, no tracking params, query params sorted by name,
+    "/" for an empty path and, optionally, no trailing slash.
+    Urls that are not http(s) or can not be parsed are returned stripped but otherwise as is, their scrape fails anyway.
+    Args:
+        Input:
+            url: submitted url
+            strip_trailing_slash: drop the trailing slash of the path, "/a/" and "/a" are then one page
+        Output:
+            normalized url
+    """
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return url
+
+    host = parts.hostname  # lowercased by urlsplit
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    netloc = host if port is None or port == DEFAULT_PORTS[scheme] else f"{host}:{port}"
+    userinfo, at, _ = parts.netloc.rpartition("@")
+    if at:
+        netloc = f"{userinfo}@{netloc}"
+
+    path = parts.path or "/"
+    if strip_trailing_slash and len(path) > 1:
+        path = path.rstrip("/") or "/"
+
+    params = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+              if name not in tracking_params]
+    # Stable sort on the name only, repeated params keep their order
+    params.sort(key=lambda param: param[0])
+    query = urlencode(params, safe=QUERY_SAFE)
+    return urlunsplit((scheme, netloc, path, query, ""))
+
+
+def _site(host: str) -> str:
+    return host[4:] if host.startswith("www.") else host
+
+
+def canonical_alias_target(url: str, canonical_url: Optional[str]) -> Optional[str]:
+    """
+    Normalized <link rel="canonical"> of a scraped page if the url should become its alias, else None.
+    Only a canonical of the same site (ignoring www.) is followed, a page can not alias itself to another site.
+    Args:
+        Input:
+            url: normalized url of the scraped record
+            canonical_url: absolute canonical url declared by the page
+        Output:
+            normalized canonical url, None if missing, the url itself or another site
+    """
+    if not canonical_url:
+        return None
+    target = normalize_url(canonical_url)
+    if target == url:
+        return None
+    try:
+        target_host, url_host = urlsplit(target).hostname, urlsplit(url).hostname
+    except ValueError:
+        return None
+    if not target_host or not url_host or _site(target_host) != _site(url_host):
+        return None
+    return target
@@ -0,0 +1,109 @@
+import asyncio
+import logging
+import time
+from services.metrics import WRITE_BEHIND_DELAY
+from services.metrics import WRITE_BEHIND_DROPPED
+from services.metrics import WRITE_BEHIND_FLUSH_DURATION
+from services.metrics import WRITE_BEHIND_WRITTEN
+from settings import WRITE_BEHIND_FLUSH_INTERVAL_MS
+from settings import WRITE_BEHIND_MAX_RECORDS
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """
+    Collects writes by key and hands them to write in batches, every interval seconds
+    or as soon as max_records are pending. A later write of a key replaces the pending one.
+    One batch is written at a time. A batch whose write fails is logged and dropped,
+    the records keep their previous DB state and are scraped again.
+    stop() writes what is pending, call it once the producers are done.
+    Args:
+        write: writes a batch of items, in one transaction
+    """
+    def __init__(
+        self,
+        write: Callable[[List[Any]], Awaitable[None]],
+        interval: float = WRITE_BEHIND_FLUSH_INTERVAL_MS / 1000,
+        max_records: int = WRITE_BEHIND_MAX_RECORDS,
+    ):
+        self.write = write
+        self.interval = interval
+        self.max_records = max_records
+        self._pending: Dict[Hashable, Tuple[float, Any]] = {}  # key -> (time added, item)
+        self._has_pending = asyncio.Event()
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, key: Hashable, item: Any):
+        """
+        Queue the write of an item, the flush task starts with the first one
+        """
+        self._pending.pop(key, None)  # the newest write goes to the end of the batch order
+        self._pending[key] = (time.perf_counter(), item)
+        self._has_pending.set()
+        if len(self._pending) >= self.max_records:
+            self._full.set()
+        if self._task is None and not self._closed:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while not self._closed:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._has_pending.clear()
+            self._full.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.exception(f"Write-behind flush error: {e}")
+
+    async def flush(self):
+        """
+        Write every pending item now, in batches of max_records
+        """
+        async with self._lock:
+            while self._pending:
+                keys = list(self._pending)[:self.max_records]
+                batch = [self._pending.pop(key) for key in keys]
+                start = time.perf_counter()
+                try:
+                    await self.write([item for _, item in batch])
+                except Exception as e:
+                    WRITE_BEHIND_DROPPED.inc(len(batch))
+                    logger.exception(f"Write-behind flush of {len(batch)} records failed: {e}")
+                    continue
+                now = time.perf_counter()
+                WRITE_BEHIND_FLUSH_DURATION.observe(now - start)
+                WRITE_BEHIND_WRITTEN.inc(len(batch))
+                for added, _ in batch:
+                    WRITE_BEHIND_DELAY.observe(now - added)
+
+    async def stop(self):
+        """
+        Stop the flush task and write what is pending. Called from the FastAPI lifespan and the workers.
+        """
+        self._closed = True
+        if self._task is not None:
+            self._has_pending.set()
+            self._full.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -2,6 +2,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import os
+import tempfile
 import redis.asyncio as redis
 
 # Redis client
@@ -9,3 +10,141 @@ REDIS_CLIENT = redis.Redis(host="localhost", port=6379, db=0, decode_responses=T
 
 # Database url
 DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Database connection pool
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+
+# Scraper http client
+SCRAPER_CONNECT_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_CONNECT_TIMEOUT_SECONDS", "3"))
+SCRAPER_READ_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_READ_TIMEOUT_SECONDS", "5"))
+SCRAPER_TOTAL_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_TOTAL_TIMEOUT_SECONDS", "10"))
+SCRAPER_MAX_CONNECTIONS = int(os.getenv("SCRAPER_MAX_CONNECTIONS", "100"))
+SCRAPER_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("SCRAPER_MAX_KEEPALIVE_CONNECTIONS", "20"))
+SCRAPER_HTTP2_ENABLED = os.getenv("SCRAPER_HTTP2_ENABLED", "true").lower() == "true"
+SCRAPER_MAX_BYTES = int(os.getenv("SCRAPER_MAX_BYTES", str(1024 * 1024)))
+SCRAPER_CHUNK_SIZE_BYTES = int(os.getenv("SCRAPER_CHUNK_SIZE_BYTES", str(16 * 1024)))
+
+# Head parser of the scraped pages, see services/og_parser.py: "html.parser", "lxml" (needs the lxml package) or "regex"
+HTML_PARSER_BACKEND = os.getenv("HTML_PARSER_BACKEND", "html.parser")
+# A head still open past HTML_PARSE_INLINE_MAX_BYTES is parsed off the event loop, in a pool of HTML_PARSE_WORKERS
+# "thread"s or, opt-in, spawned "process"es, see services/parse_pool.py. "inline" parses every page on the event loop.
+HTML_PARSE_POOL = os.getenv("HTML_PARSE_POOL", "thread")
+HTML_PARSE_WORKERS = int(os.getenv("HTML_PARSE_WORKERS", str(os.cpu_count() or 1)))
+HTML_PARSE_INLINE_MAX_BYTES = int(os.getenv("HTML_PARSE_INLINE_MAX_BYTES", str(64 * 1024)))
+
+# DNS cache of the scraper connections, see services/dns_cache.py (a max size of 0 disables caching).
+# Answers are kept for their TTL within the min / max, the system resolver gives no TTL and gets the default one.
+DNS_CACHE_MAX_SIZE = int(os.getenv("DNS_CACHE_MAX_SIZE", "10000"))
+DNS_CACHE_DEFAULT_TTL_SECONDS = float(os.getenv("DNS_CACHE_DEFAULT_TTL_SECONDS", "300"))
+DNS_CACHE_MIN_TTL_SECONDS = float(os.getenv("DNS_CACHE_MIN_TTL_SECONDS", "30"))
+DNS_CACHE_MAX_TTL_SECONDS = float(os.getenv("DNS_CACHE_MAX_TTL_SECONDS", "3600"))
+DNS_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("DNS_CACHE_NEGATIVE_TTL_SECONDS", "30"))
+# A host used within this many seconds of its expiry is resolved again in the background, 0 disables it
+DNS_CACHE_REFRESH_AHEAD_SECONDS = float(os.getenv("DNS_CACHE_REFRESH_AHEAD_SECONDS", "10"))
+# "system" (getaddrinfo in a thread) or "aiodns" (c-ares, needs the aiodns package, answers carry their TTL)
+DNS_RESOLVER = os.getenv("DNS_RESOLVER", "system")
+# Refuse to connect to loopback, private, link-local and other non public addresses (SSRF guard)
+SCRAPER_BLOCK_PRIVATE_ADDRESSES = os.getenv("SCRAPER_BLOCK_PRIVATE_ADDRESSES", "true").lower() == "true"
+
+# Per host politeness of the scrapes, see services/host_scheduler.py (a rate of 0 disables the token bucket).
+# The scheduler is the only per host limit, the http client only caps its connections in total.
+SCRAPER_MAX_CONNECTIONS_PER_HOST = int(os.getenv("SCRAPER_MAX_CONNECTIONS_PER_HOST", "6"))
+SCRAPER_HOST_RATE_PER_SECOND = float(os.getenv("SCRAPER_HOST_RATE_PER_SECOND", "10"))
+SCRAPER_HOST_BURST = int(os.getenv("SCRAPER_HOST_BURST", "10"))
+SCRAPER_MAX_ACTIVE_SCRAPES = int(os.getenv("SCRAPER_MAX_ACTIVE_SCRAPES", str(SCRAPER_MAX_CONNECTIONS)))
+SCRAPER_HOST_QUEUE_TIMEOUT_SECONDS = float(os.getenv("SCRAPER_HOST_QUEUE_TIMEOUT_SECONDS", "60"))
+SCRAPER_RETRY_AFTER_DEFAULT_SECONDS = float(os.getenv("SCRAPER_RETRY_AFTER_DEFAULT_SECONDS", "5"))
+SCRAPER_RETRY_AFTER_MAX_SECONDS = float(os.getenv("SCRAPER_RETRY_AFTER_MAX_SECONDS", "60"))
+SCRAPER_THROTTLE_MAX_RETRIES = int(os.getenv("SCRAPER_THROTTLE_MAX_RETRIES", "1"))
+SCRAPER_HOST_LIMITS_REDIS_ENABLED = os.getenv("SCRAPER_HOST_LIMITS_REDIS_ENABLED", "false").lower() == "true"
+SCRAPER_HOST_LIMITS_REDIS_PREFIX = os.getenv("SCRAPER_HOST_LIMITS_REDIS_PREFIX", "og:host:")
+
+# In-process cache in front of Redis for the hottest urls, kept coherent across workers over Redis pub/sub
+LOCAL_CACHE_ENABLED = os.getenv("LOCAL_CACHE_ENABLED", "true").lower() == "true"
+LOCAL_CACHE_MAX_SIZE = int(os.getenv("LOCAL_CACHE_MAX_SIZE", "5000"))
+LOCAL_CACHE_INVALIDATION_ENABLED = os.getenv("LOCAL_CACHE_INVALIDATION_ENABLED", "true").lower() == "true"
+LOCAL_CACHE_INVALIDATION_CHANNEL = os.getenv("LOCAL_CACHE_INVALIDATION_CHANNEL", "og:invalidate")
+
+# Freshness of scraped records, taken from the origin cache headers within these bounds.
+# A stale record is revalidated with If-None-Match / If-Modified-Since, a 304 only refreshes its freshness.
+SCRAPE_CACHE_TTL_DEFAULT_SECONDS = int(os.getenv("SCRAPE_CACHE_TTL_DEFAULT_SECONDS", "300"))
+SCRAPE_CACHE_TTL_MIN_SECONDS = int(os.getenv("SCRAPE_CACHE_TTL_MIN_SECONDS", "60"))
+SCRAPE_CACHE_TTL_MAX_SECONDS = int(os.getenv("SCRAPE_CACHE_TTL_MAX_SECONDS", str(60 * 60 * 24)))
+# Serve a stale record for up to this many seconds while it is revalidated in the background, 0 revalidates inline
+SCRAPE_STALE_WHILE_REVALIDATE_SECONDS = int(os.getenv("SCRAPE_STALE_WHILE_REVALIDATE_SECONDS", "0"))
+
+# Hot urls, see services/hot_urls.py: submits are counted per url into a decaying score (a Redis sorted set),
+# every interval the top K are re-scraped before their record goes stale, within max re-scrapes per interval.
+# Keep the ahead time above the interval, so a hot record is refreshed before it expires.
+# Off by default, it scrapes on its own schedule: enable it on the deployments that should keep hot urls warm.
+HOT_REFRESH_ENABLED = os.getenv("HOT_REFRESH_ENABLED", "false").lower() == "true"
+HOT_REFRESH_INTERVAL_SECONDS = float(os.getenv("HOT_REFRESH_INTERVAL_SECONDS", "15"))
+# The cycle lock is released when the cycle ends, its TTL only frees the lock of a dead worker: keep it above the
+# longest cycle, max re-scrapes / concurrency fetches of up to the host queue and total timeouts each
+HOT_REFRESH_LOCK_TTL_SECONDS = float(os.getenv("HOT_REFRESH_LOCK_TTL_SECONDS", "600"))
+HOT_REFRESH_AHEAD_SECONDS = float(os.getenv("HOT_REFRESH_AHEAD_SECONDS", "45"))
+HOT_REFRESH_TOP_K = int(os.getenv("HOT_REFRESH_TOP_K", "100"))
+HOT_REFRESH_MAX_PER_CYCLE = int(os.getenv("HOT_REFRESH_MAX_PER_CYCLE", "20"))
+HOT_REFRESH_CONCURRENCY = int(os.getenv("HOT_REFRESH_CONCURRENCY", "5"))
+HOT_URLS_MIN_SCORE = float(os.getenv("HOT_URLS_MIN_SCORE", "10"))
+HOT_URLS_DECAY = float(os.getenv("HOT_URLS_DECAY", "0.5"))
+HOT_URLS_MAX_TRACKED = int(os.getenv("HOT_URLS_MAX_TRACKED", "10000"))
+HOT_URLS_KEY = os.getenv("HOT_URLS_KEY", "og:hot")
+
+# Failed scrapes, cached as negative entries and retried with exponential backoff
+REDIS_OG_NEGATIVE_EXPIRATION_SECONDS = int(os.getenv("REDIS_OG_NEGATIVE_EXPIRATION_SECONDS", "60"))
+SCRAPE_RETRY_BACKOFF_BASE_SECONDS = float(os.getenv("SCRAPE_RETRY_BACKOFF_BASE_SECONDS", "60"))
+SCRAPE_RETRY_BACKOFF_MAX_SECONDS = float(os.getenv("SCRAPE_RETRY_BACKOFF_MAX_SECONDS", str(60 * 60 * 24)))
+
+# Submit single flight, the Redis lock coalesces submits across workers and nodes.
+# The leader refreshes the lock while it scrapes (host queue wait included), the TTL only bounds a dead leader's lock.
+SUBMIT_SINGLE_FLIGHT_REDIS_ENABLED = os.getenv("SUBMIT_SINGLE_FLIGHT_REDIS_ENABLED", "false").lower() == "true"
+SUBMIT_SINGLE_FLIGHT_LOCK_TTL_SECONDS = float(os.getenv("SUBMIT_SINGLE_FLIGHT_LOCK_TTL_SECONDS", "15"))
+
+# Batch submit
+SUBMIT_BATCH_MAX_SIZE = int(os.getenv("SUBMIT_BATCH_MAX_SIZE", "1000"))
+SUBMIT_BATCH_CONCURRENCY = int(os.getenv("SUBMIT_BATCH_CONCURRENCY", "50"))
+
+# Url normalization before the cache and DB lookups, see services/url_normalizer.py.
+# Tracking params are dropped from the query, a name ending with * matches as a prefix.
+URL_TRACKING_PARAMS = os.getenv(
+    "URL_TRACKING_PARAMS",
+    "utm_*,fbclid,gclid,dclid,gbraid,wbraid,msclkid,yclid,twclid,igshid,mc_cid,mc_eid,_ga,_gl,_hsenc,_hsmi,mkt_tok",
+).split(",")
+URL_STRIP_TRAILING_SLASH = os.getenv("URL_STRIP_TRAILING_SLASH", "true").lower() == "true"
+# Follow <link rel="canonical"> of the same site: the scraped url becomes an alias of the canonical record
+URL_CANONICAL_ALIASES_ENABLED = os.getenv("URL_CANONICAL_ALIASES_ENABLED", "true").lower() == "true"
+
+# History listing
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", "100"))
+
+# Image proxy, GET /api/image/{id} serves a WebP thumbnail of the og image from a size bounded on-disk cache
+IMAGE_PROXY_MAX_BYTES = int(os.getenv("IMAGE_PROXY_MAX_BYTES", str(10 * 1024 * 1024)))
+IMAGE_PROXY_MAX_PIXELS = int(os.getenv("IMAGE_PROXY_MAX_PIXELS", str(50_000_000)))
+IMAGE_PROXY_CACHE_MAX_AGE_SECONDS = int(os.getenv("IMAGE_PROXY_CACHE_MAX_AGE_SECONDS", str(60 * 60 * 24 * 7)))
+IMAGE_PROXY_NEGATIVE_TTL_SECONDS = float(os.getenv("IMAGE_PROXY_NEGATIVE_TTL_SECONDS", "60"))
+IMAGE_THUMBNAIL_WIDTH = int(os.getenv("IMAGE_THUMBNAIL_WIDTH", "600"))
+IMAGE_THUMBNAIL_QUALITY = int(os.getenv("IMAGE_THUMBNAIL_QUALITY", "80"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "og_previewer", "thumbnails"))
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+# Resizes run in a process pool of this many processes, 0 resizes in a thread of the API process
+IMAGE_RESIZE_WORKERS = int(os.getenv("IMAGE_RESIZE_WORKERS", "2"))
+
+# Scrape job queue, "memory" runs jobs in the API process, "redis" lets separate workers (worker.py) drain them
+SCRAPE_QUEUE_BACKEND = os.getenv("SCRAPE_QUEUE_BACKEND", "memory")
+SCRAPE_QUEUE_KEY = os.getenv("SCRAPE_QUEUE_KEY", "scrape:queue")
+SCRAPE_QUEUE_MAX_SIZE = int(os.getenv("SCRAPE_QUEUE_MAX_SIZE", "10000"))
+SCRAPE_WORKER_CONCURRENCY = int(os.getenv("SCRAPE_WORKER_CONCURRENCY", "10"))
+SCRAPE_WORKERS_IN_APP = os.getenv("SCRAPE_WORKERS_IN_APP", "true").lower() == "true"
+SCRAPE_STATUS_MAX_WAIT_SECONDS = float(os.getenv("SCRAPE_STATUS_MAX_WAIT_SECONDS", "30"))
+SCRAPE_STATUS_POLL_INTERVAL_SECONDS = float(os.getenv("SCRAPE_STATUS_POLL_INTERVAL_SECONDS", "0.25"))
+
+# Write-behind of the scrape results, see services/write_behind.py: collected and written every flush interval,
+# or as soon as WRITE_BEHIND_MAX_RECORDS are pending, in one DB transaction and one Redis pipeline
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL_MS", "50"))
+WRITE_BEHIND_MAX_RECORDS = int(os.getenv("WRITE_BEHIND_MAX_RECORDS", "500"))
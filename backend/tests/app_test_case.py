@@ -0,0 +1,71 @@
+import fakeredis
+import httpx
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from fastapi import FastAPI
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.orm import sessionmaker
+from api import routes
+from database.models import Base
+from services.local_cache import local_cache
+
+OG_PAGE = '<html><head><meta property="og:image" content="https://example.com/img.jpg"></head></html>'
+
+
+class AppTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    The app on local stand-ins: a temporary sqlite file DB (a connection per session, like the production pool),
+    fakeredis, and an origin answered by origin() through a MockTransport. self.client calls the API.
+    Every SQL statement is recorded in self.statements.
+    """
+    def origin(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/html"}, text=OG_PAGE)
+
+    def start_patches(self, *patches):
+        for p in patches:
+            p.start()
+            self.patches.append(p)
+
+    async def asyncSetUp(self):
+        local_cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.engine = create_async_engine(
+            f"sqlite+aiosqlite:///{os.path.join(self.tmpdir.name, 'og.db')}",
+            connect_args={"timeout": 30},
+        )
+        self.session_local = sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.statements = []
+        event.listen(self.engine.sync_engine, "before_cursor_execute", lambda *args: self.statements.append(args[2]))
+
+        self.redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        self.http = httpx.AsyncClient(transport=httpx.MockTransport(self.origin))
+        self.patches = []
+        self.start_patches(
+            patch("database.session.AsyncSessionLocal", self.session_local),
+            patch("api.routes.AsyncSessionLocal", self.session_local),
+            patch("services.og_scraper.AsyncSessionLocal", self.session_local),
+            patch("services.hot_urls.AsyncSessionLocal", self.session_local),
+            patch("cli.AsyncSessionLocal", self.session_local),
+            patch("services.og_scraper.get_http_client", return_value=self.http),
+            patch("services.og_scraper.REDIS_CLIENT", self.redis),
+            patch("api.routes.REDIS_CLIENT", self.redis),
+            patch.object(routes.submit_redis_flight, "redis", self.redis),
+        )
+
+        app = FastAPI()
+        app.include_router(routes.router, prefix="/api")
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+    async def asyncTearDown(self):
+        for p in reversed(self.patches):
+            p.stop()
+        local_cache.clear()
+        await self.client.aclose()
+        await self.http.aclose()
+        await self.engine.dispose()
+        self.tmpdir.cleanup()
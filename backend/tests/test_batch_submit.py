@@ -0,0 +1,85 @@
+import asyncio
+import httpx
+import json
+import unittest
+from unittest.mock import patch
+from datetime import datetime, timezone
+from database import crud
+from services.og_scraper import cache_save
+from tests.app_test_case import AppTestCase
+
+
+def page(image):
+    return f'<html><head><meta property="og:image" content="{image}"></head></html>'
+
+
+class TestBatchSubmit(AppTestCase):
+    async def origin(self, request):
+        # /slow answers last, /none has no og image
+        await asyncio.sleep(0.2 if request.url.host == "slow.com" else 0.01)
+        image = None if request.url.host == "none.com" else f"https://{request.url.host}/img.jpg"
+        body = page(image) if image else "<html><head></head></html>"
+        return httpx.Response(200, headers={"content-type": "text/html"}, text=body)
+
+    async def submit_batch(self, urls):
+        response = await self.client.post("/api/submit/batch", json={"urls": urls})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    async def test_batch_mixes_cache_db_and_scrapes_in_completion_order(self):
+        async with self.session_local() as session:
+            cached = await crud.create_url_entry(session, "https://cached.com/")
+            cached.image_url, cached.status = "https://cached.com/img.jpg", "success"
+            await cache_save(cached)
+            in_db = await crud.create_url_entry(session, "https://indb.com/")
+            await crud.update_url_entry(
+                session, in_db.id, "https://indb.com/img.jpg", "success", validated_at=datetime.now(timezone.utc)
+            )
+
+        results = await self.submit_batch([
+            "https://slow.com", "https://cached.com", "https://fast.com", "https://indb.com",
+            "https://none.com", "https://fast.com",
+        ])
+
+        by_url = {r["url"]: r for r in results}
+        self.assertEqual(len(results), 5)
+        self.assertEqual(by_url["https://cached.com/"]["image_url"], "https://cached.com/img.jpg")
+        self.assertEqual(by_url["https://indb.com/"]["image_url"], "https://indb.com/img.jpg")
+        self.assertEqual(by_url["https://fast.com/"]["image_url"], "https://fast.com/img.jpg")
+        self.assertEqual(by_url["https://none.com/"]["status"], "failed")
+        self.assertEqual(results[-1]["url"], "https://slow.com/")
+        self.assertIsNotNone(await self.redis.get("og:info:https://indb.com/"))
+
+    async def test_batch_uses_one_upsert(self):
+        async with self.session_local() as session:
+            await crud.create_url_entry(session, "https://indb.com/")
+        self.statements.clear()
+        with patch("api.routes.stream_batch_results") as mock_stream:
+            mock_stream.return_value = iter([])
+            mget_calls = []
+            mget = self.redis.mget
+
+            async def counting_mget(keys):
+                mget_calls.append(keys)
+                return await mget(keys)
+
+            with patch.object(self.redis, "mget", counting_mget):
+                urls = [f"https://site{i}.com" for i in range(50)] + ["https://indb.com"]
+                await self.client.post("/api/submit/batch", json={"urls": urls})
+        self.assertEqual(len(mget_calls), 1)
+        selects = [s for s in self.statements if s.startswith("SELECT")]
+        inserts = [s for s in self.statements if s.startswith("INSERT")]
+        # One read of the existing rows, one insert of the missing ones
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(len(inserts), 1)
+        args, _ = mock_stream.call_args
+        self.assertEqual(len(args[1]), 51)
+
+    async def test_batch_rejects_empty_list(self):
+        response = await self.client.post("/api/submit/batch", json={"urls": []})
+        self.assertEqual(response.status_code, 422)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import csv
+import gzip
+import httpx
+import json
+import os
+import tempfile
+import unittest
+from sqlalchemy import func, select
+import cli
+from database.models import URLRecord
+from tests.app_test_case import AppTestCase
+
+
+class TestReadURLs(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.tmpdir.name, name)
+
+    def test_lines_gzipped(self):
+        with gzip.open(self.path("urls.txt.gz"), "wt") as f:
+            f.write("https://a.com\n\n# comment\n  https://b.com  \r\n")
+        self.assertEqual(list(cli.read_urls(self.path("urls.txt.gz"))), [(1, "https://a.com"), (4, "https://b.com")])
+        self.assertEqual(list(cli.read_urls(self.path("urls.txt.gz"), skip=1)), [(4, "https://b.com")])
+
+    def test_csv_header_or_index(self):
+        with open(self.path("crawl.csv"), "w") as f:
+            f.write("id,url\n1,https://a.com\n2\n3,https://b.com\n")
+        self.assertEqual(list(cli.read_urls(self.path("crawl.csv"))), [(1, "https://a.com"), (3, "https://b.com")])
+        with open(self.path("plain.csv"), "w") as f:
+            f.write("https://a.com,x\nhttps://b.com,y\n")
+        self.assertEqual(list(cli.read_urls(self.path("plain.csv"))), [(1, "https://a.com"), (2, "https://b.com")])
+
+
+class TestImportExport(AppTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.requests = []
+
+    def origin(self, request):
+        self.requests.append(str(request.url))
+        if request.url.host == "none.com":
+            return httpx.Response(200, headers={"content-type": "text/html"}, text="<html><head></head></html>")
+        body = f'<html><head><title>{request.url.host}</title><meta property="og:image" content="/i.jpg"></head>'
+        return httpx.Response(200, headers={"content-type": "text/html"}, text=body)
+
+    def write_urls(self, urls) -> str:
+        path = os.path.join(self.tmpdir.name, "urls.txt")
+        with open(path, "w") as f:
+            f.write("\n".join(urls) + "\n")
+        return path
+
+    async def count_records(self) -> int:
+        async with self.session_local() as session:
+            return await session.scalar(select(func.count()).select_from(URLRecord))
+
+    async def test_import_normalizes_dedupes_and_scrapes(self):
+        path = self.write_urls([
+            "https://a.com/x", "https://A.com/x/?utm_source=feed", "ftp://nope", "https://b.com", "https://none.com",
+        ])
+        checkpoint = os.path.join(self.tmpdir.name, "import.checkpoint")
+        progress = await cli.import_urls(path, batch_size=2, concurrency=3, checkpoint_path=checkpoint)
+
+        self.assertEqual((progress.read, progress.invalid, progress.duplicates), (5, 1, 1))
+        self.assertEqual((progress.upserted, progress.scraped, progress.scraped_with_image), (3, 3, 2))
+        self.assertEqual(sorted(self.requests), ["https://a.com/x", "https://b.com/", "https://none.com/"])
+        self.assertEqual(await self.count_records(), 3)
+        with open(checkpoint) as f:
+            self.assertEqual(json.load(f)["position"], 5)
+
+        # Resumed from the checkpoint, nothing is read again
+        progress = await cli.import_urls(path, checkpoint_path=checkpoint)
+        self.assertEqual(progress.read, 0)
+
+        # Without it, the rows exist and are fresh (or failed and backing off), nothing is scraped again
+        progress = await cli.import_urls(path)
+        self.assertEqual((progress.upserted, progress.scraped), (3, 0))
+        self.assertEqual(len(self.requests), 3)
+
+    async def test_checkpoint_waits_for_earlier_batches(self):
+        progress = cli.ImportProgress()
+        saved = []
+        checkpoint = cli.Checkpoint(None, "urls.txt")
+        checkpoint.save = lambda p: saved.append(p.position)
+        tracker = cli.BatchTracker(progress, checkpoint)
+        tracker.add(0, 10, scrapes=1)
+        tracker.add(1, 20, scrapes=1)
+        tracker.done(1)
+        self.assertEqual(saved, [])  # batch 0 still scraping
+        tracker.done(0)
+        self.assertEqual(saved, [20])
+
+    async def test_import_without_scrape(self):
+        progress = await cli.import_urls(self.write_urls(["https://a.com", "https://b.com"]), scrape=False)
+        self.assertEqual((progress.upserted, progress.scraped, progress.position), (2, 0, 2))
+        self.assertEqual(self.requests, [])
+
+    async def test_export_ndjson_and_csv(self):
+        await cli.import_urls(self.write_urls(["https://a.com", "https://none.com"]))
+        ndjson = os.path.join(self.tmpdir.name, "records.ndjson.gz")
+        self.assertEqual(await cli.export_records(ndjson), 2)
+        with gzip.open(ndjson, "rt") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([r["url"] for r in records], ["https://a.com/", "https://none.com/"])
+        self.assertEqual(records[0]["image_url"], "https://a.com/i.jpg")
+        self.assertEqual(records[0]["title"], "a.com")
+
+        path = os.path.join(self.tmpdir.name, "records.csv")
+        self.assertEqual(await cli.export_records(path, status="success"), 1)
+        with open(path) as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual([(r["url"], r["status"]) for r in rows], [("https://a.com/", "success")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+import asyncio
+import httpx
+import unittest
+from sqlalchemy import func
+from sqlalchemy import select
+from api import routes
+from database import crud
+from database.models import URLRecord
+from tests.app_test_case import AppTestCase
+
+
+class TestConcurrentSubmit(AppTestCase):
+    """
+    Submits of the same new url racing on separate DB connections, like several app workers do
+    """
+    def origin(self, request):
+        body = '<html><head><meta property="og:image" content="https://race.com/img.jpg"></head></html>'
+        return httpx.Response(200, headers={"content-type": "text/html"}, text=body)
+
+    async def count_rows(self) -> int:
+        async with self.session_local() as session:
+            return await session.scalar(select(func.count()).select_from(URLRecord))
+
+    async def test_concurrent_upserts_return_one_row(self):
+        async def upsert():
+            async with self.session_local() as session:
+                return await crud.upsert_url_entry(session, "https://race.com")
+
+        entries = await asyncio.gather(*(upsert() for _ in range(20)))
+        self.assertEqual(len({entry.id for entry in entries}), 1)
+        self.assertEqual(await self.count_rows(), 1)
+
+    async def test_concurrent_submits_raise_no_integrity_error(self):
+        # process_submit bypasses the in-process single flight, so every call reaches the DB
+        outcomes = await asyncio.gather(*(routes.process_submit("https://race.com") for _ in range(20)))
+        results = [outcome.info for outcome in outcomes]
+        self.assertEqual({info.id for info in results}, {results[0].id})
+        self.assertTrue(all(info.image_url == "https://race.com/img.jpg" for info in results))
+        self.assertEqual(await self.count_rows(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
 import unittest
 import asyncio
+from datetime import datetime, timezone
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
@@ -19,49 +21,129 @@ class TestCRUDOperations(unittest.IsolatedAsyncioTestCase):
             self.engine, expire_on_commit=False, class_=AsyncSession
         )
 
-        # Override the actual session
-        crud.AsyncSessionLocal = self.async_session
+        self.session = self.async_session()
 
         # Create tables
         async with self.engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
 
     async def asyncTearDown(self):
+        await self.session.close()
         await self.engine.dispose()
 
     async def test_create_and_get_url_entry(self):
         url = "https://example.com"
-        entry = await crud.create_url_entry(url)
+        entry = await crud.create_url_entry(self.session, url)
         self.assertIsNotNone(entry)
         self.assertEqual(entry.url, url)
         self.assertEqual(entry.status, "pending")
 
-        fetched = await crud.get_url_entry_by_url(url)
+        fetched = await crud.get_url_entry_by_url(self.session, url)
         self.assertIsNotNone(fetched)
         self.assertEqual(fetched.id, entry.id)
 
-        fetched_by_id = await crud.get_url_entry_by_id(entry.id)
+        fetched_by_id = await crud.get_url_entry_by_id(self.session, entry.id)
         self.assertEqual(fetched_by_id.url, url)
 
+    async def test_upsert_url_entry(self):
+        entry = await crud.upsert_url_entry(self.session, "https://upsert.com")
+        self.assertEqual(entry.status, "pending")
+        self.assertIsNotNone(entry.created_at)
+        await crud.update_url_entry(self.session, entry.id, "https://upsert.com/img.jpg", "success")
+
+        # An existing row is returned as is, not reset
+        again = await crud.upsert_url_entry(self.session, "https://upsert.com")
+        self.assertEqual(again.id, entry.id)
+        self.assertEqual(again.image_url, "https://upsert.com/img.jpg")
+        self.assertEqual(again.status, "success")
+
+    async def test_upsert_does_not_write_existing_rows(self):
+        await crud.upsert_url_entries(self.session, ["https://a.com", "https://b.com"])
+        statements = []
+        listener = lambda *args: statements.append(args[2].split()[0])
+        event.listen(self.engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            entries = await crud.upsert_url_entries(self.session, ["https://b.com", "https://a.com", "https://c.com"])
+            again = await crud.upsert_url_entry(self.session, "https://a.com")
+        finally:
+            event.remove(self.engine.sync_engine, "before_cursor_execute", listener)
+        self.assertEqual(sorted(e.url for e in entries), ["https://a.com", "https://b.com", "https://c.com"])
+        self.assertEqual(again.url, "https://a.com")
+        # Only the new url is inserted, the known ones are only read
+        self.assertEqual(statements, ["SELECT", "INSERT", "SELECT"])
+
+    async def test_upsert_inserts_in_url_order(self):
+        statements = []
+        listener = lambda *args: statements.append(args[3])
+        event.listen(self.engine.sync_engine, "before_cursor_execute", listener)
+        try:
+            await crud.upsert_url_entries(self.session, ["https://c.com", "https://a.com", "https://b.com"])
+        finally:
+            event.remove(self.engine.sync_engine, "before_cursor_execute", listener)
+        inserted = [value for value in statements[-1] if str(value).startswith("https://")]
+        self.assertEqual(inserted, ["https://a.com", "https://b.com", "https://c.com"])
+
+    async def test_upsert_and_get_many_url_entries(self):
+        urls = [f"https://bulk{i}.com" for i in range(5)]
+        existing = await crud.create_url_entry(self.session, urls[0])
+        entries = await crud.upsert_url_entries(self.session, urls)
+        self.assertEqual(sorted(e.url for e in entries), urls)
+        self.assertIn(existing.id, [e.id for e in entries])
+        self.assertTrue(all(e.id and e.status == "pending" and e.attempt_count == 0 for e in entries))
+
+        fetched = await crud.get_url_entries_by_urls(self.session, urls[:3] + ["https://missing.com"])
+        self.assertEqual(sorted(e.url for e in fetched), urls[:3])
+        self.assertEqual(await crud.upsert_url_entries(self.session, []), [])
+        self.assertEqual(await crud.get_url_entries_by_urls(self.session, []), [])
+
     async def test_update_url_entry(self):
-        entry = await crud.create_url_entry("https://test.com")
-        await crud.update_url_entry(entry.id, "https://image.com/img.jpg", "success")
+        entry = await crud.create_url_entry(self.session, "https://test.com")
+        await crud.update_url_entry(self.session, entry.id, "https://image.com/img.jpg", "success")
 
-        updated = await crud.get_url_entry_by_id(entry.id)
+        updated = await crud.get_url_entry_by_id(self.session, entry.id)
         self.assertEqual(updated.image_url, "https://image.com/img.jpg")
         self.assertEqual(updated.status, "success")
 
+    async def test_update_url_entry_metadata(self):
+        entry = await crud.create_url_entry(self.session, "https://meta.com")
+        updated = await crud.update_url_entry(
+            self.session, entry.id, "https://meta.com/img.jpg", "success",
+            metadata={"title": "Meta", "image_width": 1200, "icon_url": "https://meta.com/favicon.ico"},
+        )
+        self.assertEqual(updated.title, "Meta")
+        self.assertEqual(updated.image_width, 1200)
+        self.assertEqual(updated.icon_url, "https://meta.com/favicon.ico")
+        self.assertIsNone(updated.description)
+
+        cleared = await crud.update_url_entry(self.session, entry.id, None, "failed")
+        self.assertIsNone(cleared.title)
+
+    async def test_update_url_entry_failure_and_reset(self):
+        entry = await crud.create_url_entry(self.session, "https://no-og.com")
+        retry_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        await crud.update_url_entry(self.session, entry.id, None, "failed", attempt_count=2, next_retry_at=retry_at)
+
+        failed = await crud.get_url_entry_by_id(self.session, entry.id)
+        self.assertEqual(failed.status, "failed")
+        self.assertEqual(failed.attempt_count, 2)
+        self.assertEqual(failed.next_retry_at.replace(tzinfo=timezone.utc), retry_at)
+
+        await crud.update_url_entry(self.session, entry.id, "https://no-og.com/img.jpg", "success")
+        updated = await crud.get_url_entry_by_id(self.session, entry.id)
+        self.assertEqual(updated.attempt_count, 0)
+        self.assertIsNone(updated.next_retry_at)
+
     async def test_get_all_entries_pagination(self):
         # Insert 15 entries
         for i in range(15):
-            await crud.create_url_entry(f"https://site{i}.com")
+            await crud.create_url_entry(self.session, f"https://site{i}.com")
 
-        entries, next_cursor = await crud.get_all_entries(limit=10)
+        entries, next_cursor = await crud.get_all_entries(self.session, limit=10)
         self.assertEqual(len(entries), 10)
         self.assertIsNotNone(next_cursor)
 
         # Fetch next page
-        entries2, next_cursor2 = await crud.get_all_entries(limit=10, cursor=next_cursor)
+        entries2, next_cursor2 = await crud.get_all_entries(self.session, limit=10, cursor=next_cursor)
         self.assertEqual(len(entries2), 5)
         self.assertIsNone(next_cursor2)
 
@@ -69,10 +151,42 @@ class TestCRUDOperations(unittest.IsolatedAsyncioTestCase):
         # Insert 3 entries
         urls = [f"https://asc{i}.com" for i in range(3)]
         for u in urls:
-            await crud.create_url_entry(u)
+            await crud.create_url_entry(self.session, u)
 
-        entries, _ = await crud.get_all_entries(limit=3, is_desc_order=False)
+        entries, _ = await crud.get_all_entries(self.session, limit=3, is_desc_order=False)
         self.assertEqual([e.url for e in entries], urls)
 
+    async def test_get_all_entries_keyset_on_created_at_and_id(self):
+        # Rows of one multi-row insert can share created_at, the id breaks the tie
+        same_time = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        self.session.add_all([URLRecord(url=f"https://tie{i}.com", created_at=same_time) for i in range(5)])
+        self.session.add(URLRecord(url="https://older.com", created_at=datetime(2029, 1, 1, tzinfo=timezone.utc)))
+        await self.session.commit()
+
+        seen, cursor = [], None
+        while True:
+            entries, cursor = await crud.get_all_entries(self.session, limit=2, cursor=cursor)
+            seen += [e.url for e in entries]
+            if cursor is None:
+                break
+        self.assertEqual(seen, [f"https://tie{i}.com" for i in reversed(range(5))] + ["https://older.com"])
+        self.assertNotIsInstance(entries[0], URLRecord)
+
+    async def test_get_all_entries_status_filter(self):
+        for i in range(4):
+            entry = await crud.create_url_entry(self.session, f"https://status{i}.com")
+            if i % 2:
+                await crud.update_url_entry(self.session, entry.id, f"https://status{i}.com/img.jpg", "success")
+
+        entries, cursor = await crud.get_all_entries(self.session, limit=1, status="success")
+        self.assertEqual([e.url for e in entries], ["https://status3.com"])
+        entries, cursor = await crud.get_all_entries(self.session, limit=1, cursor=cursor, status="success")
+        self.assertEqual([e.url for e in entries], ["https://status1.com"])
+        self.assertIsNone(cursor)
+
+    async def test_get_all_entries_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            await crud.get_all_entries(self.session, cursor="not-a-cursor")
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,154 @@
+import asyncio
+import httpcore
+import httpx
+import socket
+import unittest
+from services.dns_cache import BlockedAddress
+from services.dns_cache import CachedDNSBackend
+from services.dns_cache import DNSCache
+from services.dns_cache import is_public_address
+from services.http_client import PoolTransport
+from services.metrics import DNS_CACHE_HIT
+from services.metrics import DNS_CACHE_MISS
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class StubResolver:
+    """
+    Answers from a dict of host -> (addresses, ttl), a missing host is NXDOMAIN
+    """
+    def __init__(self, answers: dict, delay: float = 0):
+        self.answers = answers
+        self.delay = delay
+        self.calls = []
+
+    async def __call__(self, host: str):
+        self.calls.append(host)
+        await asyncio.sleep(self.delay)
+        answer = self.answers.get(host)
+        if isinstance(answer, Exception):
+            raise answer
+        if answer is None:
+            raise socket.gaierror(socket.EAI_NONAME, "Name or service not known")
+        return answer
+
+
+class TestDNSCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.resolver = StubResolver({"site.com": (["93.184.216.34"], 60), "cdn.com": (["151.101.1.1"], None)})
+
+    def cache(self, **kwargs) -> DNSCache:
+        options = dict(default_ttl=300, min_ttl=30, max_ttl=3600, negative_ttl=10, refresh_ahead=0,
+                       block_private=True, clock=self.clock)
+        options.update(kwargs)
+        return DNSCache(self.resolver, **options)
+
+    async def test_answers_cached_for_their_ttl(self):
+        cache = self.cache()
+        hits, misses = DNS_CACHE_HIT.get(), DNS_CACHE_MISS.get()
+        results = await asyncio.gather(*(cache.resolve("Site.com.") for _ in range(10)))
+        self.assertEqual(results, [["93.184.216.34"]] * 10)
+        self.assertEqual(self.resolver.calls, ["site.com"])  # concurrent lookups coalesced
+        self.clock.now += 59
+        await cache.resolve("site.com")
+        self.assertEqual((DNS_CACHE_HIT.get() - hits, DNS_CACHE_MISS.get() - misses), (1, 10))
+        self.clock.now += 1
+        await cache.resolve("site.com")
+        self.assertEqual(len(self.resolver.calls), 2)
+
+        # Without a TTL from the resolver, the default one
+        await cache.resolve("cdn.com")
+        self.clock.now += 299
+        await cache.resolve("cdn.com")
+        self.assertEqual(self.resolver.calls.count("cdn.com"), 1)
+
+    async def test_nxdomain_cached_briefly_other_errors_not(self):
+        cache = self.cache()
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                await cache.resolve("missing.com")
+        self.assertEqual(self.resolver.calls, ["missing.com"])
+        self.clock.now += 10
+        with self.assertRaises(socket.gaierror):
+            await cache.resolve("missing.com")
+        self.assertEqual(len(self.resolver.calls), 2)
+
+        self.resolver.answers["flaky.com"] = socket.gaierror(socket.EAI_AGAIN, "Temporary failure")
+        for _ in range(2):
+            with self.assertRaises(socket.gaierror):
+                await cache.resolve("flaky.com")
+        self.assertEqual(self.resolver.calls.count("flaky.com"), 2)
+
+    async def test_refresh_ahead_serves_the_cached_answer(self):
+        cache = self.cache(refresh_ahead=10)
+        await cache.resolve("site.com")
+        self.resolver.answers["site.com"] = (["93.184.216.35"], 60)
+        self.clock.now += 55
+        self.assertEqual(await cache.resolve("site.com"), ["93.184.216.34"])
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.resolver.calls, ["site.com", "site.com"])
+        self.assertEqual(await cache.resolve("site.com"), ["93.184.216.35"])
+
+    async def test_non_public_addresses_blocked(self):
+        self.resolver.answers.update({
+            "mixed.com": (["10.0.0.1", "93.184.216.34"], 60),
+            "internal.com": (["127.0.0.1", "::1"], 60),
+        })
+        cache = self.cache()
+        self.assertEqual(await cache.resolve("mixed.com"), ["93.184.216.34"])
+        for host in ("internal.com", "169.254.169.254", "[::ffff:127.0.0.1]", "192.168.1.1", "100.64.0.1"):
+            with self.subTest(host=host), self.assertRaises(BlockedAddress):
+                await cache.resolve(host)
+        self.assertEqual(await self.cache(block_private=False).resolve("internal.com"), ["127.0.0.1", "::1"])
+        self.assertTrue(is_public_address("2606:4700::1111"))
+        self.assertFalse(is_public_address("fe80::1%eth0"))
+
+
+class TestCachedDNSBackend(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.hosts = []
+
+        async def handle(reader, writer):
+            request = await reader.readuntil(b"\r\n\r\n")
+            headers = request.split(b"\r\n")
+            self.hosts += [line.split(b":", 1)[1].strip() for line in headers if line.lower().startswith(b"host:")]
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        self.server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def client(self, cache: DNSCache) -> httpx.AsyncClient:
+        transport = PoolTransport(httpcore.AsyncConnectionPool(network_backend=CachedDNSBackend(cache)))
+        return httpx.AsyncClient(transport=transport)
+
+    async def test_connects_to_the_cached_address(self):
+        resolver = StubResolver({"origin.test": (["127.0.0.1"], 60)})
+        async with self.client(DNSCache(resolver, block_private=False)) as client:
+            response = await client.get(f"http://origin.test:{self.port}/")
+        self.assertEqual(response.text, "ok")
+        self.assertEqual(self.hosts, [f"origin.test:{self.port}".encode()])
+
+        async with self.client(DNSCache(resolver, block_private=True)) as client:
+            with self.assertRaises(httpx.ConnectError):
+                await client.get(f"http://origin.test:{self.port}/")
+            with self.assertRaises(httpx.ConnectError):
+                await client.get("http://unknown.test/")
+        self.assertEqual(len(self.hosts), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+from concurrent.futures import BrokenExecutor
+from concurrent.futures import ThreadPoolExecutor
+from services.executors import LazyExecutor
+
+
+def broken_worker():
+    raise RuntimeError("worker died")
+
+
+class TestLazyExecutor(unittest.IsolatedAsyncioTestCase):
+    async def test_new_executor_after_it_broke(self):
+        made = []
+
+        def factory():
+            # The first executor breaks, its worker fails to start
+            made.append(ThreadPoolExecutor(1, initializer=broken_worker if not made else None))
+            return made[-1]
+
+        pool = LazyExecutor(factory)
+        self.assertEqual(made, [])
+        with self.assertRaises(BrokenExecutor):
+            await pool.run(lambda: 1)
+        self.assertEqual(await pool.run(lambda: 2), 2)
+        self.assertEqual(len(made), 2)
+        pool.close()
+        pool.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import asyncio
+import fakeredis
+import httpx
+import time
+import unittest
+from email.utils import format_datetime
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from benchmarks.stub_origin import StubOrigin
+from benchmarks.stub_origin import StubPage
+from services import og_scraper
+from services.host_scheduler import HostQueueTimeout
+from services.host_scheduler import HostScheduler
+from services.host_scheduler import RedisHostLimiter
+from services.host_scheduler import interleave_by_host
+from services.host_scheduler import parse_retry_after
+
+
+class TestHostScheduler(unittest.IsolatedAsyncioTestCase):
+    async def test_round_robin_across_hosts(self):
+        scheduler = HostScheduler(max_per_host=1, rate_per_second=0, max_active=1)
+        order = []
+
+        async def fetch(host):
+            async with scheduler.slot(host):
+                order.append(host)
+                await asyncio.sleep(0)
+
+        tasks = [asyncio.ensure_future(fetch("big.com")) for _ in range(20)]
+        tasks += [asyncio.ensure_future(fetch("small.com")), asyncio.ensure_future(fetch("other.com"))]
+        await asyncio.gather(*tasks)
+        # The small hosts are served within the first round, not after the 20 urls of big.com
+        self.assertLessEqual(order.index("small.com"), 3)
+        self.assertLessEqual(order.index("other.com"), 3)
+        self.assertEqual(scheduler.active, 0)
+
+    async def test_token_bucket_paces_requests(self):
+        scheduler = HostScheduler(max_per_host=10, rate_per_second=20, burst=1, max_active=10)
+        start = time.monotonic()
+        for _ in range(6):
+            async with scheduler.slot("example.com"):
+                pass
+        self.assertGreaterEqual(time.monotonic() - start, 0.24)
+
+    async def test_penalize_pauses_host_only(self):
+        scheduler = HostScheduler(max_per_host=10, rate_per_second=0, max_active=10)
+        await scheduler.penalize("slow.com", 0.2)
+        start = time.monotonic()
+        async with scheduler.slot("fast.com"):
+            self.assertLess(time.monotonic() - start, 0.1)
+        async with scheduler.slot("slow.com"):
+            self.assertGreaterEqual(time.monotonic() - start, 0.19)
+
+    async def test_queue_timeout_leaves_no_waiter(self):
+        scheduler = HostScheduler(max_per_host=1, rate_per_second=0, max_active=10)
+        async with scheduler.slot("example.com"):
+            with self.assertRaises(asyncio.TimeoutError):
+                async with scheduler.slot("example.com", timeout=0.05):
+                    pass
+        self.assertEqual(scheduler.active, 0)
+        self.assertEqual(scheduler.waiting(), 0)
+
+    async def test_limits_shared_through_redis(self):
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        # Two workers, each with its own scheduler, one shared slot per host
+        workers = [
+            HostScheduler(max_per_host=1, rate_per_second=0, max_active=10,
+                          shared=RedisHostLimiter(redis, 1, 0, 1, poll_interval=0.005))
+            for _ in range(2)
+        ]
+        in_flight, peak = 0, 0
+
+        async def fetch(scheduler):
+            nonlocal in_flight, peak
+            async with scheduler.slot("example.com"):
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        await asyncio.gather(*(fetch(workers[i % 2]) for i in range(6)))
+        self.assertEqual(peak, 1)
+
+        await workers[0].penalize("example.com", 0.2)
+        start = time.monotonic()
+        async with workers[1].slot("example.com"):
+            self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+    async def test_shared_slot_wait_bounded_by_queue_timeout(self):
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        limiter = RedisHostLimiter(redis, 1, 0, 1, poll_interval=0.005)
+        scheduler = HostScheduler(max_per_host=1, rate_per_second=0, max_active=10, shared=limiter)
+        # Another worker holds the only shared slot of the host
+        await limiter.acquire("example.com")
+        start = time.monotonic()
+        with self.assertRaises(HostQueueTimeout):
+            async with scheduler.slot("example.com", timeout=0.05):
+                pass
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(scheduler.active, 0)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("120"), 120)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        retry_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+        now = (retry_at - timedelta(seconds=30)).timestamp()
+        self.assertAlmostEqual(parse_retry_after(format_datetime(retry_at, usegmt=True), now=now), 30)
+
+    def test_interleave_by_host(self):
+        urls = ["a/1", "a/2", "a/3", "b/1", "c/1", "b/2"]
+        ordered = interleave_by_host(urls, lambda url: url.split("/")[0])
+        self.assertEqual(ordered, ["a/1", "b/1", "c/1", "a/2", "b/2", "a/3"])
+
+
+class TestPoliteScrapes(unittest.IsolatedAsyncioTestCase):
+    """
+    extract_og_image through the scheduler, against a local origin
+    """
+    async def test_concurrent_connections_capped_per_host(self):
+        scheduler = HostScheduler(max_per_host=3, rate_per_second=0, max_active=100)
+        pages = {f"/page{i}": StubPage(delay=0.02) for i in range(30)}
+        async with StubOrigin(pages) as origin, httpx.AsyncClient() as client:
+            with patch("services.og_scraper.get_http_client", return_value=client), \
+                    patch("services.og_scraper.get_host_scheduler", return_value=scheduler):
+                results = await asyncio.gather(*(og_scraper.extract_og_image(f"{origin.base_url}/page{i}") for i in range(30)))
+        self.assertTrue(all(results))
+        self.assertEqual(origin.max_in_flight, 3)
+        self.assertLessEqual(origin.max_open_connections, 3)
+
+    async def test_retry_after_is_honored(self):
+        scheduler = HostScheduler(max_per_host=3, rate_per_second=0, max_active=100)
+        calls = []
+
+        def origin(request):
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                return httpx.Response(429, headers={"retry-after": "0.2"})
+            body = '<html><head><meta property="og:image" content="https://example.com/img.jpg"></head></html>'
+            return httpx.Response(200, headers={"content-type": "text/html"}, text=body)
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+            with patch("services.og_scraper.get_http_client", return_value=client), \
+                    patch("services.og_scraper.get_host_scheduler", return_value=scheduler):
+                image_url = await og_scraper.extract_og_image("https://example.com")
+        self.assertEqual(image_url, "https://example.com/img.jpg")
+        self.assertEqual(len(calls), 2)
+        self.assertGreaterEqual(calls[1] - calls[0], 0.19)
+
+    @patch("services.og_scraper.SCRAPER_RETRY_AFTER_DEFAULT_SECONDS", 0.05)
+    async def test_unavailable_without_retry_after_gives_up(self):
+        scheduler = HostScheduler(max_per_host=3, rate_per_second=0, max_active=100)
+        calls = []
+
+        def origin(request):
+            calls.append(request)
+            return httpx.Response(503, headers={"content-type": "text/html"}, text="<html><head></head></html>")
+
+        async with httpx.AsyncClient(transport=httpx.MockTransport(origin)) as client:
+            with patch("services.og_scraper.get_http_client", return_value=client), \
+                    patch("services.og_scraper.get_host_scheduler", return_value=scheduler):
+                self.assertIsNone(await og_scraper.extract_og_image("https://example.com"))
+        self.assertEqual(len(calls), og_scraper.SCRAPER_THROTTLE_MAX_RETRIES + 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,152 @@
+import asyncio
+import httpx
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+from database import crud
+from services.hot_urls import AccessTracker
+from services.hot_urls import HotURLRefresher
+from services.hot_urls import access_tracker
+from tests.app_test_case import AppTestCase
+
+
+class FakeClock:
+    def __init__(self, now: datetime):
+        self.now = now
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += timedelta(seconds=seconds)
+
+
+class TestAccessTracker(unittest.TestCase):
+    def test_record_and_drain(self):
+        tracker = AccessTracker(max_size=2)
+        for url in ("a", "b", "a", "c", "a"):
+            tracker.record(url)
+        self.assertEqual(tracker.drain(), {"a": 3, "b": 1})  # c is over max_size
+        self.assertEqual(len(tracker), 0)
+
+
+class TestHotURLRefresher(AppTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.requests = []
+        self.validated_at = datetime.now(timezone.utc)
+        self.clock = FakeClock(self.validated_at)
+        self.tracker = AccessTracker()
+
+    def origin(self, request):
+        self.requests.append(str(request.url))
+        body = f'<html><head><meta property="og:image" content="{request.url}img.jpg"></head></html>'
+        return httpx.Response(200, headers={"content-type": "text/html", "cache-control": "max-age=300"}, text=body)
+
+    def refresher(self, **kwargs) -> HotURLRefresher:
+        options = dict(
+            tracker=self.tracker, interval=15, ahead_seconds=45, min_score=1, max_per_cycle=10, clock=self.clock
+        )
+        options.update(kwargs)
+        return HotURLRefresher(self.redis, **options)
+
+    async def add_entry(self, url: str):
+        # Fresh for 300 seconds from validated_at
+        async with self.session_local() as session:
+            entry = await crud.create_url_entry(session, url)
+            return await crud.update_url_entry(
+                session, entry.id, f"{url}old.jpg", "success", max_age=300, validated_at=self.validated_at
+            )
+
+    def hit(self, url: str, times: int):
+        for _ in range(times):
+            self.tracker.record(url)
+
+    async def next_interval(self, refresher: HotURLRefresher, seconds: float):
+        self.clock.advance(seconds)
+        await self.redis.delete(refresher.lock_key)  # the lock expires with the interval
+
+    async def test_scores_decay_and_cold_urls_are_ignored(self):
+        refresher = self.refresher(min_score=10)
+        self.hit("https://hot.com/", 12)
+        self.hit("https://cold.com/", 3)
+        self.assertEqual([url for url, _ in await refresher.hot_urls()], [])
+        await refresher.run_once()
+        self.assertEqual(await self.redis.zscore(refresher.key, "https://hot.com/"), 6)
+        self.assertEqual(await self.redis.zscore(refresher.key, "https://cold.com/"), 1.5)
+
+        await self.next_interval(refresher, 15)
+        self.hit("https://hot.com/", 4)
+        await refresher.run_once()
+        self.assertEqual(await self.redis.zscore(refresher.key, "https://hot.com/"), 5)
+        self.assertIsNone(await self.redis.zscore(refresher.key, "https://cold.com/"))  # decayed below 1
+
+    async def test_hot_url_refreshed_before_expiry(self):
+        await self.add_entry("https://hot.com/")
+        refresher = self.refresher()
+        self.hit("https://hot.com/", 5)
+
+        # 200 seconds in, 100 seconds of freshness left: only saved back to the cache
+        self.clock.advance(200)
+        self.assertEqual(await refresher.run_once(), {"refreshed": 0, "rewarmed": 1})
+        self.assertIsNotNone(await self.redis.get("og:info:https://hot.com/"))
+        self.assertEqual(self.requests, [])
+
+        # Within the same interval, another worker only flushes its counts
+        self.hit("https://hot.com/", 1)
+        self.assertEqual(await refresher.run_once(), {"refreshed": 0, "rewarmed": 0})
+
+        # 260 seconds in, 40 seconds left, below the 45 seconds ahead: re-scraped before it expires
+        await self.next_interval(refresher, 60)
+        self.assertEqual(await refresher.run_once(), {"refreshed": 1, "rewarmed": 0})
+        self.assertEqual(self.requests, ["https://hot.com/"])
+        async with self.session_local() as session:
+            entry = await crud.get_url_entry_by_url(session, "https://hot.com/")
+        self.assertEqual(entry.image_url, "https://hot.com/img.jpg")
+        self.assertGreater(entry.validated_at.replace(tzinfo=timezone.utc), self.validated_at)
+
+    async def test_cycle_lock_held_until_the_cycle_ends(self):
+        await self.add_entry("https://hot.com/")
+        self.hit("https://hot.com/", 5)
+        self.clock.advance(280)
+        first, second = self.refresher(interval=0.05), self.refresher(interval=0.05)
+        started, release = asyncio.Event(), asyncio.Event()
+        refresh = first._refresh
+
+        async def slow_refresh():
+            started.set()
+            await release.wait()
+            return await refresh()
+
+        first._refresh = slow_refresh
+        cycle = asyncio.ensure_future(first.run_once())
+        await started.wait()
+        # The cycle outlasts its interval, another worker still does not start one
+        await asyncio.sleep(0.1)
+        self.assertEqual(await second.run_once(), {"refreshed": 0, "rewarmed": 0})
+        release.set()
+        self.assertEqual(await cycle, {"refreshed": 1, "rewarmed": 0})
+        self.assertIsNone(await self.redis.get(first.lock_key))
+
+    async def test_submits_not_counted_when_refresher_disabled(self):
+        access_tracker.drain()
+        with patch("api.routes.HOT_REFRESH_ENABLED", False):
+            await self.client.post("/api/submit", json={"url": "https://example.com/"})
+        self.assertEqual(len(access_tracker), 0)
+        with patch("api.routes.HOT_REFRESH_ENABLED", True):
+            await self.client.post("/api/submit", json={"url": "https://example.com/"})
+        self.assertEqual(access_tracker.drain(), {"https://example.com/": 1})
+
+    async def test_refreshes_within_budget_hottest_first(self):
+        for i, hits in enumerate((3, 9, 6)):
+            await self.add_entry(f"https://site{i}.com/")
+            self.hit(f"https://site{i}.com/", hits)
+        self.hit("https://unknown.com/", 20)  # no record, nothing to refresh
+        refresher = self.refresher(max_per_cycle=2)
+        self.clock.advance(280)
+        self.assertEqual(await refresher.run_once(), {"refreshed": 2, "rewarmed": 0})
+        self.assertEqual(sorted(self.requests), ["https://site1.com/", "https://site2.com/"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+from services import http_client
+from services.dns_cache import DNSCache
+
+
+class TestHTTPClient(unittest.IsolatedAsyncioTestCase):
+    async def test_open_and_close_shared_client(self):
+        client = await http_client.open_http_client()
+        self.assertIs(http_client.get_http_client(), client)
+        await http_client.close_http_client()
+        self.assertTrue(client.is_closed)
+        self.assertIsNot(http_client.get_http_client(), client)
+        await http_client.close_http_client()
+
+    async def test_shared_client_resolves_through_the_dns_cache(self):
+        async def handle(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Length: 2\r\nConnection: close\r\n\r\nok")
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        resolved = []
+
+        async def resolver(host):
+            resolved.append(host)
+            return ["127.0.0.1"], 60
+
+        # origin.test only exists in the DNS cache resolver, the request fails unless connections go through it
+        with patch("services.http_client.get_dns_cache", return_value=DNSCache(resolver, block_private=False)):
+            client = http_client.build_http_client()
+        async with client:
+            response = await client.get(f"http://origin.test:{port}/")
+        server.close()
+        await server.wait_closed()
+        self.assertEqual(response.text, "ok")
+        self.assertEqual(resolved, ["origin.test"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+import asyncio
+import httpx
+import io
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from PIL import Image
+from api.routes import router
+from services import image_proxy
+from services.host_scheduler import HostScheduler
+from services.image_proxy import ImageProxyError
+from services.image_proxy import ThumbnailCache
+from services.thumbnailer import make_thumbnail
+
+
+app = FastAPI()
+app.include_router(router, prefix="/api")
+
+
+def png_bytes(width: int, height: int, mode: str = "RGB") -> bytes:
+    output = io.BytesIO()
+    Image.new(mode, (width, height), "red").save(output, "PNG")
+    return output.getvalue()
+
+
+class TestThumbnailer(unittest.TestCase):
+    def test_resize_to_webp(self):
+        thumbnail = Image.open(io.BytesIO(make_thumbnail(png_bytes(1200, 630), 600, 80, 10_000_000)))
+        self.assertEqual(thumbnail.format, "WEBP")
+        self.assertEqual(thumbnail.size, (600, 315))
+
+    def test_small_image_not_upscaled_and_palette_converted(self):
+        thumbnail = Image.open(io.BytesIO(make_thumbnail(png_bytes(100, 50, "P"), 600, 80, 10_000_000)))
+        self.assertEqual(thumbnail.size, (100, 50))
+
+    def test_tall_image_is_cut(self):
+        thumbnail = Image.open(io.BytesIO(make_thumbnail(png_bytes(200, 2000), 100, 80, 10_000_000)))
+        self.assertEqual(thumbnail.size, (100, 400))
+
+    def test_invalid_images_refused(self):
+        with self.assertRaises(ValueError):
+            make_thumbnail(b"<html>not an image</html>", 600, 80, 10_000_000)
+        with self.assertRaises(ValueError):
+            make_thumbnail(png_bytes(1000, 1000), 600, 80, 100_000)  # over max_pixels
+
+
+class TestThumbnailCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_content_addressed(self):
+        cache = ThumbnailCache(self.tmpdir.name, max_bytes=1024)
+        digest = cache.put("a", b"thumbnail")
+        self.assertEqual(cache.put("b", b"thumbnail"), digest)
+        self.assertEqual(cache.get("a"), (digest, b"thumbnail"))
+        self.assertEqual(cache.get("b"), (digest, b"thumbnail"))
+        self.assertIsNone(cache.get("c"))
+        self.assertEqual(cache.size, len(b"thumbnail"))
+
+    def test_lru_eviction_and_reload(self):
+        cache = ThumbnailCache(self.tmpdir.name, max_bytes=250)
+        cache.put("a", b"a" * 100)
+        cache.put("b", b"b" * 100)
+        cache.get("a")
+        cache.put("c", b"c" * 100)  # evicts b, the least recently used
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertEqual(cache.size, 200)
+
+        # A new process finds the thumbnails on disk
+        reloaded = ThumbnailCache(self.tmpdir.name, max_bytes=250)
+        self.assertEqual(reloaded.get("a")[1], b"a" * 100)
+        self.assertEqual(reloaded.size, 200)
+
+
+class TestImageEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.requests = []
+        self.image = png_bytes(1200, 630)
+
+        def origin(request):
+            self.requests.append(request)
+            if request.url.path == "/page.html":
+                return httpx.Response(200, headers={"content-type": "text/html"}, text="<html></html>")
+            if request.url.path == "/huge.png":
+                return httpx.Response(200, headers={"content-type": "image/png"}, content=b"0" * 2048)
+            return httpx.Response(200, headers={"content-type": "image/png"}, content=self.image)
+
+        self.patches = [
+            patch("services.image_proxy._thumbnail_cache", ThumbnailCache(self.tmpdir.name)),
+            patch("services.image_proxy._failed_sources", image_proxy.LocalTTLCache()),
+            patch("services.image_proxy.get_http_client",
+                  return_value=httpx.AsyncClient(transport=httpx.MockTransport(origin))),
+            patch("services.image_proxy.get_host_scheduler", return_value=HostScheduler(rate_per_second=0)),
+            patch("services.image_proxy.IMAGE_RESIZE_WORKERS", 0),
+        ]
+        for p in self.patches:
+            p.start()
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmpdir.cleanup()
+
+    @patch("database.crud.get_url_entry_by_id", new_callable=AsyncMock)
+    def test_thumbnail_served_with_etag(self, mock_get_by_id):
+        mock_get_by_id.return_value = SimpleNamespace(id=1, image_url="https://example.com/og.png")
+        response = self.client.get("/api/image/1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "image/webp")
+        self.assertIn("max-age=", response.headers["cache-control"])
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (600, 315))
+
+        etag = response.headers["etag"]
+        response = self.client.get("/api/image/1", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], etag)
+        self.assertEqual(len(self.requests), 1)  # the origin is only hit once
+
+        for if_none_match in (f'"other", W/{etag}', "*"):
+            response = self.client.get("/api/image/1", headers={"If-None-Match": if_none_match})
+            self.assertEqual(response.status_code, 304)
+        response = self.client.get("/api/image/1", headers={"If-None-Match": f'"x{etag[1:]}'})
+        self.assertEqual(response.status_code, 200)
+
+    @patch("database.crud.get_url_entry_by_id", new_callable=AsyncMock)
+    def test_invalid_images_answer_502_and_are_negatively_cached(self, mock_get_by_id):
+        mock_get_by_id.return_value = SimpleNamespace(id=2, image_url="https://example.com/page.html")
+        for _ in range(2):
+            response = self.client.get("/api/image/2")
+            self.assertEqual(response.status_code, 502)
+        self.assertEqual(len(self.requests), 1)
+
+        with self.assertRaises(ImageProxyError):
+            asyncio.run(image_proxy.fetch_image("https://example.com/huge.png", max_bytes=1024))
+
+    @patch("database.crud.get_url_entry_by_id", new_callable=AsyncMock)
+    def test_record_without_image_is_404(self, mock_get_by_id):
+        mock_get_by_id.return_value = SimpleNamespace(id=3, image_url=None)
+        self.assertEqual(self.client.get("/api/image/3").status_code, 404)
+        mock_get_by_id.return_value = None
+        self.assertEqual(self.client.get("/api/image/4").status_code, 404)
+
+
+class TestFetchImage(unittest.IsolatedAsyncioTestCase):
+    def test_source_key_covers_thumbnail_settings(self):
+        key = image_proxy.source_key("https://example.com/og.png", 600, 80)
+        self.assertNotEqual(key, image_proxy.source_key("https://example.com/og.png", 600, 90))
+        self.assertNotEqual(key, image_proxy.source_key("https://example.com/og.png", 300, 80))
+
+    async def test_timeout_starts_after_the_host_slot(self):
+        image = png_bytes(10, 10)
+
+        async def origin(request):
+            await asyncio.sleep(0.05)
+            return httpx.Response(200, headers={"content-type": "image/png"}, content=image)
+
+        scheduler = HostScheduler(rate_per_second=0, max_per_host=1)
+        client = httpx.AsyncClient(transport=httpx.MockTransport(origin))
+        with patch("services.image_proxy.get_host_scheduler", return_value=scheduler), \
+                patch("services.image_proxy.get_http_client", return_value=client):
+            async def busy_host():
+                async with scheduler.slot("example.com"):
+                    await asyncio.sleep(0.3)
+
+            busy = asyncio.create_task(busy_host())
+            await asyncio.sleep(0)
+            # Queued behind the busy host longer than the timeout, the download itself fits in it
+            self.assertEqual(await image_proxy.fetch_image("https://example.com/og.png", timeout=0.2), image)
+            await busy
+
+            with self.assertRaises(asyncio.TimeoutError):
+                await image_proxy.fetch_image("https://example.com/og.png", timeout=0.01)
+
+
+class TestResizePool(unittest.IsolatedAsyncioTestCase):
+    async def test_resize_in_process_pool(self):
+        with patch("services.image_proxy.IMAGE_RESIZE_WORKERS", 1):
+            try:
+                thumbnail = await image_proxy.resize_image(png_bytes(1200, 630))
+                self.assertIsNotNone(image_proxy._resize_pool)
+            finally:
+                image_proxy.close_resize_pool()
+        self.assertEqual(Image.open(io.BytesIO(thumbnail)).size, (600, 315))
+
+
+if __name__ == "__main__":
+    unittest.main()
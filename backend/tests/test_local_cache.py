@@ -0,0 +1,124 @@
+import asyncio
+import fakeredis
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+from database.enums import URLStatus
+from services.local_cache import CacheInvalidator, LocalTTLCache, local_cache
+from services.og_scraper import cache_get, cache_save
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLocalTTLCache(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = LocalTTLCache(max_size=2)
+        cache.set("a", 1, ttl=60)
+        cache.set("b", 2, ttl=60)
+        cache.get("a")  # a is now the most recently used
+        cache.set("c", 3, ttl=60)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_ttl_per_entry(self):
+        clock = FakeClock()
+        cache = LocalTTLCache(max_size=10, clock=clock)
+        cache.set("short", 1, ttl=10)
+        cache.set("long", 2, ttl=300)
+        clock.now = 11
+        self.assertIsNone(cache.get("short"))
+        self.assertEqual(cache.get("long"), 2)
+        self.assertEqual(cache.expirations, 1)
+        self.assertEqual(len(cache), 1)
+
+    def test_counters(self):
+        cache = LocalTTLCache(max_size=10)
+        cache.set("a", 1, ttl=60)
+        cache.get("a")
+        cache.get("missing")
+        self.assertEqual(cache.stats(), {
+            "size": 1, "max_size": 10, "hits": 1, "misses": 1, "evictions": 0, "expirations": 0,
+        })
+
+    def test_zero_size_disables(self):
+        cache = LocalTTLCache(max_size=0)
+        cache.set("a", 1, ttl=60)
+        self.assertIsNone(cache.get("a"))
+
+
+class TestCacheInvalidator(unittest.IsolatedAsyncioTestCase):
+    async def test_ignores_own_messages(self):
+        cache = LocalTTLCache()
+        invalidator = CacheInvalidator(cache, redis_client=None)
+        cache.set("key", "value", ttl=60)
+        invalidator.handle_message(f"{invalidator.node_id} key")
+        self.assertEqual(cache.get("key"), "value")
+        invalidator.handle_message("other-node key")
+        self.assertIsNone(cache.get("key"))
+
+    async def test_publish_only_while_listening(self):
+        redis_client = AsyncMock()
+        await CacheInvalidator(LocalTTLCache(), redis_client).publish("key")
+        redis_client.publish.assert_not_awaited()
+
+    async def test_invalidation_between_workers(self):
+        redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        worker_a = CacheInvalidator(LocalTTLCache(), redis_client)
+        worker_b = CacheInvalidator(LocalTTLCache(), redis_client)
+        worker_a.start()
+        worker_b.start()
+        await asyncio.sleep(0.05)  # let both subscribe
+
+        worker_a.cache.set("key", "old", ttl=60)
+        worker_b.cache.set("key", "new", ttl=60)
+        await worker_b.publish("key")
+        for _ in range(50):
+            if worker_a.cache.get("key") is None:
+                break
+            await asyncio.sleep(0.01)
+
+        self.assertIsNone(worker_a.cache.get("key"))
+        self.assertEqual(worker_b.cache.get("key"), "new")
+        await worker_a.stop()
+        await worker_b.stop()
+
+
+class TestTwoTierCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        local_cache.clear()
+
+    def tearDown(self):
+        local_cache.clear()
+
+    async def test_cache_get_reads_through_and_keeps_redis_hits(self):
+        with patch("services.og_scraper.REDIS_CLIENT.get", new_callable=AsyncMock, return_value='{"id":1}') as mock_get:
+            self.assertEqual(await cache_get("https://hot.com"), '{"id":1}')
+            self.assertEqual(await cache_get("https://hot.com"), '{"id":1}')
+        mock_get.assert_awaited_once()
+
+    async def test_failed_records_use_the_negative_ttl(self):
+        value = '{"id":1,"url":"https://no-og.com/","image_url":null,"status":"failed","next_retry_at":null}'
+        with patch("services.og_scraper.REDIS_CLIENT.get", new_callable=AsyncMock, return_value=value), \
+                patch.object(local_cache, "set") as mock_set:
+            await cache_get("https://no-og.com")
+        self.assertEqual(mock_set.call_args.args[2], 60)
+
+    @patch("services.og_scraper.REDIS_CLIENT.set", new_callable=AsyncMock)
+    async def test_cache_save_writes_both_tiers(self, mock_set):
+        entry = SimpleNamespace(id=1, url="https://hot.com", image_url="https://hot.com/a.jpg", status=URLStatus.SUCCESS.value)
+        await cache_save(entry)
+        with patch("services.og_scraper.REDIS_CLIENT.get", new_callable=AsyncMock) as mock_get:
+            self.assertIn("https://hot.com/a.jpg", await cache_get("https://hot.com"))
+        mock_get.assert_not_awaited()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from api.schemas import URLInfo
+from database.enums import URLStatus
+from main import app
+from services import metrics
+from services.metrics import Counter, Gauge, Histogram, MetricsRegistry
+from services.local_cache import local_cache
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render_prometheus_text(self):
+        registry = MetricsRegistry()
+        latency = Histogram("test_latency_seconds", "Latency", ["path"], buckets=(0.1, 1), registry=registry)
+        hit = latency.labels("hit")
+        hit.observe(0.05)
+        hit.observe(0.5)
+        hit.observe(5)
+        requests = Counter("test_requests", "Requests", ["result"], registry=registry)
+        requests.labels("ok").inc(3)
+        size = Gauge("test_size", "Size", registry=registry)
+        size.set_function(lambda: 7)
+
+        lines = registry.render().splitlines()
+        self.assertIn("# TYPE test_latency_seconds histogram", lines)
+        self.assertIn('test_latency_seconds_bucket{path="hit",le="0.1"} 1', lines)
+        self.assertIn('test_latency_seconds_bucket{path="hit",le="1"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{path="hit",le="+Inf"} 3', lines)
+        self.assertIn('test_latency_seconds_sum{path="hit"} 5.55', lines)
+        self.assertIn('test_latency_seconds_count{path="hit"} 3', lines)
+        self.assertIn('test_requests_total{result="ok"} 3', lines)
+        self.assertIn("test_size 7", lines)
+
+    def test_labels_are_bound_once(self):
+        registry = MetricsRegistry()
+        latency = Histogram("test_bound_seconds", "Latency", ["path"], registry=registry)
+        self.assertIs(latency.labels("a"), latency.labels("a"))
+        with self.assertRaises(ValueError):
+            latency.labels("a", "b")
+        with self.assertRaises(ValueError):
+            Counter("test_bound_seconds", "Duplicate", registry=registry)
+
+
+class TestInstrumentation(unittest.IsolatedAsyncioTestCase):
+    async def test_db_statements_are_timed(self):
+        engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        metrics.instrument_engine(engine)
+        before = metrics.DB_STATEMENTS["SELECT"].count
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            with self.assertRaises(Exception):
+                await conn.execute(text("SELECT * FROM missing_table"))
+            await conn.execute(text("  select 2"))
+        await engine.dispose()
+        self.assertEqual(metrics.DB_STATEMENTS["SELECT"].count, before + 2)
+
+
+class TestMetricsEndpoint(unittest.TestCase):
+    @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
+    def test_metrics_endpoint(self, mock_redis_get):
+        local_cache.clear()
+        mock_redis_get.return_value = URLInfo(
+            id=1, url="https://cached.com", image_url="https://cached.com/img.png", status=URLStatus.SUCCESS
+        ).model_dump_json()
+        before = metrics.SUBMIT_CACHE_HIT.count
+        client = TestClient(app)
+        client.post("/api/submit", json={"url": "https://cached.com"})
+        local_cache.clear()
+
+        response = client.get("/metrics")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        self.assertEqual(metrics.SUBMIT_CACHE_HIT.count, before + 1)
+        for name in ("og_submit_duration_seconds_bucket", "og_redis_duration_seconds_count",
+                     "og_cache_requests_total", "og_scrapes_in_flight", "og_host_slots_active"):
+            self.assertIn(name, response.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
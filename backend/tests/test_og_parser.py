@@ -0,0 +1,140 @@
+import httpx
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+from services import parse_pool
+from services.metrics import PARSES_OFFLOADED
+from services.og_parser import lxml_available
+from services.og_parser import make_head_parser
+from services.og_parser import parse_head
+from services.og_scraper import stream_og_page
+
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "pages"
+BACKENDS = ["html.parser", "regex"] + (["lxml"] if lxml_available() else [])
+
+
+class RecordedStream(httpx.AsyncByteStream):
+    def __init__(self, body: bytes, chunks: list):
+        self.body = body
+        self.chunks = chunks
+
+    async def __aiter__(self):
+        for i in range(0, len(self.body), 4096):
+            self.chunks.append(self.body[i:i + 4096])
+            yield self.chunks[-1]
+
+
+def mock_http_client(body: str, chunks: list = None):
+    def handler(request):
+        stream = RecordedStream(body.encode("utf-8"), [] if chunks is None else chunks)
+        return httpx.Response(200, headers={"content-type": "text/html"}, stream=stream)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def feed_in_chunks(parser, html: str, size: int):
+    for i in range(0, len(html), size):
+        parser.feed(html[i:i + size])
+        if parser.done:
+            break
+    return parser
+
+
+def parsed(parser) -> tuple:
+    return parser.image_url, parser.metadata(), parser.canonical_url
+
+
+class TestParserBackends(unittest.TestCase):
+    def test_backends_agree_on_fixtures(self):
+        for path in sorted(FIXTURES_DIR.glob("*.html")):
+            html = path.read_text(encoding="utf-8")
+            expected = parsed(feed_in_chunks(make_head_parser("https://example.com/a", "html.parser"), html, len(html)))
+            for backend in BACKENDS:
+                with self.subTest(fixture=path.name, backend=backend):
+                    # Tags and entities split across chunks
+                    parser = feed_in_chunks(make_head_parser("https://example.com/a", backend), html, 7)
+                    self.assertEqual(parsed(parser), expected)
+
+    def test_backends_fallbacks_and_end_of_head(self):
+        for backend in BACKENDS:
+            with self.subTest(backend=backend):
+                parser = make_head_parser("https://example.com/a/b", backend)
+                parser.feed(
+                    '<html><head><base href="https://static.example.com/assets/"><title>  Plain\n title </title>'
+                    '<meta name="description" content="Plain description"><link rel="icon" href="icon.png">'
+                    '<meta name="twitter:image:src" content="//cdn.example.com/card.png">'
+                )
+                self.assertFalse(parser.done)
+                parser.feed('<div><meta property="og:image" content="https://example.com/in-body.jpg"></div>')
+                self.assertTrue(parser.done)
+                self.assertEqual(parser.image_url, "https://cdn.example.com/card.png")
+                metadata = parser.metadata()
+                self.assertEqual(metadata["title"], "Plain title")
+                self.assertEqual(metadata["icon_url"], "https://static.example.com/assets/icon.png")
+
+    def test_regex_skips_comments_and_raw_text(self):
+        html = (
+            '<!DOCTYPE html><html><head><!-- <meta property="og:image" content="/commented.jpg"> -->'
+            '<script>document.write("<meta property=\'og:image\' content=\'/script.jpg\'><div>")</script>'
+            '<title>A &amp; <b>B</b></title>'
+            '<meta content="/real.jpg?a=1&amp;b=2" PROPERTY=\'og:image\' data-x="a > b"></head><body>'
+        )
+        parser = feed_in_chunks(make_head_parser("https://example.com/", "regex"), html, 5)
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.image_url, "https://example.com/real.jpg?a=1&b=2")
+        self.assertEqual(parser.metadata()["title"], "A & <b>B</b>")
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            make_head_parser("https://example.com/", "soup")
+
+    def test_parse_head(self):
+        result = parse_head('<head><meta property="og:image" content="/i.jpg">', "https://example.com/", "regex")
+        self.assertEqual(result["image_url"], "https://example.com/i.jpg")
+        self.assertGreaterEqual(result["seconds"], 0)
+
+
+class TestParseOffload(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.patches = [
+            patch("services.parse_pool.HTML_PARSE_POOL", "thread"),
+            patch("services.og_scraper.HTML_PARSE_POOL", "thread"),
+            patch("services.og_scraper.HTML_PARSE_INLINE_MAX_BYTES", 32 * 1024),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        for p in self.patches:
+            p.stop()
+        parse_pool.close_parse_pool()
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_large_head_parsed_in_pool(self, mock_client):
+        chunks = []
+        script = "<script>var data = '" + "x" * 100 * 1024 + "';</script>"
+        body = (
+            f'<html><head><title>Big</title>{script}<meta property="og:image" content="/big.jpg"></head>'
+            "<body>" + "y" * 1024 * 1024 + "</body></html>"
+        )
+        mock_client.return_value = mock_http_client(body, chunks=chunks)
+        offloaded = PARSES_OFFLOADED._default().get()
+
+        page = await stream_og_page("https://example.com/")
+        self.assertEqual(page.image_url, "https://example.com/big.jpg")
+        self.assertEqual(page.metadata["title"], "Big")
+        self.assertEqual(PARSES_OFFLOADED._default().get(), offloaded + 1)
+        # Still stops reading after the head
+        self.assertLess(sum(len(c) for c in chunks), 160 * 1024)
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_small_head_parsed_inline(self, mock_client):
+        mock_client.return_value = mock_http_client('<head><meta property="og:image" content="/i.jpg"></head>')
+        offloaded = PARSES_OFFLOADED._default().get()
+        page = await stream_og_page("https://example.com/")
+        self.assertEqual(page.image_url, "https://example.com/i.jpg")
+        self.assertEqual(PARSES_OFFLOADED._default().get(), offloaded)
+        self.assertIsNone(parse_pool._parse_pool)
+
+
+if __name__ == "__main__":
+    unittest.main()
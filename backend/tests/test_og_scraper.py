@@ -1,56 +1,408 @@
+import fakeredis
+import httpx
+import time
 import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from bs4 import BeautifulSoup
+from pathlib import Path
+from urllib.parse import urljoin
 from unittest.mock import AsyncMock, patch, MagicMock
-from services.og_scraper import extract_og_image, cache_save, process_og_url_by_entry_id
+from benchmarks.stub_origin import StubOrigin
+from benchmarks.stub_origin import StubPage
+from benchmarks.stub_origin import article_page
+from services.og_scraper import extract_og_image, cache_save, cache_save_negative, process_og_url_by_entry_id, stream_og_image
+from services.og_scraper import cache_get, is_retry_deferred, retry_backoff_seconds
+from services.og_scraper import OGPage, cache_ttl_seconds, fresh_seconds_left, parse_max_age, stream_og_page
+from services import og_scraper
+from services import parse_pool
+from services.metrics import PARSES_OFFLOADED
+from services.host_scheduler import HostQueueTimeout
+from services.og_parser import OGHeadParser
+from api.schemas import URLInfo
 from database.enums import URLStatus
 
 HTML_WITH_OG = '<html><head><meta property="og:image" content="https://example.com/image.jpg"></head></html>'
 HTML_NO_OG = '<html><head><title>No OG</title></head></html>'
+FIXTURES_DIR = Path(__file__).parent / "fixtures" / "pages"
+
+
+class ChunkedStream(httpx.AsyncByteStream):
+    """
+    Response body delivered in small chunks, recording what was actually read
+    """
+    def __init__(self, body: bytes, chunks: list, chunk_size: int = 4096):
+        self.body = body
+        self.chunks = chunks
+        self.chunk_size = chunk_size
+
+    async def __aiter__(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            chunk = self.body[i:i + self.chunk_size]
+            self.chunks.append(chunk)
+            yield chunk
+
+
+def mock_http_client(body, content_type="text/html; charset=utf-8", chunks=None, chunk_size=4096):
+    body = body.encode("utf-8") if isinstance(body, str) else body
+    chunks = [] if chunks is None else chunks
+
+    def handler(request):
+        stream = ChunkedStream(body, chunks, chunk_size)
+        return httpx.Response(200, headers={"content-type": content_type}, stream=stream)
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
 
 class TestOGProcessor(unittest.IsolatedAsyncioTestCase):
-    @patch("services.og_scraper.httpx.AsyncClient.get")
-    async def test_extract_og_image_success(self, mock_get):
-        mock_get.return_value.text = HTML_WITH_OG
+    async def asyncSetUp(self):
+        # Large heads go to a thread pool, shut down after each test
+        self.patches = [
+            patch("services.parse_pool.HTML_PARSE_POOL", "thread"),
+            patch("services.og_scraper.HTML_PARSE_POOL", "thread"),
+        ]
+        for p in self.patches:
+            p.start()
+
+    async def asyncTearDown(self):
+        for p in self.patches:
+            p.stop()
+        parse_pool.close_parse_pool()
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_extract_og_image_success(self, mock_client):
+        mock_client.return_value = mock_http_client(HTML_WITH_OG)
         result = await extract_og_image("https://example.com")
-        print('testing...')
         self.assertEqual(result, "https://example.com/image.jpg")
 
-    @patch("services.og_scraper.httpx.AsyncClient.get")
-    async def test_extract_og_image_no_tag(self, mock_get):
-        mock_get.return_value.text = HTML_NO_OG
+    @patch("services.og_scraper.get_http_client")
+    async def test_extract_og_image_no_tag(self, mock_client):
+        mock_client.return_value = mock_http_client(HTML_NO_OG)
         result = await extract_og_image("https://example.com")
         self.assertIsNone(result)
 
-    @patch("services.og_scraper.httpx.AsyncClient.get", side_effect=Exception("Timeout"))
-    async def test_extract_og_image_exception(self, mock_get):
+    @patch("services.og_scraper.get_http_client")
+    async def test_extract_og_image_exception(self, mock_client):
+        mock_client.return_value.stream.side_effect = Exception("Timeout")
         result = await extract_og_image("https://timeout.com")
         self.assertIsNone(result)
 
+    @patch("services.og_scraper.get_http_client")
+    async def test_extract_og_image_refuses_non_html(self, mock_client):
+        chunks = []
+        mock_client.return_value = mock_http_client(b"\x89PNG" * 1000, content_type="image/png", chunks=chunks)
+        result = await extract_og_image("https://example.com/image.png")
+        self.assertIsNone(result)
+        self.assertEqual(chunks, [])
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_extract_og_image_stops_after_head(self, mock_client):
+        chunks = []
+        body = HTML_WITH_OG.replace("</html>", "<body>" + "x" * 1024 * 1024 + "</body></html>")
+        mock_client.return_value = mock_http_client(body, chunks=chunks)
+        result = await extract_og_image("https://example.com")
+        self.assertEqual(result, "https://example.com/image.jpg")
+        self.assertLess(sum(len(c) for c in chunks), 64 * 1024)
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_stream_og_image_stops_after_head_of_drip_fed_page(self, mock_client):
+        # A short page sent a few bytes at a time: the read stops at the chunk holding </head>,
+        # not once a full text chunk is buffered
+        chunks = []
+        body = HTML_WITH_OG.replace("</html>", "<body>" + "<p>drip</p>" * 500 + "</body></html>")
+        mock_client.return_value = mock_http_client(body, chunks=chunks, chunk_size=64)
+        result = await stream_og_image("https://example.com")
+        self.assertEqual(result, "https://example.com/image.jpg")
+        self.assertEqual(len(chunks), body.index("</head>") // 64 + 1)
+
+    async def test_slow_drip_origin_scraped_once_head_arrived(self):
+        # The submit_miss_slow_drip benchmark scenario: the whole body takes about 1.3 s to arrive
+        page = StubPage(body=article_page(8 * 1024), drip_bytes=32, drip_delay=0.005)
+        async with StubOrigin({"/drip": page}) as origin, httpx.AsyncClient() as client:
+            with patch("services.og_scraper.get_http_client", return_value=client):
+                start = time.perf_counter()
+                result = await stream_og_image(f"{origin.base_url}/drip")
+                elapsed = time.perf_counter() - start
+        self.assertEqual(result, "https://stub.local/image.jpg")
+        self.assertLess(elapsed, 0.5)
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_stream_og_image_byte_budget(self, mock_client):
+        chunks = []
+        body = "<html><head>" + "<!-- padding -->" * 100_000 + HTML_WITH_OG
+        mock_client.return_value = mock_http_client(body, chunks=chunks)
+        offloaded = PARSES_OFFLOADED._default().get()
+        with patch("services.og_scraper.HTML_PARSE_INLINE_MAX_BYTES", 64 * 1024):
+            result = await stream_og_image("https://example.com", max_bytes=64 * 1024)
+        self.assertIsNone(result)
+        self.assertLess(sum(len(c) for c in chunks), 128 * 1024)
+        # Cut off by the budget, not parsed again in the pool
+        self.assertEqual(PARSES_OFFLOADED._default().get(), offloaded)
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_extract_og_image_matches_beautifulsoup_on_fixtures(self, mock_client):
+        for path in sorted(FIXTURES_DIR.glob("*.html")):
+            html = path.read_text(encoding="utf-8")
+            with self.subTest(fixture=path.name):
+                mock_client.return_value = mock_http_client(html)
+                soup = BeautifulSoup(html, "html.parser")
+                # The first og:image with a content, else twitter:image
+                tags = [tag for tag in soup.find_all("meta", property="og:image") if tag.get("content")]
+                tags += soup.find_all("meta", attrs={"name": "twitter:image"})
+                expected = urljoin("https://example.com", tags[0]["content"]) if tags else None
+                self.assertEqual(await extract_og_image("https://example.com"), expected)
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_stream_og_page_metadata(self, mock_client):
+        html = (FIXTURES_DIR / "full_metadata.html").read_text(encoding="utf-8")
+
+        def handler(request):
+            if request.url.path == "/old":
+                return httpx.Response(301, headers={"location": "https://www.example.com/news/story"})
+            return httpx.Response(200, headers={"content-type": "text/html"}, text=html)
+        mock_client.return_value = httpx.AsyncClient(transport=httpx.MockTransport(handler), follow_redirects=True)
+
+        page = await stream_og_page("https://example.com/old")
+        # Relative urls resolve against the final url, after the redirect
+        self.assertEqual(page.image_url, "https://www.example.com/images/hero.jpg")
+        self.assertEqual(page.metadata, {
+            "title": "OG title",
+            "description": "OG & description",
+            "site_name": "Example News",
+            "image_width": 1200,
+            "image_height": 630,
+            "image_type": "image/jpeg",
+            "twitter_card": "summary_large_image",
+            "icon_url": "https://www.example.com/favicon.ico",
+        })
+
+    def test_og_head_parser_fallbacks(self):
+        parser = OGHeadParser(base_url="https://example.com/a/b")
+        parser.feed(
+            '<html><head><base href="https://static.example.com/assets/"><title>  Plain\n title </title>'
+            '<meta name="description" content="Plain description"><link rel="icon" href="icon.png">'
+            '<meta name="twitter:image:src" content="//cdn.example.com/card.png">'
+            '<meta property="og:image:width" content="100">'
+        )
+        self.assertFalse(parser.done)
+        parser.feed('<div><meta property="og:image" content="https://example.com/in-body.jpg"></div>')
+        self.assertTrue(parser.done)
+        self.assertEqual(parser.image_url, "https://cdn.example.com/card.png")
+        metadata = parser.metadata()
+        self.assertEqual(metadata["title"], "Plain title")
+        self.assertEqual(metadata["description"], "Plain description")
+        self.assertEqual(metadata["icon_url"], "https://static.example.com/assets/icon.png")
+        self.assertIsNone(metadata["image_width"])
+
     @patch("services.og_scraper.REDIS_CLIENT.set", new_callable=AsyncMock)
     async def test_cache_save(self, mock_set):
-        await cache_save("https://example.com", "https://example.com/image.jpg", ttl=60)
-        mock_set.assert_awaited_once_with("https://example.com", "https://example.com/image.jpg", ex=60)
+        entry = SimpleNamespace(
+            id=1, url="https://example.com", image_url="https://example.com/image.jpg", status=URLStatus.SUCCESS.value
+        )
+        await cache_save(entry, ttl=60)
+        mock_set.assert_awaited_once()
+        key, value = mock_set.await_args.args
+        self.assertEqual(key, "og:info:https://example.com")
+        self.assertEqual(mock_set.await_args.kwargs, {"ex": 60})
+        self.assertEqual(URLInfo.model_validate_json(value), URLInfo.model_validate(entry))
+
+    @patch("services.og_scraper.REDIS_CLIENT.get", new_callable=AsyncMock, return_value='{"id": 1}')
+    async def test_cache_get(self, mock_get):
+        self.assertEqual(await cache_get("https://example.com"), '{"id": 1}')
+        mock_get.assert_awaited_once_with("og:info:https://example.com")
 
-    @patch("services.og_scraper.init_db", new_callable=AsyncMock)
     @patch("services.og_scraper.AsyncSessionLocal")
-    @patch("services.og_scraper.extract_og_image", return_value="https://example.com/image.jpg")
+    @patch("services.og_scraper.fetch_og_page", return_value=OGPage(image_url="https://example.com/image.jpg", etag='"v1"', max_age=600))
     @patch("services.og_scraper.cache_save", new_callable=AsyncMock)
     @patch("services.og_scraper.crud.update_url_entry", new_callable=AsyncMock)
     async def test_process_og_url_success(
-        self, mock_update, mock_cache, mock_extract, mock_session_local, mock_init_db
+        self, mock_update, mock_cache, mock_fetch, mock_session_local
+    ):
+        mock_session = AsyncMock()
+        mock_session.get = AsyncMock(return_value=MagicMock(id=1, url="https://example.com", image_url=None))
+        mock_session_local.return_value.__aenter__.return_value = mock_session
+
+        await process_og_url_by_entry_id(1)
+
+        mock_fetch.assert_awaited_once_with("https://example.com", None, None)
+        args, kwargs = mock_update.await_args
+        self.assertEqual(args, (mock_session, 1, "https://example.com/image.jpg", URLStatus.SUCCESS.value))
+        self.assertEqual((kwargs["etag"], kwargs["last_modified"], kwargs["max_age"]), ('"v1"', None, 600))
+        self.assertIsNotNone(kwargs["validated_at"])
+        mock_cache.assert_awaited_once_with(mock_update.return_value)
+
+    @patch("services.og_scraper.AsyncSessionLocal")
+    @patch("services.og_scraper.fetch_og_page", return_value=OGPage(not_modified=True))
+    @patch("services.og_scraper.cache_save", new_callable=AsyncMock)
+    @patch("services.og_scraper.crud.update_url_entry", new_callable=AsyncMock)
+    async def test_process_og_url_not_modified_refreshes_validation(
+        self, mock_update, mock_cache, mock_fetch, mock_session_local
+    ):
+        stored = MagicMock(
+            id=1, url="https://example.com", image_url="https://example.com/old.jpg",
+            etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT", max_age=600,
+        )
+        mock_session = AsyncMock()
+        mock_session.get = AsyncMock(return_value=stored)
+        mock_session_local.return_value.__aenter__.return_value = mock_session
+
+        await process_og_url_by_entry_id(1)
+
+        mock_fetch.assert_awaited_once_with("https://example.com", '"v1"', "Mon, 01 Jan 2024 00:00:00 GMT")
+        args, kwargs = mock_update.await_args
+        self.assertEqual(args[2], "https://example.com/old.jpg")
+        self.assertEqual((kwargs["etag"], kwargs["max_age"]), ('"v1"', 600))
+        mock_cache.assert_awaited_once_with(mock_update.return_value)
+
+    @patch("services.og_scraper.AsyncSessionLocal")
+    @patch("services.og_scraper.fetch_og_page", return_value=None)
+    @patch("services.og_scraper.cache_save", new_callable=AsyncMock)
+    @patch("services.og_scraper.crud.update_url_entry", new_callable=AsyncMock)
+    async def test_process_og_url_failed_revalidation_keeps_image(
+        self, mock_update, mock_cache, mock_fetch, mock_session_local
+    ):
+        stored = MagicMock(id=1, url="https://example.com", image_url="https://example.com/old.jpg", etag=None, last_modified=None)
+        mock_session = AsyncMock()
+        mock_session.get = AsyncMock(return_value=stored)
+        mock_session_local.return_value.__aenter__.return_value = mock_session
+
+        self.assertIs(await process_og_url_by_entry_id(1), stored)
+        mock_update.assert_not_awaited()
+        mock_cache.assert_awaited_once_with(stored, ttl=og_scraper.SCRAPE_CACHE_TTL_MIN_SECONDS)
+
+    @patch("services.og_scraper.AsyncSessionLocal")
+    @patch("services.og_scraper.get_http_client")
+    @patch("services.og_scraper.cache_save", new_callable=AsyncMock)
+    @patch("services.og_scraper.crud.update_url_entry", new_callable=AsyncMock)
+    async def test_process_og_url_revalidation_error_page_keeps_image(
+        self, mock_update, mock_cache, mock_client, mock_session_local
+    ):
+        mock_client.return_value = httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(500, headers={"content-type": "text/html"}, text=HTML_NO_OG)
+        ))
+        stored = MagicMock(id=1, url="https://example.com", image_url="https://example.com/old.jpg", etag='"v1"', last_modified=None)
+        mock_session = AsyncMock()
+        mock_session.get = AsyncMock(return_value=stored)
+        mock_session_local.return_value.__aenter__.return_value = mock_session
+
+        self.assertIs(await process_og_url_by_entry_id(1), stored)
+        mock_update.assert_not_awaited()
+        mock_cache.assert_awaited_once_with(stored, ttl=og_scraper.SCRAPE_CACHE_TTL_MIN_SECONDS)
+
+    @patch("services.og_scraper.AsyncSessionLocal")
+    @patch("services.og_scraper.fetch_og_page", side_effect=HostQueueTimeout("queue full"))
+    @patch("services.og_scraper.cache_save_negative", new_callable=AsyncMock)
+    @patch("services.og_scraper.crud.update_url_entry", new_callable=AsyncMock)
+    async def test_process_og_url_host_queue_timeout_counts_no_attempt(
+        self, mock_update, mock_cache_negative, mock_fetch, mock_session_local
     ):
+        stored = MagicMock(id=1, url="https://example.com", image_url=None, attempt_count=2)
         mock_session = AsyncMock()
-        mock_session.get = AsyncMock(return_value=MagicMock(id=1, url="https://example.com"))
+        mock_session.get = AsyncMock(return_value=stored)
         mock_session_local.return_value.__aenter__.return_value = mock_session
 
+        self.assertIs(await process_og_url_by_entry_id(1), stored)
+        mock_update.assert_not_awaited()
+        mock_cache_negative.assert_not_awaited()
+
+    @patch("services.og_scraper.REDIS_CLIENT.set", new_callable=AsyncMock)
+    async def test_cache_save_negative(self, mock_set):
+        entry = SimpleNamespace(id=1, url="https://example.com", image_url=None, status=URLStatus.FAILED.value)
+        await cache_save_negative(entry, ttl=30)
+        self.assertEqual(mock_set.await_args.kwargs, {"ex": 30})
+        self.assertEqual(URLInfo.model_validate_json(mock_set.await_args.args[1]).status, URLStatus.FAILED.value)
+
+    @patch("services.og_scraper.AsyncSessionLocal")
+    @patch("services.og_scraper.fetch_og_page", return_value=OGPage())
+    @patch("services.og_scraper.cache_save", new_callable=AsyncMock)
+    @patch("services.og_scraper.cache_save_negative", new_callable=AsyncMock)
+    @patch("services.og_scraper.crud.update_url_entry", new_callable=AsyncMock)
+    async def test_process_og_url_no_image_persists_failure(
+        self, mock_update, mock_cache_negative, mock_cache, mock_fetch, mock_session_local
+    ):
+        mock_session = AsyncMock()
+        mock_session.get = AsyncMock(return_value=MagicMock(id=1, url="https://example.com", image_url=None, attempt_count=2))
+        mock_session_local.return_value.__aenter__.return_value = mock_session
+
+        before = datetime.now(timezone.utc)
         await process_og_url_by_entry_id(1)
 
-        mock_extract.assert_awaited_once_with("https://example.com")
-        mock_cache.assert_awaited_once_with("https://example.com", "https://example.com/image.jpg")
-        mock_update.assert_awaited_once_with(1, "https://example.com/image.jpg", URLStatus.SUCCESS.value)
+        mock_cache.assert_not_awaited()
+        mock_cache_negative.assert_awaited_once_with(mock_update.return_value)
+        args, kwargs = mock_update.await_args
+        self.assertEqual(args, (mock_session, 1, None, URLStatus.FAILED.value))
+        self.assertEqual(kwargs["attempt_count"], 3)
+        self.assertGreaterEqual(kwargs["next_retry_at"], before + timedelta(seconds=retry_backoff_seconds(3)))
+
+    @patch("services.og_scraper.SCRAPE_RETRY_BACKOFF_BASE_SECONDS", 10)
+    @patch("services.og_scraper.SCRAPE_RETRY_BACKOFF_MAX_SECONDS", 100)
+    def test_retry_backoff_seconds(self):
+        self.assertEqual([retry_backoff_seconds(n) for n in range(1, 6)], [10, 20, 40, 80, 100])
+
+    def test_is_retry_deferred(self):
+        now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.assertFalse(is_retry_deferred(SimpleNamespace(next_retry_at=None), now))
+        self.assertTrue(is_retry_deferred(SimpleNamespace(next_retry_at=now + timedelta(seconds=1)), now))
+        self.assertFalse(is_retry_deferred(SimpleNamespace(next_retry_at=now - timedelta(seconds=1)), now))
+        # sqlite returns naive utc datetimes
+        self.assertTrue(is_retry_deferred(SimpleNamespace(next_retry_at=datetime(2024, 1, 1, 0, 0, 1)), now))
+
+    def test_parse_max_age(self):
+        self.assertEqual(parse_max_age(httpx.Headers({"cache-control": "public, max-age=600"})), 600)
+        self.assertEqual(parse_max_age(httpx.Headers({"cache-control": "max-age=600, s-maxage=60"})), 60)
+        self.assertEqual(parse_max_age(httpx.Headers({"cache-control": "no-cache"})), 0)
+        self.assertEqual(parse_max_age(httpx.Headers({
+            "date": "Mon, 01 Jan 2024 00:00:00 GMT", "expires": "Mon, 01 Jan 2024 01:00:00 GMT",
+        })), 3600)
+        self.assertEqual(parse_max_age(httpx.Headers({"expires": "0"})), 0)
+        self.assertIsNone(parse_max_age(httpx.Headers({})))
+
+    @patch("services.og_scraper.SCRAPE_CACHE_TTL_DEFAULT_SECONDS", 300)
+    @patch("services.og_scraper.SCRAPE_CACHE_TTL_MIN_SECONDS", 60)
+    @patch("services.og_scraper.SCRAPE_CACHE_TTL_MAX_SECONDS", 3600)
+    def test_cache_ttl_and_freshness(self):
+        self.assertEqual([cache_ttl_seconds(v) for v in (None, 0, 600, 10 ** 6)], [300, 60, 600, 3600])
+        now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        entry = SimpleNamespace(validated_at=now - timedelta(seconds=100), max_age=600)
+        self.assertEqual(fresh_seconds_left(entry, now), 500)
+        # sqlite returns naive utc datetimes
+        entry = SimpleNamespace(validated_at=datetime(2023, 12, 31, 23, 50), max_age=None)
+        self.assertEqual(fresh_seconds_left(entry, now), -300)
+        self.assertLess(fresh_seconds_left(SimpleNamespace(validated_at=None, max_age=None), now), 0)
+
+    @patch("services.og_scraper.get_http_client")
+    async def test_stream_og_page_conditional_request(self, mock_client):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(304, headers={"etag": '"v2"', "cache-control": "max-age=120"})
+
+        mock_client.return_value = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        page = await stream_og_page("https://example.com", etag='"v1"', last_modified="Mon, 01 Jan 2024 00:00:00 GMT")
+        self.assertTrue(page.not_modified)
+        self.assertEqual((page.etag, page.max_age), ('"v2"', 120))
+        self.assertEqual(requests[0].headers["if-none-match"], '"v1"')
+        self.assertEqual(requests[0].headers["if-modified-since"], "Mon, 01 Jan 2024 00:00:00 GMT")
+
+    @patch("services.og_scraper.SCRAPE_STALE_WHILE_REVALIDATE_SECONDS", 600)
+    @patch("services.og_scraper.LOCAL_CACHE_ENABLED", False)
+    @patch("services.og_scraper.revalidate_in_background")
+    async def test_cache_get_stale_while_revalidate(self, mock_revalidate):
+        entry = SimpleNamespace(
+            id=1, url="https://example.com", image_url="https://example.com/image.jpg", status=URLStatus.SUCCESS.value
+        )
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        with patch("services.og_scraper.REDIS_CLIENT", redis):
+            await cache_save(entry, ttl=60)
+            self.assertEqual(await redis.ttl("og:info:https://example.com"), 660)
+            self.assertIsNotNone(await cache_get("https://example.com"))
+            mock_revalidate.assert_not_called()
+
+            await redis.delete("og:fresh:https://example.com")  # freshness ran out
+            self.assertIsNotNone(await cache_get("https://example.com"))
+            mock_revalidate.assert_called_once_with("https://example.com")
 
-    @patch("services.og_scraper.init_db", new_callable=AsyncMock)
     @patch("services.og_scraper.AsyncSessionLocal")
-    async def test_process_og_url_entry_not_found(self, mock_session_local, mock_init_db):
+    async def test_process_og_url_entry_not_found(self, mock_session_local):
         mock_session = AsyncMock()
         mock_session.get = AsyncMock(return_value=None)
         mock_session_local.return_value.__aenter__.return_value = mock_session
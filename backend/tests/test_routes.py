@@ -3,13 +3,16 @@ from unittest.mock import patch, AsyncMock
 from fastapi.testclient import TestClient
 from main import app  # replace with the correct path to your FastAPI app
 from types import SimpleNamespace
+from api.schemas import URLInfo
 from database.enums import URLStatus
+from datetime import datetime, timedelta, timezone
 import unittest
 from unittest.mock import patch, AsyncMock
 from types import SimpleNamespace
 from fastapi.testclient import TestClient
 from fastapi import FastAPI
 from api.routes import router  # adjust import to your actual router location
+from services.local_cache import local_cache
 
 
 app = FastAPI()
@@ -18,57 +21,98 @@ app.include_router(router, prefix="/api")
 class TestAPIEndpoints(unittest.TestCase):
     def setUp(self):
         self.client = TestClient(app)
+        local_cache.clear()
 
     @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
-    @patch("database.crud.get_url_entry_by_url", new_callable=AsyncMock)
-    def test_submit_url_cache_hit(self, mock_get_by_url, mock_redis_get):
-        mock_redis_get.return_value = "https://cached.com/img.png"
-        mock_get_by_url.return_value = SimpleNamespace(
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
+    def test_submit_url_cache_hit(self, mock_upsert, mock_redis_get):
+        mock_redis_get.return_value = URLInfo(
             id=1, url="https://cached.com", image_url="https://cached.com/img.png", status=URLStatus.SUCCESS
-        )
+        ).model_dump_json()
         response = self.client.post("/api/submit", json={"url": "https://cached.com"})
         self.assertEqual(response.status_code, 200)
         data = response.json()
+        self.assertEqual(data["id"], 1)
         self.assertEqual(data["url"], "https://cached.com/")
         self.assertEqual(data["image_url"], "https://cached.com/img.png")
+        mock_redis_get.assert_awaited_once_with("og:info:https://cached.com/")
+        mock_upsert.assert_not_awaited()
 
     @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
-    @patch("database.crud.get_url_entry_by_url", new_callable=AsyncMock)
-    @patch("services.og_scraper.cache_save", new_callable=AsyncMock)
-    def test_submit_url_existing_entry_with_image(self, mock_cache_save, mock_get_by_url, mock_redis_get):
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
+    @patch("api.routes.cache_save", new_callable=AsyncMock)
+    def test_submit_url_existing_entry_with_image(self, mock_cache_save, mock_upsert, mock_redis_get):
         mock_redis_get.return_value = None
-        mock_get_by_url.return_value = SimpleNamespace(
-            id=2, url="https://existing.com", image_url="https://existing.com/img.png", status=URLStatus.SUCCESS
+        mock_upsert.return_value = SimpleNamespace(
+            id=2, url="https://existing.com", image_url="https://existing.com/img.png", status=URLStatus.SUCCESS,
+            next_retry_at=None, max_age=None, validated_at=datetime.now(timezone.utc), canonical_url=None,
         )
         response = self.client.post("/api/submit", json={"url": "https://existing.com"})
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertEqual(data["url"], "https://existing.com/")
         self.assertEqual(data["image_url"], "https://existing.com/img.png")
+        mock_cache_save.assert_awaited_once_with(mock_upsert.return_value)
 
-    @patch("database.crud.update_url_entry", new_callable=AsyncMock)
-    @patch("services.og_scraper.REDIS_CLIENT.set", new_callable=AsyncMock)
     @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
-    @patch("database.crud.get_url_entry_by_url", new_callable=AsyncMock)
-    @patch("database.crud.create_url_entry", new_callable=AsyncMock)
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
+    @patch("api.routes.process_og_url_entry", new_callable=AsyncMock)
+    def test_submit_url_stale_entry_is_revalidated(self, mock_process, mock_upsert, mock_redis_get):
+        mock_redis_get.return_value = None
+        mock_upsert.return_value = SimpleNamespace(
+            id=5, url="https://stale.com", image_url="https://stale.com/img.png", status=URLStatus.SUCCESS,
+            next_retry_at=None, max_age=60, validated_at=datetime.now(timezone.utc) - timedelta(hours=1),
+            canonical_url=None,
+        )
+        mock_process.return_value = SimpleNamespace(
+            id=5, url="https://stale.com", image_url="https://stale.com/new.png", status=URLStatus.SUCCESS
+        )
+        response = self.client.post("/api/submit", json={"url": "https://stale.com"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["image_url"], "https://stale.com/new.png")
+        mock_process.assert_awaited_once()
+
+    @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
     @patch("database.crud.get_url_entry_by_id", new_callable=AsyncMock)
-    @patch("services.og_scraper.process_og_url_by_entry_id", new_callable=AsyncMock)
-    def test_submit_url_new_entry(
-        self, mock_process, mock_get_by_id, mock_create, mock_get_by_url, mock_redis_get, mock_redis_set, mock_update_url_entry
-    ):
+    @patch("api.routes.process_og_url_entry", new_callable=AsyncMock)
+    def test_submit_url_new_entry(self, mock_process, mock_get_by_id, mock_upsert, mock_redis_get):
         mock_redis_get.return_value = None
-        mock_get_by_url.return_value = None
-        mock_create.return_value = SimpleNamespace(
-            id=3, url="https://new.com", image_url=None, status=URLStatus.PENDING
+        mock_upsert.return_value = SimpleNamespace(
+            id=3, url="https://new.com", image_url=None, status=URLStatus.PENDING, next_retry_at=None, canonical_url=None
         )
-        mock_get_by_id.return_value = SimpleNamespace(
+        mock_process.return_value = SimpleNamespace(
             id=3, url="https://new.com", image_url="https://new.com/img.png", status=URLStatus.SUCCESS
         )
         response = self.client.post("/api/submit", json={"url": "https://new.com"})
         self.assertEqual(response.status_code, 200)
         data = response.json()
         self.assertEqual(data["url"], "https://new.com/")
-        self.assertIn("image_url", data)
+        self.assertEqual(data["image_url"], "https://new.com/img.png")
+        mock_process.assert_awaited_once()
+        mock_get_by_id.assert_not_awaited()
+
+    @patch("api.routes.process_og_url_entry", new_callable=AsyncMock)
+    @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
+    def test_submit_url_failed_entry_in_backoff_is_not_scraped(self, mock_upsert, mock_redis_get, mock_process):
+        mock_redis_get.return_value = None
+        mock_upsert.return_value = SimpleNamespace(
+            id=4, url="https://no-og.com", image_url=None, status=URLStatus.FAILED,
+            next_retry_at=datetime.now(timezone.utc) + timedelta(minutes=5), canonical_url=None,
+        )
+        response = self.client.post("/api/submit", json={"url": "https://no-og.com"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], URLStatus.FAILED.value)
+        mock_process.assert_not_awaited()
+
+    def test_get_cache_stats(self):
+        local_cache.set("og:info:https://hot.com", "{}", ttl=60)
+        local_cache.get("og:info:https://hot.com")
+        response = self.client.get("/api/cache/stats")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["size"], 1)
+        self.assertGreaterEqual(response.json()["hits"], 1)
 
     @patch("database.crud.get_all_entries", new_callable=AsyncMock)
     def test_get_history(self, mock_get_all):
@@ -87,6 +131,19 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(data["results"][0]["url"], "https://one.com/")
         self.assertEqual(data["results"][1]["url"], "https://two.com/")
 
+    @patch("database.crud.get_all_entries", new_callable=AsyncMock)
+    def test_get_history_status_filter(self, mock_get_all):
+        mock_get_all.return_value = ([], None)
+        response = self.client.get("/api/history?status=failed")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_get_all.call_args.kwargs["status"], URLStatus.FAILED.value)
+        self.assertEqual(self.client.get("/api/history?status=unknown").status_code, 422)
+        self.assertEqual(self.client.get("/api/history?limit=0").status_code, 422)
+
+    def test_get_history_invalid_cursor(self):
+        response = self.client.get("/api/history?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, 400)
+
 
 if __name__ == "__main__":
     unittest.main()
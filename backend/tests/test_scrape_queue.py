@@ -0,0 +1,149 @@
+import asyncio
+import fakeredis
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch, AsyncMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from api.routes import router
+from database.enums import URLStatus
+from services.local_cache import local_cache
+from services.metrics import SUBMIT_DEFERRED
+from services.scrape_queue import InMemoryScrapeQueue, RedisScrapeQueue, ScrapeQueueFull, ScrapeWorkerPool
+
+
+app = FastAPI()
+app.include_router(router, prefix="/api")
+
+
+class TestScrapeQueue(unittest.IsolatedAsyncioTestCase):
+    async def test_in_memory_queue_dedupes_and_bounds(self):
+        queue = InMemoryScrapeQueue(max_size=2)
+        self.assertTrue(await queue.put(1))
+        self.assertFalse(await queue.put(1))
+        self.assertTrue(await queue.put(2))
+        with self.assertRaises(ScrapeQueueFull):
+            await queue.put(3)
+
+        self.assertEqual(await queue.get(timeout=0.01), 1)
+        self.assertTrue(await queue.put(1))  # picked up, so it can be queued again
+        self.assertEqual(await queue.size(), 2)
+
+    async def test_in_memory_queue_get_timeout(self):
+        self.assertIsNone(await InMemoryScrapeQueue().get(timeout=0.01))
+
+    async def test_redis_queue_is_fifo_and_dedupes(self):
+        queue = RedisScrapeQueue(fakeredis.FakeAsyncRedis(decode_responses=True), max_size=10)
+        for id in (1, 2, 1, 3):
+            await queue.put(id)
+        self.assertEqual(await queue.size(), 3)
+        self.assertEqual([await queue.get(timeout=0.01) for _ in range(3)], [1, 2, 3])
+        self.assertIsNone(await queue.get(timeout=0.01))
+
+    async def test_redis_queue_full(self):
+        queue = RedisScrapeQueue(fakeredis.FakeAsyncRedis(decode_responses=True), max_size=1)
+        await queue.put(1)
+        with self.assertRaises(ScrapeQueueFull):
+            await queue.put(2)
+        self.assertFalse(await queue.put(1))
+        self.assertEqual(await queue.redis.smembers(queue.queued_key), {"1"})
+
+    async def test_redis_queue_requeues_id_left_without_a_job(self):
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        queue = RedisScrapeQueue(redis, max_size=10)
+        # A worker popped the job and died before removing the id from the queued set
+        await redis.sadd(queue.queued_key, 1)
+        self.assertTrue(await queue.put(1))
+        self.assertFalse(await queue.put(1))
+        self.assertEqual(await queue.get(timeout=0.01), 1)
+        self.assertEqual(await redis.smembers(queue.queued_key), set())
+
+    async def test_worker_pool_bounds_concurrency(self):
+        queue = InMemoryScrapeQueue()
+        in_flight, max_in_flight, done = 0, 0, []
+
+        async def handler(id):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            done.append(id)
+
+        for id in range(20):
+            await queue.put(id)
+        pool = ScrapeWorkerPool(queue, concurrency=3, handler=handler)
+        pool.start()
+        while len(done) < 20:
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        self.assertEqual(max_in_flight, 3)
+        self.assertEqual(sorted(done), list(range(20)))
+
+    async def test_worker_pool_survives_handler_errors(self):
+        queue = InMemoryScrapeQueue()
+        handler = AsyncMock(side_effect=[Exception("boom"), None])
+        await queue.put(1)
+        await queue.put(2)
+        pool = ScrapeWorkerPool(queue, concurrency=1, handler=handler)
+        pool.start()
+        while handler.await_count < 2:
+            await asyncio.sleep(0.01)
+        await pool.stop()
+        self.assertEqual(handler.await_count, 2)
+
+
+class TestBackgroundSubmit(unittest.TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        local_cache.clear()
+
+    @patch("api.routes.get_scrape_queue")
+    @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
+    def test_background_submit_queues_and_returns_pending(self, mock_upsert, mock_redis_get, mock_queue):
+        mock_redis_get.return_value = None
+        mock_upsert.return_value = SimpleNamespace(
+            id=7, url="https://slow.com", image_url=None, status="pending", next_retry_at=None, canonical_url=None
+        )
+        mock_queue.return_value.put = AsyncMock(return_value=True)
+        samples = SUBMIT_DEFERRED.count
+
+        response = self.client.post("/api/submit?background=true", json={"url": "https://slow.com"})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()["status"], URLStatus.PENDING.value)
+        mock_queue.return_value.put.assert_awaited_once_with(7)
+        self.assertEqual(SUBMIT_DEFERRED.count, samples + 1)
+
+    @patch("api.routes.get_scrape_queue")
+    @patch("api.routes.REDIS_CLIENT.get", new_callable=AsyncMock)
+    @patch("database.crud.upsert_url_entry", new_callable=AsyncMock)
+    def test_background_submit_queue_full(self, mock_upsert, mock_redis_get, mock_queue):
+        mock_redis_get.return_value = None
+        mock_upsert.return_value = SimpleNamespace(
+            id=8, url="https://slow.com", image_url=None, status="pending", next_retry_at=None, canonical_url=None
+        )
+        mock_queue.return_value.put = AsyncMock(side_effect=ScrapeQueueFull("full"))
+
+        response = self.client.post("/api/submit?background=true", json={"url": "https://slow.com"})
+        self.assertEqual(response.status_code, 503)
+
+    @patch("api.routes.SCRAPE_STATUS_POLL_INTERVAL_SECONDS", 0.01)
+    @patch("database.crud.get_url_entry_by_id", new_callable=AsyncMock)
+    def test_status_long_poll_returns_when_done(self, mock_get_by_id):
+        pending = SimpleNamespace(id=7, url="https://slow.com", image_url=None, status="pending")
+        done = SimpleNamespace(id=7, url="https://slow.com", image_url="https://slow.com/img.png", status="success")
+        mock_get_by_id.side_effect = [pending, pending, done]
+
+        response = self.client.get("/api/status/7?wait=5")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["status"], "success")
+        self.assertEqual(mock_get_by_id.await_count, 3)
+
+    @patch("database.crud.get_url_entry_by_id", new_callable=AsyncMock, return_value=None)
+    def test_status_not_found(self, mock_get_by_id):
+        self.assertEqual(self.client.get("/api/status/404").status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
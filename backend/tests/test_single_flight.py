@@ -0,0 +1,132 @@
+import asyncio
+import fakeredis
+import httpx
+import unittest
+from unittest.mock import patch, AsyncMock
+from services.metrics import SUBMIT_SCRAPE
+from services.single_flight import RedisSingleFlight, SingleFlight
+from tests.app_test_case import AppTestCase
+
+
+class TestSingleFlight(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_calls_share_one_run(self):
+        flight = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(50)))
+        self.assertEqual(calls, 1)
+        self.assertEqual(set(results), {"result"})
+        self.assertEqual(flight.in_flight(), 0)
+
+    async def test_errors_are_shared_and_not_remembered(self):
+        flight = SingleFlight()
+
+        async def boom():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        results = await asyncio.gather(*(flight.do("key", boom) for _ in range(3)), return_exceptions=True)
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(await flight.do("key", AsyncMock(return_value="ok")), "ok")
+
+    async def test_cancelled_caller_does_not_cancel_the_call(self):
+        flight = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.02)
+            return "result"
+
+        first = asyncio.ensure_future(flight.do("key", fetch))
+        second = asyncio.ensure_future(flight.do("key", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        self.assertEqual(await second, "result")
+
+    async def test_redis_single_flight_across_workers(self):
+        redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        workers = [RedisSingleFlight(redis_client, poll_interval=0.005) for _ in range(4)]
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.05)
+            return {"image_url": "https://example.com/img.jpg"}
+
+        results = await asyncio.gather(*(workers[i % 4].do("url", fetch) for i in range(20)))
+        self.assertEqual(calls, 1)
+        self.assertTrue(all(r == {"image_url": "https://example.com/img.jpg"} for r in results))
+        self.assertIsNone(await redis_client.get("singleflight:lock:url"))
+
+    async def test_redis_single_flight_lock_outlives_its_ttl_while_running(self):
+        redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        workers = [RedisSingleFlight(redis_client, lock_ttl=0.1, poll_interval=0.01) for _ in range(2)]
+        calls = 0
+
+        async def slow_fetch():
+            # Several lock TTLs, like a scrape waiting in its host queue
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.4)
+            return calls
+
+        leader = asyncio.ensure_future(workers[0].do("url", slow_fetch))
+        await asyncio.sleep(0.01)
+        self.assertEqual(await workers[1].do("url", slow_fetch), 1)
+        self.assertEqual(await leader, 1)
+        self.assertEqual(calls, 1)
+        self.assertIsNone(await redis_client.get("singleflight:lock:url"))
+
+    async def test_redis_single_flight_takes_over_expired_lock(self):
+        redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+        await redis_client.set("singleflight:lock:url", "dead-worker", px=50)
+        flight = RedisSingleFlight(redis_client, poll_interval=0.01)
+        self.assertEqual(await flight.do("url", AsyncMock(return_value=1)), 1)
+
+
+class TestConcurrentSubmits(AppTestCase):
+    """
+    Load test: N concurrent submits of one url against a real (sqlite) DB produce exactly one outbound fetch
+    """
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.fetches = 0
+
+    async def origin(self, request):
+        self.fetches += 1
+        await asyncio.sleep(0.05)
+        return httpx.Response(
+            200,
+            headers={"content-type": "text/html"},
+            text='<html><head><meta property="og:image" content="https://viral.com/img.jpg"></head></html>',
+        )
+
+    async def submit_many(self, n):
+        samples = SUBMIT_SCRAPE.count
+        responses = await asyncio.gather(
+            *(self.client.post("/api/submit", json={"url": "https://viral.com"}) for _ in range(n))
+        )
+        self.assertTrue(all(r.status_code == 200 for r in responses))
+        self.assertEqual({r.json()["image_url"] for r in responses}, {"https://viral.com/img.jpg"})
+        self.assertEqual(len({r.json()["id"] for r in responses}), 1)
+        # One latency sample per request, not per coalesced scrape
+        self.assertEqual(SUBMIT_SCRAPE.count, samples + n)
+
+    async def test_concurrent_submits_fetch_once(self):
+        await self.submit_many(100)
+        self.assertEqual(self.fetches, 1)
+
+    @patch("api.routes.SUBMIT_SINGLE_FLIGHT_REDIS_ENABLED", True)
+    async def test_concurrent_submits_fetch_once_with_redis_lock(self):
+        await self.submit_many(100)
+        self.assertEqual(self.fetches, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+from services.local_cache import local_cache
+from tests.app_test_case import AppTestCase
+
+
+class TestSubmitQueryCount(AppTestCase):
+    """
+    Statements run against the DB by one submit, per path
+    """
+    async def submit(self):
+        self.statements.clear()
+        response = await self.client.post("/api/submit", json={"url": "https://example.com"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["image_url"], "https://example.com/img.jpg")
+        return [statement.split()[0] for statement in self.statements]
+
+    async def test_new_url(self):
+        # lookup, insert returning the new row, scrape result returning the updated row
+        self.assertEqual(await self.submit(), ["SELECT", "INSERT", "UPDATE"])
+
+    async def test_db_hit(self):
+        await self.submit()
+        await self.redis.flushall()
+        local_cache.clear()
+        # An existing url is only read, not written
+        self.assertEqual(await self.submit(), ["SELECT"])
+
+    async def test_cache_hit(self):
+        await self.submit()
+        local_cache.clear()
+        self.assertEqual(await self.submit(), [])
+
+    async def test_no_schema_statements_per_scrape(self):
+        statements = await self.submit()
+        self.assertNotIn("PRAGMA", statements)
+        self.assertNotIn("CREATE", statements)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import httpx
+import unittest
+from database import crud
+from services.local_cache import local_cache
+from services.og_parser import OGHeadParser
+from services.url_normalizer import TrackingParams
+from services.url_normalizer import canonical_alias_target
+from services.url_normalizer import normalize_url
+from tests.app_test_case import AppTestCase
+
+
+class TestNormalizeURL(unittest.TestCase):
+    def test_variants_of_one_page(self):
+        for url in (
+            "https://site.com/a",
+            "https://SITE.com/a/",
+            "https://site.com/a?utm_source=x&utm_medium=email",
+            "https://site.com/a#frag",
+            "HTTPS://site.com:443/a?fbclid=123",
+            "  https://site.com/a  ",
+        ):
+            self.assertEqual(normalize_url(url), "https://site.com/a", url)
+
+    def test_query_sorted_by_name(self):
+        self.assertEqual(normalize_url("https://site.com/?b=2&a=1&a=0&gclid=x"), "https://site.com/?a=1&a=0&b=2")
+        self.assertEqual(normalize_url("https://site.com/s?q=a b&next=/p"), "https://site.com/s?next=/p&q=a+b")
+
+    def test_hosts_and_ports(self):
+        self.assertEqual(normalize_url("https://site.com"), "https://site.com/")
+        self.assertEqual(normalize_url("http://site.com:80/x"), "http://site.com/x")
+        self.assertEqual(normalize_url("http://site.com:8080/x"), "http://site.com:8080/x")
+        self.assertEqual(normalize_url("https://[::1]:443/"), "https://[::1]/")
+        self.assertEqual(normalize_url("https://bücher.de/"), "https://xn--bcher-kva.de/")
+        self.assertEqual(normalize_url("https://site.com/a/", strip_trailing_slash=False), "https://site.com/a/")
+
+    def test_unparsable_urls_kept(self):
+        for url in ("not a url", "ftp://site.com/a", "https://site.com:99999/"):
+            self.assertEqual(normalize_url(f" {url} "), url)
+
+    def test_tracking_params(self):
+        params = TrackingParams(["utm_*", "fbclid", " "])
+        self.assertIn("UTM_Campaign", params)
+        self.assertIn("fbclid", params)
+        self.assertNotIn("fbclid2", params)
+        self.assertNotIn("page", params)
+
+    def test_canonical_alias_target(self):
+        url = "https://site.com/a"
+        self.assertEqual(canonical_alias_target(url, "https://www.site.com/a/"), "https://www.site.com/a")
+        self.assertEqual(canonical_alias_target(url, "https://site.com/b"), "https://site.com/b")
+        self.assertIsNone(canonical_alias_target(url, "https://site.com/a/"))  # itself
+        self.assertIsNone(canonical_alias_target(url, "https://other.com/a"))
+        self.assertIsNone(canonical_alias_target(url, None))
+
+    def test_parser_reads_canonical(self):
+        parser = OGHeadParser(base_url="https://site.com/a/amp")
+        parser.feed('<html><head><link rel="canonical" href="/a"><link rel="canonical" href="/b"></head>')
+        self.assertEqual(parser.canonical_url, "https://site.com/a")
+
+
+class TestCanonicalAliases(AppTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.requests = []
+
+    def origin(self, request):
+        self.requests.append(str(request.url))
+        body = ('<html><head><link rel="canonical" href="https://site.com/article">'
+                '<meta property="og:image" content="/img.jpg"></head></html>')
+        return httpx.Response(200, headers={"content-type": "text/html"}, text=body)
+
+    async def submit(self, url):
+        response = await self.client.post("/api/submit", json={"url": url})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    async def test_alias_served_the_canonical_record(self):
+        first = await self.submit("https://site.com/article/amp?utm_source=feed")
+        self.assertEqual(first["url"], "https://site.com/article")
+        self.assertEqual(first["image_url"], "https://site.com/img.jpg")
+        self.assertEqual(await self.redis.get("og:alias:https://site.com/article/amp"), "https://site.com/article")
+
+        # Other variants of the alias and the canonical url itself are not scraped again
+        for url in ("https://SITE.com/article/amp/#top", "https://site.com/article?utm_campaign=x"):
+            self.assertEqual((await self.submit(url))["id"], first["id"])
+        self.assertEqual(self.requests, ["https://site.com/article/amp"])
+
+        # With the Redis keys gone, the alias row still leads to the canonical record
+        await self.redis.flushdb()
+        local_cache.clear()
+        self.assertEqual((await self.submit("https://site.com/article/amp"))["id"], first["id"])
+        self.assertEqual(await self.redis.get("og:alias:https://site.com/article/amp"), "https://site.com/article")
+        async with self.session_local() as session:
+            alias = await crud.get_url_entry_by_url(session, "https://site.com/article/amp")
+        self.assertEqual(alias.canonical_url, "https://site.com/article")
+        self.assertEqual(len(self.requests), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
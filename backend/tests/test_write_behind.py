@@ -0,0 +1,113 @@
+import asyncio
+import httpx
+import unittest
+from unittest.mock import patch
+from sqlalchemy import event
+from database.enums import URLStatus
+from database.models import URLRecord
+from services import og_scraper
+from services.local_cache import local_cache
+from services.metrics import WRITE_BEHIND_DROPPED
+from services.og_scraper import cache_key
+from services.og_scraper import process_og_url_entry
+from services.write_behind import WriteBehindBuffer
+from tests.app_test_case import AppTestCase
+
+
+class TestWriteBehindBuffer(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.batches = []
+
+        async def write(items):
+            self.batches.append(items)
+
+        self.write = write
+
+    async def test_flush_after_interval_last_write_wins(self):
+        buffer = WriteBehindBuffer(self.write, interval=0.02, max_records=100)
+        buffer.add(1, "a")
+        buffer.add(2, "b")
+        buffer.add(1, "c")
+        self.assertEqual(self.batches, [])
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.batches, [["b", "c"]])
+        await buffer.stop()
+
+    async def test_flush_when_full(self):
+        buffer = WriteBehindBuffer(self.write, interval=60, max_records=2)
+        for i in range(5):
+            buffer.add(i, i)
+        await asyncio.sleep(0.01)
+        self.assertEqual(self.batches[0], [0, 1])
+        # What is left is written on stop, not after the interval
+        await buffer.stop()
+        self.assertEqual(sum(self.batches, []), [0, 1, 2, 3, 4])
+        self.assertEqual(len(buffer), 0)
+
+    async def test_failed_batch_dropped(self):
+        async def write(items):
+            if items == ["bad"]:
+                raise RuntimeError("db down")
+            self.batches.append(items)
+
+        buffer = WriteBehindBuffer(write, interval=60, max_records=1)
+        dropped = WRITE_BEHIND_DROPPED.get()
+        with self.assertLogs("services.write_behind", "ERROR"):
+            buffer.add(1, "bad")
+            buffer.add(2, "good")
+            await buffer.stop()
+        self.assertEqual(self.batches, [["good"]])
+        self.assertEqual(WRITE_BEHIND_DROPPED.get(), dropped + 1)
+
+
+class TestScrapeWriteBehind(AppTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.start_patches(patch("services.og_scraper.WRITE_BEHIND_ENABLED", True))
+        self.commits = 0
+
+        def count_commit(conn):
+            self.commits += 1
+        event.listen(self.engine.sync_engine, "commit", count_commit)
+
+    def origin(self, request):
+        if request.url.host == "none.com":
+            return httpx.Response(404)
+        body = f'<html><head><title>{request.url.host}</title><meta property="og:image" content="/i.jpg"></head>'
+        return httpx.Response(200, headers={"content-type": "text/html"}, text=body)
+
+    async def asyncTearDown(self):
+        await og_scraper.close_write_behind()
+        await super().asyncTearDown()
+
+    async def test_results_written_in_one_flush(self):
+        urls = ["https://a.com/", "https://b.com/", "https://none.com/"]
+        async with self.session_local() as session:
+            entries = [URLRecord(url=url) for url in urls]
+            session.add_all(entries)
+            await session.commit()
+            commits = self.commits
+            results = [await process_og_url_entry(session, entry) for entry in entries]
+
+        # Returned and served from the local cache right away, not written yet
+        self.assertEqual(results[0].image_url, "https://a.com/i.jpg")
+        self.assertEqual(results[2].status, URLStatus.FAILED.value)
+        self.assertEqual(results[2].attempt_count, 1)
+        self.assertIsNotNone(local_cache.get(cache_key("https://b.com/")))
+        self.assertEqual(self.commits, commits)
+        self.assertIsNone(await self.redis.get(cache_key("https://a.com/")))
+
+        await og_scraper.close_write_behind()
+        self.assertEqual(self.commits, commits + 1)
+        async with self.session_local() as session:
+            stored = {record.url: record for record in [await session.get(URLRecord, e.id) for e in entries]}
+        self.assertEqual(stored["https://a.com/"].image_url, "https://a.com/i.jpg")
+        self.assertEqual(stored["https://b.com/"].title, "b.com")
+        self.assertEqual(stored["https://none.com/"].status, URLStatus.FAILED.value)
+        self.assertIsNotNone(stored["https://none.com/"].next_retry_at)
+        self.assertIn('"image_url":"https://a.com/i.jpg"', await self.redis.get(cache_key("https://a.com/")))
+        self.assertGreater(await self.redis.ttl(cache_key("https://none.com/")), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
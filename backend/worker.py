@@ -0,0 +1,47 @@
+import asyncio
+import logging
+import signal
+from database.session import init_db
+from services.http_client import close_http_client
+from services.http_client import open_http_client
+from services.local_cache import cache_invalidator
+from services.og_scraper import close_write_behind
+from services.parse_pool import close_parse_pool
+from services.scrape_queue import RedisScrapeQueue
+from services.scrape_queue import ScrapeWorkerPool
+from settings import REDIS_CLIENT
+
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(name)s: %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+
+
+async def run():
+    """
+    Standalone scrape worker process draining the Redis scrape queue until SIGINT/SIGTERM
+    """
+    await init_db()
+    await open_http_client()
+    # Listening also turns on publishing, so the API workers drop their local copy of re-scraped urls
+    cache_invalidator.start()
+    pool = ScrapeWorkerPool(RedisScrapeQueue(REDIS_CLIENT))
+    pool.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+
+    await pool.stop()
+    await close_write_behind()
+    await cache_invalidator.stop()
+    await close_http_client()
+    close_parse_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
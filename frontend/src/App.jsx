@@ -1,6 +1,6 @@
 // src/App.jsx
 import { useEffect, useState } from "react";
-import { submitURL, getHistory } from "./api";
+import { submitURL, getHistory, imageURL } from "./api";
 import "./App.css";
 
 function App() {
@@ -80,8 +80,14 @@ function App() {
                 {entry.url}
               </a>
             </p>
+            {entry.title && (
+              <p>
+                <strong>{entry.site_name ? `${entry.site_name}: ` : ""}{entry.title}</strong>
+              </p>
+            )}
+            {entry.description && <p>{entry.description}</p>}
             {entry.image_url && (
-              <img src={entry.image_url} alt="Preview" className="preview-image" />
+              <img src={imageURL(entry.id)} alt="Preview" className="preview-image" loading="lazy" />
             )}
           </div>
         ))}
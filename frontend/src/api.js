@@ -9,6 +9,10 @@ export async function submitURL(url) {
     return res.json();
 }
 
+export function imageURL(id) {
+    return `${API_BASE}/image/${id}`;
+}
+
 export async function getHistory(cursor = null, limit = 10) {
     const params = new URLSearchParams({ limit });
     if (cursor) {